@@ -84,6 +84,10 @@ class Config(pw.Config):
     MAX_PREVIEW_FILE_SIZE = float(_get("MAX_PREVIEW_FILE_SIZE", DEFAULT_MAX_PREVIEW_FILE_SIZE,
                                        description="Maximum size (MB) of files to visualize in the file browser preview."))
 
+    IMAGE_CACHE_SIZE = float(_get("SCIPION_IMAGE_CACHE_SIZE", DEFAULT_IMAGE_CACHE_SIZE,
+                                  description="Maximum size (MB) of the images kept in memory by each process "
+                                              "after reading them (e.g. in the viewers).", source="pwem"))
+
     # OLD CHIMERA variable
     CHIMERA_OLD_BINARY_PATH = _get("CHIMERA_OLD_BINARY_PATH",'',
                                    description="Path to the Chimera OLD binary program (not the folder). Will only "
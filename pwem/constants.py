@@ -194,6 +194,7 @@ FREQ_BANDPASS_WIZ_MSG =\
 EM_ROOT_VAR = 'EM_ROOT'
 
 DEFAULT_MAX_PREVIEW_FILE_SIZE = 500  # Unit is MB: 500 MB
+DEFAULT_IMAGE_CACHE_SIZE = 1024  # Unit is MB: 1 GB
 
 RESIDUES3TO1 = {'CYS': 'C', 'ASP': 'D', 'SER': 'S', 'GLN': 'Q', 'LYS': 'K',
                 'ILE': 'I', 'PRO': 'P', 'THR': 'T', 'PHE': 'F', 'ASN': 'N',
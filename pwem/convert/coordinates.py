@@ -0,0 +1,110 @@
+# **************************************************************************
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module helps to find close 2D coordinates (e.g. picked particles)
+within each micrograph, using a KD-tree instead of comparing all pairs.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class CoordinatesIndex:
+    """ Spatial index (KD-tree) of the (x, y) positions of the coordinates
+    of one micrograph.
+
+    Distances are euclidean, or the maximum of the x and y distances when
+    box=True. With strict=True only distances smaller than the radius are
+    considered close, otherwise also the ones equal to it.
+    """
+    def __init__(self, positions):
+        """
+        :param positions: array-like of shape (N, 2) with the x, y values
+        """
+        self._positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self._tree = cKDTree(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    @staticmethod
+    def _queryArgs(radius, strict, box):
+        """ Returns the radius and the Minkowski norm (p) used by the tree """
+        p = np.inf if box else 2
+        return (np.nextafter(radius, 0) if strict else radius), p
+
+    def hasNeighbours(self, positions, radius, strict=False, box=False):
+        """ Returns a boolean array telling which of the given positions
+        have any indexed coordinate close to them. """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        if not len(self) or (strict and radius <= 0):
+            return np.zeros(len(positions), dtype=bool)
+        r, p = self._queryArgs(radius, strict, box)
+        counts = self._tree.query_ball_point(positions, r, p=p, return_length=True)
+        return np.asarray(counts) > 0
+
+    def closePairs(self, radius, strict=False, box=False):
+        """ Returns an (M, 2) array with the indexes (i < j) of all the pairs
+        of indexed coordinates close to each other, sorted. """
+        if strict and radius <= 0:
+            return np.empty((0, 2), dtype=int)
+        r, p = self._queryArgs(radius, strict, box)
+        pairs = self._tree.query_pairs(r, p=p, output_type='ndarray')
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def readPositions(inputSet, xAttr='_x', yAttr='_y', micAttrs='_micId'):
+    """ Read the ids, micrograph ids and positions of the items of a set,
+    sorted by id, without building the items.
+
+    :param inputSet: set of coordinates, particles...
+    :param xAttr: attribute with the x position (i.e. '_coordinate._x')
+    :param yAttr: attribute with the y position
+    :param micAttrs: attribute with the micrograph id, or a list of them
+        where the first not None value is used
+    :returns ids and micIds arrays and an (N, 2) array of positions
+    """
+    micAttrs = [micAttrs] if isinstance(micAttrs, str) else list(micAttrs)
+    rows = inputSet.getColumnValues(['id', xAttr, yAttr] + micAttrs)
+    if not rows:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty((0, 2))
+
+    values = list(zip(*rows))
+    ids = np.array(values[0], dtype=int)
+    positions = np.array(values[1:3], dtype=float).T
+    micIds = [next((m for m in mics if m is not None), -1) for mics in zip(*values[3:])]
+    return ids, np.array(micIds, dtype=int), positions
+
+
+def groupByMicrograph(micIds):
+    """ Yields (micId, indexes) with the indexes (sorted) of the given
+    micIds array with the same value. """
+    micIds = np.asarray(micIds)
+    if micIds.size == 0:
+        return
+    order = np.argsort(micIds, kind='stable')
+    sortedMics = micIds[order]
+    starts = np.flatnonzero(np.r_[True, sortedMics[1:] != sortedMics[:-1]])
+    for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+        yield sortedMics[start], order[start:end]
@@ -171,6 +171,9 @@ class Ccp4Header:
     def setMode(self, mode):
         self._header['Mode'] = mode
 
+    def getMode(self):
+        return self._header['Mode']
+
     def setStartPixel(self, originTransformShift):  # PIXEL
         """input pixels"""
         self._header['originX'] = 0.  # originTransformShift[0]
@@ -197,7 +197,8 @@ class SymmetryHelper:
     """ This is a static class so there is no need to instantiate it. 
         Given a symmetry the class provides methods to "move" projection
         directions to the equivalent orientation that lays within the unit
-        cells defined at https://scipion-em.github.io/docs/release-3.0.0/docs/developer/symmetries/symmetries.html?highlight=symmetry."""
+        cells defined at
+        https://scipion-em.github.io/docs/release-3.0.0/docs/developer/symmetries/symmetries.html?highlight=symmetry."""
 
     # Dictionary to cache all the symmetry matrices and unit cell 
     # planes for a particular symmetry
@@ -260,33 +261,74 @@ class SymmetryHelper:
             :param matrixSet: value returned when calling getSymmetryMatrices with the right symmetry and order
             :param unitCellPlanes: second term returned by getUnitCell when called with the right symmetry and order
             """
-        # get projection direction
-        colunm = particle.getTransform().getMatrix()[0:3, 2]
-        u, v, w = unitCellPlanes
-
-        if (np.dot(colunm, u) > 0) and \
-           (np.dot(colunm, v) > 0) and \
-           (np.dot(colunm, w) > 0):
-            # particle is inside unit cell so nothing needs to be done
+        t = particle.getTransform()
+        matrices, found = cls._moveTransformsInsideUnitCell(
+            np.array([t.getMatrix()]), matrixSet, unitCellPlanes)
+
+        if found[0]:
+            t.setMatrix(matrices[0])
+            particle.setTransform(t)
             return particle
-        else:
-            # loop over symmetry matrices
-            for i, matrix in enumerate(matrixSet):
-                matrix3 = np.array(matrix)
-                matrix3 = np.delete(matrix3, -1, 1)
-                columPrime = matrix3.dot(colunm)[:3]
-                if (np.dot(columPrime, u) > 0) and \
-                   (np.dot(columPrime, v) > 0) and \
-                   (np.dot(columPrime, w) > 0):
-                    matrix = np.dot(matrix, particle.getTransform().getMatrix())
-                    t = particle.getTransform()
-                    t.setMatrix(matrix)
-                    particle.setTransform(t)
-                    return particle
 
-            logger.info("Error: something went wrong in moveParticlesInsideUnitCell."
-                        " No matrix found to move the particle projection direction inside the unit cell."
-                        "       particle id: %s" % particle.getObjId())
+        logger.info("Error: something went wrong in moveParticlesInsideUnitCell."
+                    " No matrix found to move the particle projection direction inside the unit cell."
+                    "       particle id: %s" % particle.getObjId())
+
+    @classmethod
+    def moveTransformsInsideUnitCell(cls, matrices, symmetry, symmetryOrder):
+        """ Batch version of moveParticleInsideUnitCell working on an array of
+        transformation matrices of shape (N, 4, 4), like the one returned by
+        SetOfImages.getTransformMatrices.
+
+        :param matrices: transformation matrices to move.
+        :param symmetry: symmetry type in scipion's convention.
+        :param symmetryOrder: order of the symmetry
+        :return: a tuple with the moved matrices and a boolean array that is
+            False for the matrices that could not be moved inside the unit cell.
+        """
+        matrices = np.asarray(matrices, dtype=float)
+
+        # For C1 particles we do not move angles to unit cell.
+        if symmetry == cts.SYM_CYCLIC and symmetryOrder == 1:
+            logger.debug("Cancelling unit cell migration due to C1 symmetry.")
+            return matrices.copy(), np.ones(len(matrices), dtype=bool)
+
+        matrixSet, unitCellPlanes = cls.getSymmetryMatricesAndPlanes(symmetry, symmetryOrder)
+        return cls._moveTransformsInsideUnitCell(matrices, matrixSet, unitCellPlanes)
+
+    @classmethod
+    def _moveTransformsInsideUnitCell(cls, matrices, matrixSet, unitCellPlanes, chunkSize=20000):
+        """ Move the projection directions of the matrices (N, 4, 4) inside the unit cell.
+        For each matrix, the first symmetry matrix that takes its projection direction
+        inside the unit cell is applied, as _moveParticleInsideUnitCell does.
+        Matrices are processed in chunks of chunkSize to bound the memory used.
+        """
+        matrixSet = np.asarray(matrixSet, dtype=float)
+        # Symmetry rotations and unit cell planes stacked once: (S, 3, 3) and (3, 3)
+        rotations = matrixSet[:, :3, :3]
+        planes = np.array(unitCellPlanes, dtype=float)[:3, :3]
+
+        moved = np.array(matrices, dtype=float)
+        found = np.zeros(len(moved), dtype=bool)
+
+        for first in range(0, len(moved), chunkSize):
+            chunk = moved[first:first + chunkSize]
+            # get projection directions (N, 3)
+            columns = chunk[:, 0:3, 2]
+
+            # particles inside unit cell need nothing to be done
+            inside = np.all(columns @ planes.T > 0, axis=1)
+
+            # Projection directions after each symmetry matrix (N, S, 3)
+            columnsPrime = np.einsum('sij,nj->nsi', rotations, columns)
+            valid = np.all(columnsPrime @ planes.T > 0, axis=2)
+
+            toMove = ~inside & valid.any(axis=1)
+            symIndex = valid.argmax(axis=1)[toMove]
+            chunk[toMove] = matrixSet[symIndex] @ chunk[toMove]
+            found[first:first + chunkSize] = inside | toMove
+
+        return moved, found
 
 
 def moveParticlesInsideUnitCell(setIN, setOUT, sym=cts.SYM_CYCLIC, n=1):
@@ -294,19 +336,26 @@ def moveParticlesInsideUnitCell(setIN, setOUT, sym=cts.SYM_CYCLIC, n=1):
     to symmetry sym.
     This function (1) gets the symmetry matrices and (2) applies them to
          each projection direction until is inside the unit cell.
+    Particles that can not be moved inside the unit cell are not added to setOUT.
     """
-    counter = 0  # counter for the number of particles
-    totalNumberOfParticles = len(setIN)
-    # for each particle in set
-    for par in setIN:
-        counter += 1
+    # All the transformations are read and moved at once
+    _, matrices = setIN.getTransformMatrices()
+    matrices, found = SymmetryHelper.moveTransformsInsideUnitCell(matrices, sym, n)
+
+    totalNumberOfParticles = len(matrices)
+    # for each particle in set, in the same (id) order as the matrices
+    for counter, par in enumerate(setIN.iterItems(orderBy='id'), 1):
         if counter % 1000 == 0:
             # print something to keep the user engaged
             logger.info(f"{counter}/{totalNumberOfParticles}")
 
-        particle = SymmetryHelper.moveParticleInsideUnitCell(par, sym, n)
-        if particle:
-            setOUT.append(particle)
+        if found[counter - 1]:
+            par.getTransform().setMatrix(matrices[counter - 1])
+            setOUT.append(par)
+        else:
+            logger.info("Error: something went wrong in moveParticlesInsideUnitCell."
+                        " No matrix found to move the particle projection direction inside the unit cell."
+                        "       particle id: %s" % par.getObjId())
 
 
 def moveParticleInsideUnitCell(particle, matrixSet, unitCellPlanes):
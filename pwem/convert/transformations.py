@@ -1162,6 +1162,69 @@ def euler_from_matrix(matrix, axes='sxyz'):
     return ax, ay, az
 
 
+def euler_from_matrices(matrices, axes='sxyz'):
+    """Return arrays of Euler angles from a stack of rotation matrices.
+
+    Vectorized version of euler_from_matrix for an array of shape (N, 3, 3)
+    or (N, 4, 4). Returns three arrays of N angles in radians.
+
+    >>> angles = (4*math.pi) * (np.random.random((10, 3)) - 0.5)
+    >>> R = np.array([euler_matrix(axes='szyz', *a) for a in angles])
+    >>> al, be, ga = euler_from_matrices(R, 'szyz')
+    >>> for a, b, g, r in zip(al, be, ga, R):
+    ...    if not np.allclose(euler_from_matrix(r, 'szyz'), (a, b, g)): print("failed")
+
+    """
+    try:
+        firstaxis, parity, repetition, frame = _AXES2TUPLE[axes.lower()]
+    except (AttributeError, KeyError):
+        _TUPLE2AXES[axes]  # validation
+        firstaxis, parity, repetition, frame = axes
+
+    i = firstaxis
+    j = _NEXT_AXIS[i + parity]
+    k = _NEXT_AXIS[i - parity + 1]
+
+    M = np.asarray(matrices, dtype=np.float64)[:, :3, :3]
+    if repetition:
+        sy = np.sqrt(M[:, i, j] * M[:, i, j] + M[:, i, k] * M[:, i, k])
+        regular = sy > _EPS
+        ax = np.where(regular, np.arctan2(M[:, i, j], M[:, i, k]),
+                      np.arctan2(-M[:, j, k], M[:, j, j]))
+        ay = np.arctan2(sy, M[:, i, i])
+        az = np.where(regular, np.arctan2(M[:, j, i], -M[:, k, i]), 0.0)
+    else:
+        cy = np.sqrt(M[:, i, i] * M[:, i, i] + M[:, j, i] * M[:, j, i])
+        regular = cy > _EPS
+        ax = np.where(regular, np.arctan2(M[:, k, j], M[:, k, k]),
+                      np.arctan2(-M[:, j, k], M[:, j, j]))
+        ay = np.arctan2(-M[:, k, i], cy)
+        az = np.where(regular, np.arctan2(M[:, j, i], M[:, i, i]), 0.0)
+
+    if parity:
+        ax, ay, az = -ax, -ay, -az
+    if frame:
+        ax, az = az, ax
+    return ax, ay, az
+
+
+def euler_direction(rot, tilt):
+    """Return the x, y, z arrays of the projection directions given by
+    arrays of rot and tilt Euler angles in degrees (ZYZ convention).
+
+    Same as the third row of the Euler matrix, psi does not change it.
+
+    >>> x, y, z = euler_direction([0, 90], [0, 90])
+    >>> np.allclose(x, [0, 0]) and np.allclose(y, [0, 1]) and np.allclose(z, [1, 0])
+    True
+
+    """
+    rot = np.radians(np.asarray(rot, dtype=np.float64))
+    tilt = np.radians(np.asarray(tilt, dtype=np.float64))
+    sinTilt = np.sin(tilt)
+    return np.cos(rot) * sinTilt, np.sin(rot) * sinTilt, np.cos(tilt)
+
+
 def euler_from_quaternion(quaternion, axes='sxyz'):
     """Return Euler angles from quaternion for specified axis sequence.
 
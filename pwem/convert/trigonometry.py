@@ -14,54 +14,63 @@ class FibonacciSphere:
         self.weights = np.zeros(len(self.sphX))
 
     def append(self, x,y,z):
+        """ Adds one to the weight of the sphere point closest to x, y, z """
+        self.appendMany([[x, y, z]])
+
+    def appendMany(self, xyz, chunkSize=50000):
+        """ Adds one to the weight of the sphere point closest to each of
+        the directions in xyz, an array-like of shape (N, 3).
+
+        Only the points in a z band around each direction are compared,
+        in chunks of chunkSize directions to bound the memory used.
+        """
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
 
         # z is a linear space array from -1 to 1
         # In a simple case for num_points= 100
         # z = [1/100-1, ... 1/100+1]
+        numPoints = self.num_points - 1
+        offsets = np.arange(-self.searchRange, self.searchRange)
+        sphX = np.asarray(self.sphX)
+        sphY = np.asarray(self.sphY)
 
-        # z index
-        zIndex = round((z*self.half_points)-1 +(self.half_points)) # + 1 
-        numPoints = self.num_points-1
-        if zIndex < 0:
-            zIndex = 0
-        elif zIndex > numPoints:
-            zIndex = numPoints
+        for first in range(0, len(xyz), chunkSize):
+            chunk = xyz[first:first + chunkSize]
+            x, y, z = chunk[:, 0:1], chunk[:, 1:2], chunk[:, 2]
 
-        zMin = max(zIndex-self.searchRange, 0)
-        zMax = min(zIndex + self.searchRange, numPoints)
+            # z index
+            zIndex = np.clip(np.rint(z * self.half_points - 1 + self.half_points),
+                             0, numPoints).astype(int)
+            zMax = np.minimum(zIndex + self.searchRange, numPoints)
 
-        distance = 4 # way maximun distance
-        finalIndex = -1
+            # Candidate indexes of the z band, out of range ones get infinite distance
+            indexes = zIndex[:, None] + offsets
+            valid = (indexes >= 0) & (indexes < zMax[:, None])
+            indexes = np.clip(indexes, 0, numPoints)
 
-        # x, y , go through the sphere
-        for index in range(zMin,zMax):
-            xSph = self.sphX[index]
-            ySph = self.sphY[index]
+            distances = (sphX[indexes] - x) ** 2 + (sphY[indexes] - y) ** 2
+            distances[~valid] = np.inf
 
-            newDist = (xSph-x)**2 + (ySph-y)**2
+            # x, y , closest point of the band
+            closest = np.argmin(distances, axis=1)
+            finalIndex = indexes[np.arange(len(chunk)), closest]
+            # way maximun distance, falls back to the last point
+            finalIndex[distances[np.arange(len(chunk)), closest] >= 4] = numPoints
 
-            if newDist < distance:
-                finalIndex = index
-                distance = newDist
-
-        # Add one to the final weight
-        self.weights[finalIndex] = self.weights[finalIndex]+1
+            # Add one to the final weights
+            self.weights += np.bincount(finalIndex, minlength=self.num_points)
 
     def cleanWeights(self):
+        """ Keeps only the sphere points with weight as numpy arrays """
+        weights = np.asarray(self.weights)
+        nonZero = weights != 0
 
-        X, Y, Z, W = [],[],[],[]
-
-        for x,y,z,w in zip(self.sphX, self.sphY, self.sphZ, self.weights):
-            if w != 0:
-                X.append(x)
-                Y.append(y)
-                Z.append(z)
-                W.append(w)
+        self.sphX = np.asarray(self.sphX)[nonZero]
+        self.sphY = np.asarray(self.sphY)[nonZero]
+        self.sphZ = np.asarray(self.sphZ)[nonZero]
+        self.weights = weights[nonZero]
 
-        self.sphX = X
-        self.sphY = Y
-        self.sphZ = Z
-        self.weights = W
+        return self.sphX, self.sphY, self.sphZ, self.weights
 
     @staticmethod
     def fibonacci_sphere(num_points: int = 5000):
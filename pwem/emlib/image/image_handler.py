@@ -281,15 +281,44 @@ class ImageHandler(object):
 
         return lib.compareTwoImageTolerance(loc1, loc2, tolerance)
 
-    def computeAverage(self, inputSet):
+    def computeAverage(self, inputSet, std=False, processes=1):
         """ Compute the average image either from filename or set.
         If inputSet is a filename, we will read the whole stack
         and compute the average from all images.
         If inputSet is a SetOfImages subclass, we will iterate
         and compute the average from all images.
+        2D images of formats that can be read by slices are averaged with
+        ImageReadersRegistry.averageLocations, using several processes if
+        processes > 1. If std is True, the standard deviation image is also
+        computed (only in that case) and (avgImage, stdImage) is returned.
         """
         if isinstance(inputSet, str):
             _, _, _, n = self.getDimensions(inputSet)
+            locations = [(i, inputSet) for i in range(1, (n or 0) + 1)]
+        else:
+            n = inputSet.getSize()
+            locations = None
+            if n and hasattr(inputSet, 'getColumnValues'):
+                locations = inputSet.getColumnValues(['_index', '_filename'])
+
+        if n and locations and self._canAverageLocations(locations):
+            # Remove format suffixes as in image.mrc:mrcs
+            locations = [(index, fn.split(':')[0]) for index, fn in locations]
+            mean, variance = ImageReadersRegistry.averageLocations(
+                locations, variance=std, processes=processes)
+            avgImage = self._imgClass()
+            avgImage.setData(mean.astype(numpy.float32))
+            if std:
+                stdImage = self._imgClass()
+                stdImage.setData(numpy.sqrt(variance).astype(numpy.float32))
+                return avgImage, stdImage
+            return avgImage
+
+        if std:
+            raise Exception("The standard deviation can only be computed for "
+                            "2D images that can be read by slices")
+
+        if isinstance(inputSet, str):
             if n:
                 avgImage = self.read((1, inputSet))
 
@@ -300,7 +329,6 @@ class ImageHandler(object):
                 avgImage.inplaceDivide(n)
                 return avgImage
         else:
-            n = inputSet.getSize()
             if n:
                 imageIter = iter(inputSet)
                 img = next(imageIter)
@@ -315,6 +343,22 @@ class ImageHandler(object):
 
         return None
 
+    @classmethod
+    def _canAverageLocations(cls, locations):
+        """ Return True if the (index, filename) locations are 2D images of
+        files that can be read by slices """
+        for fn in {fn for _, fn in locations}:
+            if ':mrc' in fn and ':mrcs' not in fn:
+                return False  # Volumes
+            fn = fn.split(':')[0]
+            reader = ImageReadersRegistry.getReader(fn)
+            if not reader.canOpenSlices():
+                return False
+            _, _, z, _ = reader.probe(fn)[0]
+            if z != 1:
+                return False
+        return True
+
     def invertStack(self, inputFn, outputFn):
         # get input dim
         (x, y, z, n) = lib.getImageSize(inputFn)
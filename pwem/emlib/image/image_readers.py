@@ -1,7 +1,9 @@
 import enum
 import os
 import struct
-from functools import lru_cache
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Union, Tuple, List, Optional
 
 import numpy
@@ -14,7 +16,7 @@ from ncempy.io import dm
 import pwem.constants as emcts
 from pyworkflow.utils import cyanStr, redStr
 from .. import lib
-from scipy.ndimage import rotate, shift
+from scipy.ndimage import rotate, shift, affine_transform
 from skimage.transform import rescale
 
 
@@ -183,6 +185,43 @@ class ImageStack:
 
         return cls.shiftSlice(cls.rotateSlice(npImage, angle, mode=mode, bg=bg), shifts, bg=bg)
 
+    @classmethod
+    def transformMatrixSlice(cls, npImage: numpy.ndarray, matrix, wrap=True) -> numpy.ndarray:
+        """ Apply a Scipion transformation matrix to the image, see transformMatrixSlices """
+        return cls.transformMatrixSlices(npImage[None], np.asarray(matrix)[None], wrap=wrap)[0]
+
+    @classmethod
+    def transformMatrixSlices(cls, npImages: numpy.ndarray, matrices, wrap=True, out=None) -> numpy.ndarray:
+        """ Apply the 2D part of Scipion transformation matrices (N, 4, 4) or (N, 3, 3) to the
+        images (N, Y, X), as Image.applyTransforMatScipion does: each matrix maps the input
+        coordinates, relative to the image center, to the output ones. Images are interpolated
+        with cubic B-splines, wrapping around the borders if wrap is True (zero outside otherwise).
+        :param out: optional array (N, Y, X) where the images are written
+        """
+        matrices = np.asarray(matrices, dtype=float)
+        n = len(npImages)
+        direct = np.tile(np.eye(3), (n, 1, 1))
+        direct[:, :2, :2] = matrices[:, :2, :2]
+        direct[:, :2, 2] = matrices[:, :2, -1]
+        inverse = np.linalg.inv(direct)
+        # Output to input mapping in (row, column) order
+        rowCol = [1, 0]
+        rotations = inverse[:, rowCol][:, :, rowCol]
+        center = np.array(npImages.shape[1:]) // 2
+        offsets = center - rotations @ center + inverse[:, rowCol, 2]
+        identities = np.all(np.isclose(direct, np.eye(3)), axis=(1, 2))
+
+        if out is None:
+            out = np.empty(npImages.shape, dtype=np.float32)
+        mode = 'grid-wrap' if wrap else 'constant'
+        for i in range(n):
+            if identities[i]:
+                out[i] = npImages[i]
+            else:
+                affine_transform(npImages[i], rotations[i], offset=offsets[i], output=out[i],
+                                 order=3, mode=mode, cval=0.)
+        return out
+
     @classmethod
     def scaleSlice(cls, npImage, factors, anti_aliasing=True):
         """ Scales the npImage by the factor/s
@@ -320,6 +359,16 @@ class ImageReader:
         """ Opens a specific slice"""
         raise NotImplementedError("Image reader %s does not implement 'openSlice' method." % cls.__name__)
 
+    @classmethod
+    def openSlices(cls, path, slices):
+        """ Opens several slices (1-based) of the file as an array (N, Y, X) """
+        if cls.canOpenSlices():
+            return numpy.stack([cls.openSlice(path, s) for s in slices])
+        data = cls.open(path)
+        if data.ndim == 2:
+            data = data[None]
+        return data[numpy.asarray(slices) - 1]
+
     @staticmethod
     def getCompatibleExtensions() -> list:
         """ Returns a list of the compatible extensions the reader can handle"""
@@ -330,6 +379,12 @@ class ImageReader:
         """ Returns the dimensions [X,Y,Z,N] of the file"""
         pass
 
+    @classmethod
+    def probe(cls, filePath):
+        """ Returns the dimensions [X,Y,Z,N] and the numpy data type (None if
+        unknown) of the file. Readers that can, read only the file header. """
+        return cls.getDimensions(filePath), None
+
     @staticmethod
     def write(images: ImageStack, fileName: str, isStack: bool) -> None:
         """ Generate a stack of images or a volume from a list of PIL images.
@@ -340,9 +395,102 @@ class ImageReader:
         logger.warning("write method not implemented. Cannot write %s" % fileName)
 
 
+class ImageCache:
+    """ LRU cache of the images read, bounded by their size in bytes.
+    Whole files and slices are stored separately: slices of a cached whole
+    file are served from it, and caching a whole file drops its slices.
+    Views (e.g. memory mapped MRC slices) are copied when cached, so the
+    bound is on resident memory and the cache does not keep files mapped. """
+
+    def __init__(self, maxBytes):
+        self._maxBytes = maxBytes
+        self._entries = OrderedDict()  # {(path, mtime, sliceIndex): numpy array}, sliceIndex is None for whole files
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def getMaxBytes(self):
+        return self._maxBytes
+
+    def setMaxBytes(self, maxBytes):
+        """ Change the cache size, evicting entries if needed """
+        with self._lock:
+            self._maxBytes = maxBytes
+            self._evict()
+
+    def getBytes(self):
+        """ Returns the bytes used by the cached images """
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, mtime, sliceIndex=None):
+        """ Returns the cached image (whole file or slice) or None """
+        with self._lock:
+            wholeKey = (path, mtime, None)
+            data = self._entries.get(wholeKey)
+            if data is not None:
+                self._entries.move_to_end(wholeKey)
+                if sliceIndex is not None:
+                    data = data if data.ndim == 2 else data[sliceIndex - 1]
+            elif sliceIndex is not None:
+                key = (path, mtime, sliceIndex)
+                data = self._entries.get(key)
+                if data is not None:
+                    self._entries.move_to_end(key)
+
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def put(self, path, mtime, data, sliceIndex=None):
+        """ Cache the image unless it does not fit in the cache """
+        nbytes = data.nbytes
+        if nbytes > self._maxBytes:
+            return
+        if not data.flags.owndata:
+            data = np.array(data)
+        with self._lock:
+            # Drop previous versions of the file, or its slices if caching the whole file
+            for key in [k for k in self._entries
+                        if k[0] == path and (k[1] != mtime or sliceIndex is None)]:
+                self._bytes -= self._entries.pop(key).nbytes
+            key = (path, mtime, sliceIndex)
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key).nbytes
+            self._entries[key] = data
+            self._bytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self._maxBytes and self._entries:
+            _, data = self._entries.popitem(last=False)
+            self._bytes -= data.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def getStats(self):
+        """ Returns a dictionary with the cache counters """
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), bytes=self._bytes, maxBytes=self._maxBytes)
+
+
 class ImageReadersRegistry:
     """ Class to register image readers to provide basic information about an image like dimensions or getting an image"""
     _readers = dict()  # Dictionary to hold the readers. The key is the extension
+    _cache = None  # ImageCache of the images read, see getCache
+    _probes = OrderedDict()  # Probed headers by path, see probe
+    _probesLock = threading.Lock()
+    PROBES_CACHE_SIZE = 100000
 
     @classmethod
     def addReader(cls, imageReader: ImageReader):
@@ -367,6 +515,94 @@ class ImageReadersRegistry:
 
         return reader
 
+    @classmethod
+    def getCache(cls) -> ImageCache:
+        """ Returns the cache of the images read by this process. Its size is
+        set by SCIPION_IMAGE_CACHE_SIZE (MB) and can be changed with setCacheSize """
+        if cls._cache is None:
+            from pwem import Config
+            cls._cache = ImageCache(int(Config.IMAGE_CACHE_SIZE * 1024 * 1024))
+        return cls._cache
+
+    @classmethod
+    def setCacheSize(cls, maxBytes):
+        """ Set the maximum bytes of images cached by this process """
+        cls.getCache().setMaxBytes(maxBytes)
+
+    @classmethod
+    def probe(cls, filePath):
+        """ Returns the dimensions (x, y, z, n) and the data type of the file,
+        see ImageReader.probe. Results are cached by path, file size and
+        modification time, so this is meant for files that are not rewritten
+        in place, i.e. files being imported. """
+        stat = os.stat(filePath.split(':')[0])
+        key = (stat.st_size, stat.st_mtime_ns)
+
+        with cls._probesLock:
+            cached = cls._probes.get(filePath)
+            if cached is not None and cached[0] == key:
+                cls._probes.move_to_end(filePath)
+                return cached[1]
+
+        result = cls.getReader(filePath).probe(filePath)
+
+        with cls._probesLock:
+            cls._probes[filePath] = (key, result)
+            cls._probes.move_to_end(filePath)
+            while len(cls._probes) > cls.PROBES_CACHE_SIZE:
+                cls._probes.popitem(last=False)
+        return result
+
+    @classmethod
+    def probeMany(cls, filePaths, threads=None):
+        """ Probe the files concurrently with a pool of threads, see probe.
+        Returns the list of results, with None for the files that could not
+        be probed. """
+        def _probe(filePath):
+            try:
+                return cls.probe(filePath)
+            except Exception as e:
+                logger.debug("Could not probe %s: %s" % (filePath, e))
+                return None
+
+        with ThreadPoolExecutor(threads) as executor:
+            return list(executor.map(_probe, filePaths))
+
+    @classmethod
+    def averageLocations(cls, locations, variance=False, chunkSize=128, processes=1):
+        """ Average of the 2D images in locations, a list of (index, path) pairs.
+        Images are read grouped by file, in chunks of consecutive slices, and
+        accumulated in float64. Chunks are split among several processes if
+        processes > 1, and their partial results reduced at the end.
+
+        Returns the mean and, if variance is True, the (population) variance
+        images as float64 arrays, otherwise None as variance.
+        """
+        groups = OrderedDict()
+        for index, path in locations:
+            groups.setdefault(path, []).append(index or 1)
+
+        chunks = []
+        for path, indices in groups.items():
+            indices.sort()
+            chunks.extend((path, indices[start:start + chunkSize])
+                          for start in range(0, len(indices), chunkSize))
+
+        if processes > 1 and len(chunks) > 1:
+            step = -(-len(chunks) // processes)
+            parts = [chunks[start:start + step] for start in range(0, len(chunks), step)]
+            with ProcessPoolExecutor(len(parts)) as executor:
+                partials = list(executor.map(_accumulateSlices, parts,
+                                             [variance] * len(parts)))
+        else:
+            partials = [_accumulateSlices(chunks, variance)]
+
+        n, mean, m2 = 0, None, None
+        for partial in partials:
+            n, mean, m2 = _combineMoments((n, mean, m2), partial)
+
+        return mean, (m2 / n if variance and n else None)
+
     @classmethod
     def open(cls, filePath) -> ImageStack:
         """
@@ -387,14 +623,15 @@ class ImageReadersRegistry:
         return cls._openInternal(filePath, mTime)
 
     @classmethod
-    @lru_cache
     def _openInternal(cls, filePath, mtime) -> ImageStack:
         """
-        Internal method that performs the actual image loading and is cached.
+        Internal method that performs the actual image loading, using the
+        image cache.
 
         This method handles slicing requests if the reader supports it. If not,
         it loads the entire image stack and extracts the requested slice manually.
         The cache is tied to both filePath and mTime to ensure consistency when files change.
+        Slices are served from the whole file when it is already cached.
 
         Parameters:
             filePath (str): Path to the image file. May include a slice index prefix ('N@path').
@@ -404,29 +641,36 @@ class ImageReadersRegistry:
             ImageStack: The loaded image data.
         """
 
-        logger.debug(f"Reading image file {filePath}")
         parts = filePath.split("@")
 
         filePath = parts[-1]
+        sliceIndex = int(parts[0]) if len(parts) == 2 else None
+        cache = cls.getCache()
+
+        data = cache.get(filePath, mtime, sliceIndex)
+        if data is not None:
+            return ImageStack(data)
 
+        logger.debug(f"Reading image file {filePath}")
         # Get the reader that deals with the file extension.
         imageReader = cls.getReader(filePath)
 
         # If requesting a slice 1@ppath/to/image.ext
-        if len(parts) == 2:
-
-            sliceIndex = int(parts[0])
+        if sliceIndex is not None:
 
             if imageReader.canOpenSlices():
                 data = imageReader.openSlice(filePath, sliceIndex)
+                cache.put(filePath, mtime, data, sliceIndex)
 
             else:
                 logger.debug("Requesting slice %s from %s. Suboptimal?." % (sliceIndex, filePath))
-                data = imageReader.open(filePath)
-                data = data[sliceIndex - 1]
+                wholeData = imageReader.open(filePath)
+                cache.put(filePath, mtime, wholeData)
+                data = wholeData[sliceIndex - 1]
         else:
             # Get the numpy array
             data = imageReader.open(filePath)
+            cache.put(filePath, mtime, data)
 
         return ImageStack(data)
 
@@ -443,6 +687,36 @@ class ImageReadersRegistry:
         return cls._readers.keys()
 
 
+def _combineMoments(a, b):
+    """ Combine the (count, mean, sum of squared differences to the mean) of
+    two groups of images, see Chan et al. parallel variance algorithm """
+    nA, meanA, m2A = a
+    nB, meanB, m2B = b
+    if not nA:
+        return b
+    if not nB:
+        return a
+    n = nA + nB
+    delta = meanB - meanA
+    mean = meanA + delta * (nB / n)
+    m2 = None if m2A is None else m2A + m2B + numpy.square(delta) * (nA * nB / n)
+    return n, mean, m2
+
+
+def _accumulateSlices(chunks, variance):
+    """ Accumulate the moments of the chunks of slices (path, indices) """
+    moments = (0, None, None)
+    for path, indices in chunks:
+        data = ImageReadersRegistry.getReader(path).openSlices(path, indices)
+        mean = data.mean(axis=0, dtype=numpy.float64)
+        m2 = None
+        if variance:
+            diff = data - mean
+            m2 = numpy.einsum('ijk,ijk->jk', diff, diff)
+        moments = _combineMoments(moments, (len(data), mean, m2))
+    return moments
+
+
 class PILImageReader(ImageReader):
     """ PIL image reader"""
 
@@ -479,6 +753,8 @@ class EmImageReader(ImageReader):
     EM_LONG = 4
     EM_FLOAT = 5
     EM_DOUBLE = 9
+    DTYPES = {EM_BYTE: np.int8, EM_SHORT: np.int16, EM_LONG: np.int32,
+              EM_FLOAT: np.float32, EM_DOUBLE: np.float64}
 
     @staticmethod
     def getCompatibleExtensions() -> List[str]:
@@ -544,6 +820,12 @@ class EmImageReader(ImageReader):
             dims = struct.unpack('<3i', header[4:16])
             return dims[0], dims[1], dims[2], 1
 
+    @classmethod
+    def probe(cls, filePath):
+        with open(filePath, 'rb') as f:
+            header = f.read(4)
+        return cls.getDimensions(filePath), cls.DTYPES.get(header[3], np.float32)
+
     @classmethod
     def write(cls,
               imageStack: ImageStack,
@@ -617,19 +899,24 @@ class Dm4ImageReader(ImageReader):
         dm4Img = dm.dmReader(filePath)
         return dm4Img['data']
 
+    # Data types of the DM image data
+    DTYPES = {1: np.int16, 2: np.float32, 3: np.complex64, 6: np.uint8,
+              7: np.int32, 9: np.int8, 10: np.uint16, 11: np.uint32,
+              12: np.float64, 13: np.complex128}
+
     @staticmethod
     def getDimensions(filePath: str) -> Tuple[int, int, int, int]:
-        data = Dm4ImageReader.open(filePath)
-        result = data.shape
-        lr = len(result)
-        if lr == 2:
-            return result[0], result[1], 1, 1
-        elif lr == 3:
-            return result[0], result[1], result[2], 1
-        elif lr == 4:
-            return result[0], result[1], result[2], result[3]
-        else:
-            return 1, 1, 1, 1
+        return Dm4ImageReader.probe(filePath)[0]
+
+    @classmethod
+    def probe(cls, filePath):
+        """ Parse the tags of the file, without reading the image data """
+        with dm.fileDM(filePath, on_memory=False) as dmFile:
+            # Skip the thumbnail dataset
+            i = 1 if dmFile.thumbnail else 0
+            dims = (int(dmFile.xSize[i]), int(dmFile.ySize[i]),
+                    int(dmFile.zSize[i]), int(dmFile.zSize2[i]))
+            return dims, cls.DTYPES.get(dmFile.dataType[i])
 
     @classmethod
     def dmToMrc(cls,
@@ -668,6 +955,12 @@ class TiffImageReader(ImageReader):
 
         return x, y, 1, frames
 
+    @classmethod
+    def probe(cls, filePath):
+        with TiffFile(filePath) as tif:
+            page = tif.pages[0]
+            return (page.imagewidth, page.imagelength, 1, len(tif.pages)), page.dtype
+
     @classmethod
     def open(cls, path: str):
         key = 0
@@ -717,8 +1010,67 @@ class XMIPPImageReader(ImageReader):
         return img.getDimensions()
 
 
+def _mmapMrc(path):
+    return mrcfile.mmap(path, mode='r', permissive=True)
+
+
+class MmapPool:
+    """ Bounded pool of read only memory maps of files (MRC by default).
+    Maps are keyed by path and modification time, so a modified file is
+    mapped again, and the least recently used one is closed when the pool
+    is full. """
+
+    def __init__(self, maxSize=32, opener=_mmapMrc):
+        """
+        :param maxSize: maximum number of files mapped
+        :param opener: function receiving the path and returning the map, an
+            object with a close method
+        """
+        self._maxSize = maxSize
+        self._opener = opener
+        self._maps = OrderedDict()  # {(path, mtime, size): mmap}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """ Return the memory map of path, mapping it if not in the pool """
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            mrc = self._maps.get(key)
+            if mrc is not None:
+                self._maps.move_to_end(key)
+                return mrc
+
+            # Stale maps of the same file
+            for oldKey in [k for k in self._maps if k[0] == path]:
+                self._maps.pop(oldKey).close()
+            logger.debug("Mapping %s" % path)
+            mrc = self._opener(path)
+            self._maps[key] = mrc
+            while len(self._maps) > self._maxSize:
+                _, evicted = self._maps.popitem(last=False)
+                evicted.close()
+            return mrc
+
+    def discard(self, path):
+        """ Close the memory maps of path, i.e. before overwriting it """
+        with self._lock:
+            for key in [k for k in self._maps if k[0] == path]:
+                self._maps.pop(key).close()
+
+    def __len__(self):
+        return len(self._maps)
+
+    def clear(self):
+        """ Close all the memory maps """
+        with self._lock:
+            while self._maps:
+                self._maps.popitem()[1].close()
+
+
 class MRCImageReader(ImageReader):
     """ Image reader for MRC files"""
+    mmapPool = MmapPool()
 
     @staticmethod
     def getCompatibleExtensions() -> list:
@@ -730,6 +1082,16 @@ class MRCImageReader(ImageReader):
         header = headers.Ccp4Header(filePath, readHeader=True)
         return header.getXYZN()
 
+    @classmethod
+    def probe(cls, filePath):
+        from pwem.convert import headers
+        header = headers.Ccp4Header(filePath, readHeader=True)
+        try:
+            dtype = mrcfile.utils.dtype_from_mode(header.getMode())
+        except ValueError:
+            dtype = None
+        return header.getXYZN(), dtype
+
     @classmethod
     def canOpenSlices(cls):
         return True
@@ -737,11 +1099,20 @@ class MRCImageReader(ImageReader):
     @classmethod
     def openSlice(cls, path, slice):
         """
-        Reads a given image
+        Reads a given image. Returns a view of the memory mapped file, no
+        data is copied.
            :param path (str) --> Image to be read
         """
         npImg = cls.open(path)
-        return npImg[slice-1]
+        return npImg if npImg.ndim == 2 else npImg[slice-1]
+
+    @classmethod
+    def openSlices(cls, path, slices):
+        """ Reads the slices (1-based) with a single access to the memory map """
+        npImg = cls.open(path)
+        if npImg.ndim == 2:
+            npImg = npImg[None]
+        return npImg[numpy.asarray(slices) - 1]
 
     @classmethod
     def open(cls, path: str):
@@ -756,8 +1127,9 @@ class MRCImageReader(ImageReader):
 
     @classmethod
     def getMrcImage(cls, fileName):
-        logger.info("Reading %s" % fileName)
-        return mrcfile.mmap(fileName, mode='r+', permissive=True)
+        """ Returns the read only memory map of the file, shared with other
+        requests of the same file """
+        return cls.mmapPool.get(fileName)
 
     @classmethod
     def getArray(cls, filename):
@@ -775,6 +1147,7 @@ class MRCImageReader(ImageReader):
         sr = samplingRate if samplingRate else imageStack.getProperties().get("sr", 1.0)
         stack = numpy.stack(imageStack.getImages(), axis=0)
 
+        cls.mmapPool.discard(fileName)
         with mrcfile.new(fileName, overwrite=True) as mrc:
             mrc.set_data(stack.astype(numpy.float32))
             if isStack:
@@ -782,6 +1155,55 @@ class MRCImageReader(ImageReader):
             mrc.update_header_from_data()
             mrc.voxel_size = sr
 
+    @classmethod
+    def writeLocations(cls, fileName, locations, matrices=None, samplingRate=None, blockSize=1024):
+        """ Write a stack with the images in locations, a list of (index, path) pairs,
+        optionally transformed by the Scipion matrices (N, 4, 4), see
+        ImageStack.transformMatrixSlices. The output file is preallocated and filled
+        in blocks of consecutive images, reading the images of each block grouped by
+        source file, with a single access to each one.
+        """
+        n = len(locations)
+        firstIndex, firstPath = locations[0]
+        first = ImageReadersRegistry.getReader(firstPath).openSlices(firstPath, [firstIndex])
+        dtype = numpy.float32 if matrices is not None else first.dtype
+        try:
+            mode = mrcfile.utils.mode_from_dtype(numpy.dtype(dtype))
+        except ValueError:
+            dtype, mode = numpy.float32, 2
+
+        cls.mmapPool.discard(fileName)
+        stats = [numpy.inf, -numpy.inf, 0., 0.]  # min, max, sum, sum of squares
+        with mrcfile.new_mmap(fileName, shape=(n,) + first.shape[1:], mrc_mode=mode,
+                              overwrite=True) as mrc:
+            for start in range(0, n, blockSize):
+                block = locations[start:start + blockSize]
+                data = mrc.data[start:start + len(block)]
+                images = data if matrices is None else numpy.empty(data.shape, dtype=numpy.float32)
+
+                sources = OrderedDict()
+                for position, (index, path) in enumerate(block):
+                    sources.setdefault(path, []).append((position, index))
+                for path, items in sources.items():
+                    positions, indices = zip(*items)
+                    images[list(positions)] = ImageReadersRegistry.getReader(path).openSlices(path, indices)
+
+                if matrices is not None:
+                    ImageStack.transformMatrixSlices(images, matrices[start:start + len(block)], out=data)
+
+                stats[0] = min(stats[0], float(data.min()))
+                stats[1] = max(stats[1], float(data.max()))
+                stats[2] += float(data.sum(dtype=numpy.float64))
+                stats[3] += float(numpy.square(data, dtype=numpy.float64).sum())
+
+            mrc.set_image_stack()
+            size = data[0].size * n
+            mean = stats[2] / size
+            mrc.header.dmin, mrc.header.dmax, mrc.header.dmean = stats[0], stats[1], mean
+            mrc.header.rms = numpy.sqrt(max(stats[3] / size - mean ** 2, 0))
+            if samplingRate:
+                mrc.voxel_size = samplingRate
+
     @classmethod
     def isMrcVolume(cls, mrcImg):
         if mrcImg.is_volume():
@@ -796,18 +1218,25 @@ class MRCImageReader(ImageReader):
 
       
 class STKImageReader(ImageReader):
-    IMG_BYTES = None
-    stk_handler = None
-    header_info = None
+    """ Reader of SPIDER stacks and volumes. Each file is read by an instance
+    that parses the header once and maps the data with numpy.memmap, so
+    slices are read concurrently without any shared file pointer. """
     HEADER_OFFSET = 1024
     FLOAT32_BYTES = 4
-    TYPE = None
+    readers = MmapPool(opener=lambda path: STKImageReader(path))
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.header_info = self.readHeader()
+        self.TYPE = self.header_info["type"]
+        self.IMG_BYTES = self.FLOAT32_BYTES * self.header_info["n_rows"] * self.header_info["n_columns"]
+        self._data = None
+        self._lock = threading.Lock()
 
     @classmethod
-    def __init__(cls, fileName):
-        cls.stk_handler = open(fileName, "rb")
-        cls.header_info = cls.readHeader()
-        cls.IMG_BYTES = cls.FLOAT32_BYTES * cls.header_info["n_columns"] ** 2
+    def getReader(cls, path) -> 'STKImageReader':
+        """ Returns the reader of the file, shared with other requests of the same file"""
+        return cls.readers.get(path.split('@')[-1])
 
     @classmethod
     def open(cls, path):
@@ -824,85 +1253,73 @@ class STKImageReader(ImageReader):
         Reads a given image
            :param filename (str) --> Image to be read
         """
-        cls.stk_handler = open(path, "rb")
-        cls.header_info = cls.readHeader()
-        cls.IMG_BYTES = cls.FLOAT32_BYTES * cls.header_info["n_columns"] ** 2
-        image = cls.readImage(slice - 1)
-        return image
-
-    @staticmethod
-    def getDimensions(filePath):
+        return cls.getReader(path).readImage(slice - 1)
 
-        STKImageReader.stk_handler = open(filePath, "rb")
-        STKImageReader.header_info = STKImageReader.readHeader()
-        STKImageReader.IMG_BYTES = STKImageReader.FLOAT32_BYTES * STKImageReader.header_info["n_columns"] ** 2
-        header = STKImageReader.header_info
-        return (header['n_rows'], header['n_columns'], header['n_slices'],
+    @classmethod
+    def getDimensions(cls, filePath):
+        header = cls.getReader(filePath).header_info
+        return (header['n_columns'], header['n_rows'], header['n_slices'],
                 header['n_images'])
 
     @classmethod
-    def readHeader(cls):
+    def probe(cls, filePath):
+        """ Read the header without adding the file to the shared readers """
+        header = cls(filePath.split('@')[-1]).header_info
+        dims = (header['n_columns'], header['n_rows'], header['n_slices'],
+                header['n_images'])
+        return dims, numpy.dtype(numpy.float32)
+
+    def readHeader(self):
         """
         Reads the header of the current file as a dictionary
             :returns The current header as a dictionary
         """
-        header = cls.readNumpy(0, cls.HEADER_OFFSET)
+        header = numpy.fromfile(self.fileName, dtype='<f4', count=self.HEADER_OFFSET // self.FLOAT32_BYTES)
 
         header = dict(img_size=int(header[1]), n_images=int(header[25]),
                       offset=int(header[21]),
                       n_rows=int(header[1]), n_columns=int(header[11]),
                       n_slices=int(header[0]),
                       sr=float(header[20]))
-
-        cls.TYPE = "stack" if header["n_images"] > 1 else "volume"
+        header["type"] = "stack" if header["n_images"] > 1 else "volume"
 
         return header
 
-    @classmethod
-    def readNumpy(cls, start, end):
-        """
-        Read bytes between start and end as a Numpy array
-            :param start (int) --> Start byte
-            :param end (int) --> End byte
-            :returns decoded bytes as Numpy array
-        """
-        return numpy.frombuffer(cls.readBinary(start, end), dtype=numpy.float32)
+    @property
+    def data(self) -> numpy.memmap:
+        """ Memory map of the images with shape (N, Y, X) for stacks and
+        (Z, Y, X) for volumes. Stack images are preceded by their own header """
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    header = self.header_info
+                    offset = header["offset"]
+                    shape = (header["n_rows"], header["n_columns"])
+                    if self.TYPE == "stack":
+                        imgType = numpy.dtype([('header', 'u1', offset), ('image', '<f4', shape)])
+                        self._data = numpy.memmap(self.fileName, dtype=imgType, mode='r', offset=offset,
+                                                  shape=(header["n_images"],))['image']
+                    else:
+                        self._data = numpy.memmap(self.fileName, dtype='<f4', mode='r', offset=offset,
+                                                  shape=(max(header["n_slices"], 1),) + shape)
+        return self._data
 
     @classmethod
-    def readBinary(cls, start, end):
-        """
-        Read bytes between start and end
-            :param start (int) --> Start byte
-            :param end (int) --> End byte
-            :returns the bytes read
-        """
-        cls.seek(start)
-        return cls.stk_handler.read(end)
+    def openSlices(cls, path, slices):
+        """ Reads the slices (1-based) with a single access to the memory map """
+        return cls.getReader(path).data[numpy.asarray(slices) - 1]
 
-    @classmethod
-    def readImage(cls, iid):
+    def readImage(self, iid):
         """
         Reads a given image in the stack according to its ID
             :param iid (int) --> Image id to be read
             :returns Image as Numpy array
         """
+        return self.data[iid]
 
-        if cls.TYPE == "stack":
-            start = 2 * cls.header_info["offset"] + iid * (
-                    cls.IMG_BYTES + cls.header_info["offset"])
-        else:
-            start = cls.header_info["offset"] + iid * cls.IMG_BYTES
-
-        img_size = cls.header_info["n_columns"]
-        return cls.readNumpy(start, cls.IMG_BYTES).reshape([img_size, img_size])
-
-    @classmethod
-    def seek(cls, pos):
-        """
-        Move file pointer to a given position
-            :param pos (int) --> Byte to move the pointer to
-        """
-        cls.stk_handler.seek(pos)
+    def close(self):
+        """ Release the memory map. Images already read remain valid """
+        self._data = None
 
     @classmethod
     def getCompatibleExtensions(cls) -> list:
@@ -914,14 +1331,8 @@ class STKImageReader(ImageReader):
 
     @classmethod
     def readAll(cls, filename):
-        filename = filename.split('@')[-1]
-        dimX, dimY, dimZ, nImages = cls.getDimensions(filename)
-        if cls.TYPE == 'volume':
-            numpyStack = numpy.stack([cls.readImage(ii) for ii in range(0, dimZ, 1)])
-        else:
-            numpyStack = numpy.stack([cls.readImage(ii) for ii in range(0, nImages, 1)])
-
-        return numpyStack
+        """ Reads all the images (or volume slices) of the file in memory """
+        return numpy.array(cls.getReader(filename).data, dtype=numpy.float32)
 
 
 # Register reader in the registry. Latest registered will take priority.
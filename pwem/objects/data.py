@@ -34,6 +34,11 @@ logger = logging.getLogger(__name__)
 
 import os
 import json
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import numpy as np
 
 import pyworkflow.utils as pwutils
@@ -1172,6 +1177,7 @@ class PdbFile(AtomStruct):
 
 class EMSet(Set, EMObject):
     _classesDict = None
+    _insertBuffer = None
 
     def _loadClassesDict(self):
 
@@ -1202,7 +1208,9 @@ class EMSet(Set, EMObject):
                   itemSelectedCallback=None,
                   rowFilter=None,
                   orderBy='id',
-                  direction='ASC'
+                  direction='ASC',
+                  workers=0,
+                  chunkSize=1000
                   ):
         """ Copy items from another set, allowing to update items information
         based on another source of data, paired with each item.
@@ -1228,6 +1236,12 @@ class EMSet(Set, EMObject):
                 returning true if it has to be copied
             orderBy: Attribute by which the items will be sorted before copying. Default is 'id'.
             direction: Sorting direction, either 'ASC' for ascending or 'DESC' for descending. Default is 'ASC'.
+            workers: If greater than 0, copy in pipelined mode: a reader thread
+                streams the items in chunks, the updateItemCallback runs on a
+                pool of this many threads and the rows are inserted in batches.
+                The callback must then be thread safe if workers > 1, and the
+                items are always cloned (doClone is ignored).
+            chunkSize: Number of items per chunk in pipelined mode.
         """
 
         if itemSelectedCallback is None:
@@ -1240,6 +1254,12 @@ class EMSet(Set, EMObject):
         else:
             itemIterator = otherSet
 
+        if workers > 0:
+            self._copyItemsPipelined(itemIterator, updateItemCallback,
+                                     itemDataIterator, copyDisabled,
+                                     itemSelectedCallback, workers, chunkSize)
+            return
+
         for item in itemIterator:
             # copy items if enabled or copyDisabled=True
             if copyDisabled or itemSelectedCallback(item):
@@ -1255,6 +1275,244 @@ class EMSet(Set, EMObject):
                 if itemDataIterator is not None:
                     next(itemDataIterator)  # just skip disabled data row
 
+    def _copyItemsPipelined(self, itemIterator, updateItemCallback,
+                            itemDataIterator, copyDisabled,
+                            itemSelectedCallback, workers, chunkSize):
+        """ Pipelined version of copyItems. The input is read in a separate
+        thread, where each selected item is cloned and paired with its data
+        row (skipping the rows of the unselected ones, as the sequential copy
+        does). Chunks are updated in a thread pool and appended in the input
+        order, buffering the inserts to write them with a single statement.
+        """
+        chunks = queue.Queue(maxsize=2 * workers + 2)
+        stop = threading.Event()
+
+        def _put(value):
+            while not stop.is_set():
+                try:
+                    chunks.put(value, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def _read():
+            try:
+                chunk = []
+                for item in itemIterator:
+                    if stop.is_set():
+                        return
+                    if copyDisabled or itemSelectedCallback(item):
+                        row = None
+                        if updateItemCallback and itemDataIterator is not None:
+                            row = next(itemDataIterator)
+                        chunk.append((item.clone(), row))
+                        if len(chunk) >= chunkSize:
+                            _put(chunk)
+                            chunk = []
+                    elif itemDataIterator is not None:
+                        next(itemDataIterator)  # just skip disabled data row
+                if chunk:
+                    _put(chunk)
+                _put(None)
+            except BaseException as e:
+                _put(e)
+
+        def _update(chunk):
+            for newItem, row in chunk:
+                updateItemCallback(newItem, row)
+            return chunk
+
+        reader = threading.Thread(target=_read, daemon=True)
+        self._startInsertBuffer()
+        reader.start()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                finished = False
+                while pending or not finished:
+                    if not finished and len(pending) <= workers:
+                        chunk = chunks.get()
+                        if chunk is None:
+                            finished = True
+                        elif isinstance(chunk, BaseException):
+                            raise chunk
+                        elif updateItemCallback:
+                            pending.append(pool.submit(_update, chunk))
+                        else:
+                            pending.append(chunk)
+                        continue
+
+                    chunk = pending.popleft()
+                    if isinstance(chunk, Future):
+                        chunk = chunk.result()
+                    for newItem, _ in chunk:
+                        # If updateCallBack function returns attribute
+                        # _appendItem to False do not append the item
+                        if getattr(newItem, "_appendItem", True):
+                            self.append(newItem)
+                    self._flushInsertBuffer()
+        finally:
+            stop.set()
+            reader.join()
+            self._insertBuffer = None
+
+    def _startInsertBuffer(self):
+        """ Keep the rows inserted by _insertItem in memory until
+        _flushInsertBuffer is called. Only sets with a flat mapper,
+        storing each item in a single row, are buffered. """
+        if hasattr(self._getMapper(), '_getValuesFromObject'):
+            self._insertBuffer = []
+
+    def _flushInsertBuffer(self):
+        """ Insert the buffered rows with a single prepared statement. """
+        if self._insertBuffer:
+            db = self._getMapper().db
+            db.cursor.executemany(db.INSERT_OBJECT, self._insertBuffer)
+            self._insertBuffer = []
+
+    def _insertItem(self, item):
+        mapper = self._getMapper()
+        # The first insert creates the tables and the insert statement
+        if (self._insertBuffer is None or mapper.doCreateTables
+                or mapper.db.INSERT_OBJECT is None):
+            Set._insertItem(self, item)
+        else:
+            self._insertBuffer.append(
+                (item.getObjId(), item.isEnabled(), item.getObjLabel(),
+                 item.getObjComment(),
+                 *mapper._getValuesFromObject(item).values()))
+
+    def getColumnValues(self, attributes, where=None, orderBy='id',
+                        direction='ASC'):
+        """ Return the stored values of one or several attributes for all
+        the rows of the set, reading only those columns and without
+        building the items.
+
+        Params:
+            attributes: attribute name (e.g. '_micId') or list of them
+                (e.g. ['id', '_transform._matrix']).
+            where: optional condition in the form attrName=value.
+            orderBy: attribute by which the rows are sorted.
+            direction: 'ASC' or 'DESC'.
+
+        Returns:
+            A list of values for a single attribute, or a list of tuples
+            with one value per attribute otherwise.
+        """
+        labels = pwutils.valueToList(attributes)
+        mapper = self._getMapper()
+
+        # Empty sets do not have tables yet
+        if mapper.doCreateTables:
+            return []
+
+        db = mapper.db
+        columns = []
+        for label in labels + [orderBy]:
+            column = db._getRealCol(label)
+            if column is None:
+                raise Exception("Attribute %s not found in %s"
+                                % (label, self.getFileName()))
+            columns.append(column)
+
+        cmd = "SELECT %s %s" % (', '.join(columns[:-1]), db.FROM)
+        whereStr = db._whereToWhereStr(where)
+        if whereStr is not None:
+            cmd += " WHERE %s" % whereStr
+        cmd += " ORDER BY %s %s" % (columns[-1], direction)
+
+        db.executeCommand(cmd)
+        rows = db.cursor.fetchall()
+
+        if isinstance(attributes, str):
+            return [row[0] for row in rows]
+        return [tuple(row) for row in rows]
+
+    def appendSubset(self, inputSet, ids=None, refSet=None, attribute='id',
+                     refAttribute='id', difference=False, enable=False):
+        """ Fill this (empty) set with the rows of inputSet selected by ids
+        or by the values of another set, without building the items. The
+        sqlite files are attached and rows are copied with a single
+        INSERT ... SELECT, together with the Classes and Properties tables.
+
+        Params:
+            inputSet: flat set (not a set of sets) with the rows to copy.
+            ids: ids of the rows to copy (used if refSet is None).
+            refSet: set with the values to match.
+            attribute: attribute of inputSet items to match.
+            refAttribute: attribute of refSet items holding the values.
+            difference: copy the rows NOT matching instead.
+            enable: set all the copied rows as enabled.
+
+        Returns:
+            The number of items copied or None if the subset could not be
+            done this way (i.e. sets of sets), so items have to be appended.
+        """
+        mapper = self._getMapper()
+        inputMapper = inputSet._getMapper()
+        if (not mapper.doCreateTables or inputMapper.doCreateTables
+                or (inputSet.getPrefix() or '').strip() or (self.getPrefix() or '').strip()
+                or isinstance(inputSet.getFirstItem(), Set)):
+            return None
+
+        inputCol = inputMapper.db._getRealCol(attribute)
+        if inputCol is None:
+            raise Exception("Attribute %s not found in %s"
+                            % (attribute, inputSet.getFileName()))
+
+        db = mapper.db
+        attached = ['src']
+        db.executeCommand("ATTACH DATABASE ? AS src", (inputSet.getFileName(),))
+        try:
+            if refSet is not None:
+                refMapper = refSet._getMapper()
+                if refMapper.doCreateTables:  # Empty set
+                    values = "SELECT NULL WHERE 0"
+                else:
+                    refCol = refMapper.db._getRealCol(refAttribute)
+                    if refCol is None:
+                        raise Exception("Attribute %s not found in %s"
+                                        % (refAttribute, refSet.getFileName()))
+                    db.executeCommand("ATTACH DATABASE ? AS ref", (refSet.getFileName(),))
+                    attached.append('ref')
+                    values = ("SELECT %s FROM ref.Objects WHERE %s IS NOT NULL"
+                              % (refCol, refCol))
+            else:
+                db.executeCommand("CREATE TEMP TABLE subset_ids (id INTEGER PRIMARY KEY)")
+                db.connection.executemany("INSERT OR IGNORE INTO subset_ids VALUES (?)",
+                                          ((int(i),) for i in ids))
+                values = "SELECT id FROM subset_ids"
+
+            # Same tables (and columns) than the input set
+            db.setVersion(db.VERSION)
+            db.executeCommand("SELECT sql FROM src.sqlite_master WHERE sql IS NOT NULL "
+                              "AND tbl_name IN ('Properties', 'Classes', 'Objects') "
+                              "ORDER BY type DESC")
+            for row in db.cursor.fetchall():
+                db.executeCommand(row[0])
+            db.executeCommand("INSERT INTO Properties SELECT * FROM src.Properties")
+            db.executeCommand("INSERT INTO Classes SELECT * FROM src.Classes")
+
+            if difference:
+                where = "%s IS NULL OR %s NOT IN (%s)" % (inputCol, inputCol, values)
+            else:
+                where = "%s IN (%s)" % (inputCol, values)
+            db.executeCommand("INSERT INTO Objects SELECT * FROM src.Objects WHERE %s ORDER BY id"
+                              % where)
+            if enable:
+                db.executeCommand("UPDATE Objects SET enabled=1 WHERE enabled<>1")
+            db.commit()
+        finally:
+            db.connection.rollback()  # Nothing if committed
+            db.executeCommand("DROP TABLE IF EXISTS temp.subset_ids")
+            for name in attached:
+                db.executeCommand("DETACH DATABASE %s" % name)
+
+        # Reload the mapper to get the new tables, size and ids
+        self.close()
+        self._getMapper()
+        return self.getSize()
+
     @classmethod
     def create(cls, outputPath,
                prefix=None, suffix=None, ext=None,
@@ -1458,11 +1716,49 @@ class SetOfImages(EMSet):
 
     def writeStack(self, fnStack, orderBy='id', direction='ASC',
                    applyTransform=False):
-        # TODO create empty file to improve efficiency
+        """ Write the images of the set in a stack, applying their 2D
+        alignment if applyTransform is True. MRC stacks of images that can be
+        read by slices are preallocated and written in blocks, reading only
+        the location columns and the matrices from the set.
+        """
         from pwem.emlib.image import ImageHandler
-        ih = ImageHandler()
+        from pwem.emlib.image.image_readers import (ImageReadersRegistry,
+                                                    MRCImageReader)
         applyTransform = applyTransform and self.hasAlignment2D()
 
+        if self.isEmpty():
+            return
+
+        # Locations and matrices read in the same query, so in the same order
+        attributes = ['_index', '_filename']
+        if applyTransform:
+            attributes.append('_transform._matrix')
+        rows = self.getColumnValues(attributes, orderBy=orderBy,
+                                    direction=direction)
+        # Remove format suffixes as in image.mrc:mrcs
+        locations = [(row[0] or 1, row[1].split(':')[0]) for row in rows]
+        noIndexPaths = {row[1] for row in rows if not row[0]}
+
+        def _isImagesStack(fn):
+            """ Images are 2D slices, or the whole file if it has no index """
+            reader = ImageReadersRegistry.getReader(fn)
+            if not reader.canOpenSlices():
+                return False
+            _, _, z, n = reader.probe(fn)[0]
+            return z == 1 and (n == 1 or fn not in noIndexPaths)
+
+        # Format suffixes are kept to read the dimensions
+        if (ImageReadersRegistry.getReader(fnStack) is MRCImageReader and
+                all(_isImagesStack(fn) for fn in {row[1] for row in rows})):
+            matrices = None
+            if applyTransform:
+                matrices = Matrix.parseValues([row[2] for row in rows])
+            MRCImageReader.writeLocations(fnStack.split(':')[0], locations,
+                                          matrices=matrices,
+                                          samplingRate=self.getSamplingRate())
+            return
+
+        ih = ImageHandler()
         for i, img in enumerate(self.iterItems(orderBy=orderBy,
                                                direction=direction)):
             transform = img.getTransform() if applyTransform else None
@@ -1592,6 +1888,18 @@ class SetOfImages(EMSet):
                         self.append(img)
 
 
+    def getTransformMatrices(self, where=None, orderBy='id', direction='ASC'):
+        """ Return the ids and the transformation matrices of all the images,
+        as an array of N ids and an array of shape (N, 4, 4), reading only
+        the columns needed from the set database.
+        """
+        rows = self.getColumnValues(['id', '_transform._matrix'], where=where,
+                                    orderBy=orderBy, direction=direction)
+        ids = np.array([row[0] for row in rows], dtype=int)
+        matrices = Matrix.parseValues([row[1] for row in rows])
+        return ids, matrices
+
+
 class SetOfMicrographsBase(SetOfImages):
     """ Create a base class for both Micrographs and Movies,
     but avoid to select Movies when Micrographs are required.
@@ -2069,6 +2377,18 @@ class Matrix(Scalar):
     def __str__(self):
         return np.array_str(self._matrix)
 
+    @staticmethod
+    def parseValues(values):
+        """ Return an array of shape (N, 4, 4) from N stored (json) matrix
+        values, all of them decoded at once. None values are identities.
+        All the values must have the same size, e.g. (N, 3, 3) for 2D.
+        """
+        if not len(values):
+            return np.empty((0, 4, 4))
+        identity = json.dumps(np.eye(4).tolist())
+        return np.array(json.loads('[%s]' % ','.join(v or identity for v in values)),
+                        dtype=float)
+
     def _copy(self, other, copyDict, copyId, level=1, ignoreAttrs=[], copyEnable=False):
         """ Override the default behaviour of copy
         to also copy array data.
@@ -2137,6 +2457,7 @@ class SetOfClasses(EMSet):
     """ Store results from a classification. """
     ITEM_TYPE = None  # type of classes stored in the set
     REP_TYPE = None  # type of the representatives of each class
+    CLASSIFY_BUFFER_SIZE = 50000  # items kept in memory by classifyItems
 
     def __init__(self, **kwargs):
         EMSet.__init__(self, **kwargs)
@@ -2313,7 +2634,31 @@ class SetOfClasses(EMSet):
 
         inputSet = self.getImages()
         iterParams = iterParams or {}
+
+        # Rows of each class are kept in memory and written to the class
+        # tables in batches, the class sizes are updated once at the end
+        try:
+            self._classifyItems(clsDict, inputSet, iterParams,
+                                updateItemCallback, updateClassCallback,
+                                itemDataIterator, classifyDisabled, doClone,
+                                raiseOnNextFailure, cancelNextWhenAppendIsFalse)
+            for classItem in clsDict.values():
+                classItem._flushInsertBuffer()
+        finally:
+            for classItem in clsDict.values():
+                classItem._insertBuffer = None
+
+        for classItem in clsDict.values():
+            self.update(classItem)
+
+    def _classifyItems(self, clsDict, inputSet, iterParams,
+                       updateItemCallback, updateClassCallback,
+                       itemDataIterator, classifyDisabled, doClone,
+                       raiseOnNextFailure, cancelNextWhenAppendIsFalse):
+        """ Main loop of classifyItems, appending the items to the buffered
+        classes of clsDict. """
         cancelNext = False
+        buffered = 0
 
         # For each item in the input set: Particles tipically (which will contribute to the main items here: class2d or 3d).
         for item in inputSet.iterItems(**iterParams):
@@ -2343,16 +2688,20 @@ class SetOfClasses(EMSet):
 
                 # Get the class the newItem belongs to.
                 classItem = self._get_or_create_class(clsDict, ref, updateClassCallback)
+                if classItem._insertBuffer is None:
+                    classItem._startInsertBuffer()
                 classItem.append(newItem)
+                buffered += 1
+                if buffered >= self.CLASSIFY_BUFFER_SIZE:
+                    for bufferedClass in clsDict.values():
+                        bufferedClass._flushInsertBuffer()
+                    buffered = 0
                 # cancel next() cancelation --> Enable next()
                 cancelNext = False
             else:
                 if itemDataIterator is not None:
                     next(itemDataIterator)  # just skip disabled data row
 
-        for classItem in clsDict.values():
-            self.update(classItem)
-
     def _updateItem(self, cancelNext, cancelNextWhenAppendIsFalse, itemDataIterator, newItem, raiseOnNextFailure,
                     updateItemCallback)->LoopActions:
         # Declare row
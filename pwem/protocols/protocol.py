@@ -24,7 +24,9 @@
 # *
 # **************************************************************************
 
+import os
 import time
+from collections import OrderedDict
 
 import pyworkflow.object as pwobj
 import pyworkflow.protocol as pwprot
@@ -246,6 +248,29 @@ class EMProtocol(pwprot.Protocol):
                       % sleepOnWait)
             time.sleep(sleepOnWait)
 
+    def _getStreamingReader(self, inputSet, SetClass):
+        """ Return the StreamingSetReader used to poll the given input set,
+        the same one is used during the whole protocol execution so only
+        the items added since the last poll are read.
+        """
+        if not hasattr(self, '_streamingReaders'):
+            self._streamingReaders = {}
+        key = (inputSet.getFileName(), SetClass)
+        if key not in self._streamingReaders:
+            self._streamingReaders[key] = StreamingSetReader(key[0], SetClass)
+        return self._streamingReaders[key]
+
+    def _getProgressLedger(self):
+        """ Return the ProgressLedger with the done (and failed) items of
+        this streaming protocol, stored in the files given by _getAllDone
+        and _getAllFailed (if defined).
+        """
+        if getattr(self, '_progressLedger', None) is None:
+            getAllFailed = getattr(self, '_getAllFailed', None)
+            self._progressLedger = ProgressLedger(
+                self._getAllDone(), getAllFailed() if getAllFailed else None)
+        return self._progressLedger
+
     def _insertNewMics(self, inputMics, getMicKeyFunc,
                        insertStepFunc, insertStepListFunc, *args):
         """ Insert steps of new micrographs taking into account the batch size.
@@ -305,3 +330,181 @@ class EMProtocol(pwprot.Protocol):
             self.micDict[getMicKeyFunc(mic)] = mic
 
         return deps
+
+
+class StreamingSetReader:
+    """ Incremental reader of a set that is being filled (in streaming)
+    by other protocol.
+
+    Each read opens the set db, selects only the rows past the high-water
+    mark of the previous read and closes it again. The mark is the maximum
+    id read, plus the last creation time for rows appended with an
+    explicit (lower) id. The set properties are loaded once, later reads
+    only update the stream state.
+    """
+    def __init__(self, fileName, SetClass):
+        self._fileName = fileName
+        self._SetClass = SetClass
+        self._set = None
+        self._lastId = 0
+        self._lastCreation = None
+        self._lastCreationIds = set()  # ids read with _lastCreation
+        self._pending = OrderedDict()
+        self.streamClosed = False
+
+    def _getSet(self):
+        if self._set is None:
+            self._set = self._SetClass(filename=self._fileName)
+            self._set.loadAllProperties()
+        else:
+            self._set.loadProperty('_streamState')
+        return self._set
+
+    def read(self):
+        """ Return a list with the items (cloned) added to the set since
+        the previous read and update the streamClosed attribute. """
+        inputSet = self._getSet()
+        if self._lastId or self._lastCreation is not None:
+            where = 'id>%d' % self._lastId
+            if self._lastCreation is not None:
+                where += " OR creation>='%s'" % self._lastCreation
+            items = inputSet.iterItems(where=where)
+        else:  # Nothing read yet, the whole set
+            items = inputSet
+
+        newItems, newMarks = [], []
+        try:
+            for item in items:
+                itemId = item.getObjId()
+                if itemId in self._lastCreationIds:
+                    continue
+                # creation is not cloned
+                newMarks.append((itemId, item.getObjCreation()))
+                newItems.append(item.clone())
+            self.streamClosed = inputSet.isStreamClosed()
+        finally:
+            inputSet.close()
+
+        for itemId, creation in newMarks:
+            if itemId is None:
+                continue
+            self._lastId = max(self._lastId, itemId)
+            if creation is None:
+                continue
+            if self._lastCreation is None or creation > self._lastCreation:
+                self._lastCreation = creation
+                self._lastCreationIds = {itemId}
+            elif creation == self._lastCreation:
+                self._lastCreationIds.add(itemId)
+
+        return newItems
+
+    def readNew(self, getKeyFunc, excludeKeys=()):
+        """ Read the new items and return an OrderedDict (key -> item) with
+        them and with the ones returned before whose key is not yet in
+        excludeKeys (e.g. the micDict of the items already processed).
+        """
+        for item in self.read():
+            self._pending[getKeyFunc(item)] = item
+
+        for key in [k for k in self._pending if k in excludeKeys]:
+            del self._pending[key]
+
+        return OrderedDict(self._pending)
+
+
+class ProgressLedger:
+    """ Bookkeeping of the items processed by a streaming protocol.
+
+    The ids of the done and failed items are kept in memory (sets) backed
+    by append-only text files with one id per line (e.g. DONE/all.TXT).
+    Only the lines appended to the files since the last read are parsed.
+    The items in progress are only kept in memory.
+    """
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, doneFile, failedFile=None):
+        self._files = {self.DONE: doneFile, self.FAILED: failedFile}
+        self._ids = {self.DONE: set(), self.FAILED: set()}
+        self._offsets = {self.DONE: 0, self.FAILED: 0}
+        self._inProgress = set()
+
+    def _load(self, state):
+        """ Read the ids appended to the file of this state since the last
+        read and return the set of ids. """
+        fn = self._files[state]
+        ids = self._ids[state]
+        if fn and os.path.exists(fn) and os.path.getsize(fn) > self._offsets[state]:
+            with open(fn, 'rb') as f:
+                f.seek(self._offsets[state])
+                data = f.read()
+            # a last line without newline could still be being written
+            data = data[:data.rfind(b'\n') + 1]
+            ids.update(int(line) for line in data.split() if line)
+            self._offsets[state] += len(data)
+        return ids
+
+    def _write(self, state, itemIds):
+        fn = self._files[state]
+        itemIds = [i for i in itemIds if i not in self._load(state)]
+        if not itemIds:
+            return
+        pwutils.makeFilePath(fn)
+        with open(fn, 'a') as f:
+            f.write(''.join('%d\n' % i for i in itemIds))
+        self._load(state)
+        self._inProgress.difference_update(itemIds)
+
+    def getDone(self):
+        """ Return the set of done ids. """
+        return self._load(self.DONE)
+
+    def getFailed(self):
+        """ Return the set of failed ids. """
+        return self._load(self.FAILED)
+
+    def getInProgress(self):
+        return self._inProgress
+
+    def isDone(self, itemId):
+        return itemId in self.getDone()
+
+    def isFailed(self, itemId):
+        return itemId in self.getFailed()
+
+    def setDone(self, itemIds):
+        """ Append the given ids to the done ones. """
+        self._write(self.DONE, itemIds)
+
+    def setFailed(self, itemIds):
+        """ Append the given ids to the failed ones. """
+        self._write(self.FAILED, itemIds)
+
+    def setInProgress(self, itemIds):
+        self._inProgress.update(itemIds)
+
+    def getNewDone(self, items, getMarkerFunc=None, isDoneFunc=None):
+        """ Return the items (not done yet) that have finished now.
+        Params:
+            items: items to check, with their ids
+            getMarkerFunc: function returning the file that marks an item
+                as finished, the folders of these files are listed only once.
+            isDoneFunc: used instead of the marker files if given.
+        """
+        done = self.getDone()
+        pending = [item for item in items if item.getObjId() not in done]
+
+        if isDoneFunc is not None:
+            return [item for item in pending if isDoneFunc(item)]
+
+        listings = {}
+
+        def _hasMarker(item):
+            folder, name = os.path.split(getMarkerFunc(item))
+            if folder not in listings:
+                listings[folder] = (set(os.listdir(folder))
+                                    if os.path.isdir(folder) else set())
+            return name in listings[folder]
+
+        return [item for item in pending if _hasMarker(item)]
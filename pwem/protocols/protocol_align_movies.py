@@ -27,9 +27,15 @@
 # **************************************************************************
 import enum
 import os
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
 
+import mrcfile
+import numpy as np
+from tifffile import TiffFile
+
 import pyworkflow.object as pwobj
 import pyworkflow.utils as pwutils
 from pyworkflow.gui.plotter import Plotter
@@ -272,9 +278,12 @@ class ProtAlignMovies(ProtProcessMovies):
 
         # Load previously done items (from text file)
         doneList = self._readDoneList()
-        # Check for newly done items
-        newDone = [m for m in self.listOfMovies
-                   if m.getObjId() not in doneList and self._isMovieDone(m)]
+        # Check for newly done items, listing the markers folder once
+        # unless _isMovieDone is redefined
+        isMovieDone = (None if type(self)._isMovieDone is ProtProcessMovies._isMovieDone
+                       else self._isMovieDone)
+        newDone = self._getProgressLedger().getNewDone(
+            self.listOfMovies, self._getMovieDone, isMovieDone)
 
         # Update the file with the newly done movies
         # or exit from the function if no new done movies
@@ -644,8 +653,16 @@ class ProtAlignMovies(ProtProcessMovies):
 
         return outputFn
 
-    def correctGain(self, movieFn, outputFn, gainFn=None, darkFn=None):
-        """correct a movie with both gain and dark images"""
+    def correctGain(self, movieFn, outputFn, gainFn=None, darkFn=None,
+                    threads=1):
+        """correct a movie with both gain and dark images. MRC outputs from
+        MRC or TIFF movies are corrected with numpy (see correctGainStack),
+        other formats are corrected frame by frame through xmipp. """
+        if canCorrectGainStack(movieFn, outputFn, gainFn, darkFn):
+            correctGainStack(movieFn, outputFn, gainFn, darkFn,
+                             threads=threads)
+            return
+
         ih = emlib.image.ImageHandler()
         _, _, z, n = ih.getDimensions(movieFn)
         numberOfFrames = max(z, n)  # in case of wrong mrc stacks as volumes
@@ -683,19 +700,115 @@ class ProtAlignMovies(ProtProcessMovies):
 
     def _writeFailedList(self, movieList):
         """ Write to a text file the items that have failed. """
-        with open(self._getAllFailed(), 'a') as f:
-            for movie in movieList:
-                f.write('%d\n' % movie.getObjId())
+        self._getProgressLedger().setFailed([movie.getObjId() for movie in movieList])
 
     def _readFailedList(self):
-        """ Read from a text file the id's of the items that have failed. """
-        failedFile = self._getAllFailed()
-        failedList = []
-        if os.path.exists(failedFile):
-            with open(failedFile) as f:
-                failedList += [int(line.strip()) for line in f]
-
-        return failedList
+        """ Return the list of ids (sorted) of the items that have failed. """
+        return sorted(self._getProgressLedger().getFailed())
+
+
+GAIN_STACK_INPUTS = ['mrc', 'mrcs', 'st', 'tif', 'tiff']
+GAIN_STACK_OUTPUTS = ['mrc', 'mrcs', 'st']
+
+
+def canCorrectGainStack(movieFn, outputFn, gainFn=None, darkFn=None):
+    """ Return True if correctGainStack can deal with these files """
+    from pwem.emlib.image.image_readers import (ImageReadersRegistry,
+                                                XMIPPImageReader)
+
+    def _ext(fn):
+        return pwutils.getExt(fn)[1:].lower()
+
+    return (_ext(movieFn) in GAIN_STACK_INPUTS and
+            _ext(outputFn) in GAIN_STACK_OUTPUTS and
+            all(ImageReadersRegistry.getReader(fn) is not XMIPPImageReader
+                for fn in [gainFn, darkFn] if fn))
+
+
+def _readFloatImage(fn):
+    """ Read a single image (gain or dark) as a float32 array """
+    if not fn:
+        return None
+    from pwem.emlib.image.image_readers import ImageReadersRegistry
+    data = np.squeeze(ImageReadersRegistry.getReader(fn).open(fn))
+    if data.ndim != 2:
+        raise Exception("%s is not a single image, shape: %s"
+                        % (fn, data.shape))
+    return np.asarray(data, dtype=np.float32)
+
+
+def correctGainStack(movieFn, outputFn, gainFn=None, darkFn=None,
+                     chunkSize=4, threads=1):
+    """ Correct a MRC or TIFF movie: (frame - dark) * gain, writing a float32
+    MRC stack. The gain and dark are read once, MRC frames are memory mapped
+    and TIFF ones decoded by chunks of frames, that are corrected in place in
+    the preallocated output. Chunks are processed by several threads if
+    threads > 1. """
+    from pwem.emlib.image.image_readers import MRCImageReader
+
+    gain = _readFloatImage(gainFn)
+    dark = _readFloatImage(darkFn)
+    voxelSize = None
+
+    if pwutils.getExt(movieFn).lower() in ['.tif', '.tiff']:
+        tif = TiffFile(movieFn)
+        numberOfFrames = len(tif.pages)
+        shape = tif.pages[0].shape
+        lock = threading.Lock()
+
+        def _readFrames(start, end):
+            with lock:
+                return tif.asarray(key=range(start, end)).reshape((-1,) + shape)
+
+        closeInput = tif.close
+    else:
+        mrc = mrcfile.mmap(movieFn, mode='r', permissive=True)
+        frames = mrc.data if mrc.data.ndim == 3 else mrc.data[None]
+        numberOfFrames, shape = len(frames), frames.shape[1:]
+        voxelSize = mrc.voxel_size
+
+        def _readFrames(start, end):
+            return frames[start:end]
+
+        closeInput = mrc.close
+
+    for img, name in [(gain, 'gain'), (dark, 'dark')]:
+        if img is not None and img.shape != shape:
+            closeInput()
+            raise Exception("The %s image shape %s does not match the movie "
+                            "frames shape %s" % (name, img.shape, shape))
+
+    MRCImageReader.mmapPool.discard(outputFn)
+    try:
+        with mrcfile.new_mmap(outputFn, shape=(numberOfFrames,) + shape,
+                              mrc_mode=2, overwrite=True) as out:
+
+            def _correct(start):
+                end = min(start + chunkSize, numberOfFrames)
+                corrected = out.data[start:end]
+                inputFrames = _readFrames(start, end)
+                if dark is not None:
+                    np.subtract(inputFrames, dark, out=corrected)
+                    if gain is not None:
+                        np.multiply(corrected, gain, out=corrected)
+                elif gain is not None:
+                    np.multiply(inputFrames, gain, out=corrected)
+                else:
+                    corrected[:] = inputFrames
+
+            starts = range(0, numberOfFrames, chunkSize)
+            if threads > 1:
+                with ThreadPoolExecutor(threads) as executor:
+                    list(executor.map(_correct, starts))
+            else:
+                for start in starts:
+                    _correct(start)
+
+            out.set_image_stack()
+            if voxelSize is not None:
+                out.voxel_size = voxelSize
+    finally:
+        closeInput()
 
 
 def createAlignmentPlot(meanX, meanY):
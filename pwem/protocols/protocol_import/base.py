@@ -260,11 +260,15 @@ class ProtImportFiles(ProtImport):
         """ Overwrite in subclasses """
         return False
 
-    def iterFiles(self):
+    def iterFiles(self, filePaths=None):
         """ Iterate through the files matched with the pattern.
         Provide the fileName and fileId.
+        Params:
+            filePaths: if not None, the files to iterate, otherwise
+                all the files matching the pattern.
         """
-        filePaths = self.getMatchFiles()
+        if filePaths is None:
+            filePaths = self.getMatchFiles()
 
         for fileName in filePaths:
             if self._idRegex:
@@ -0,0 +1,105 @@
+# **************************************************************************
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Index of the files blacklisted in the import of micrographs and movies.
+"""
+
+import os
+import re
+
+
+class BlacklistIndex:
+    """ Answer if a file is blacklisted by a set of images or by a list of
+    file names (or regular expressions) without iterating over them.
+
+    Files of the set are indexed by their base name and, for links, by the
+    path they point to. The set is read again only when its file has been
+    modified, and then only the rows added since the previous read, so the
+    index follows a blacklist set that grows in streaming.
+    """
+
+    def __init__(self, blacklistSet=None, items=(), useRegexps=False):
+        """
+        :param blacklistSet: set of images whose files are blacklisted
+        :param items: file names or regular expressions (if useRegexps)
+            read from the blacklist file
+        :param useRegexps: items are regular expressions matching the
+            start of the file names, otherwise file names are blacklisted
+            if contained in one of the items
+        """
+        self._blacklistSet = blacklistSet
+        self._names = set()  # base names of the set files
+        self._links = set()  # paths pointed by the set files
+        self._lastId = 0
+        self._setMtime = None
+
+        items = [item for item in items if item]
+        if useRegexps:
+            self._regexps = [(item, re.compile(item)) for item in items]
+            self._items = None
+        else:
+            self._regexps = []
+            # File names can not contain line breaks, so the name is
+            # contained in an item if it is contained in all of them joined
+            self._items = '\n'.join(items)
+
+    def _update(self):
+        """ Index the files added to the set since the previous call """
+        fileName = self._blacklistSet.getFileName()
+        # Rows may be in the write-ahead log, depending on the journal mode
+        mtime = tuple(os.stat(fn).st_mtime_ns for fn in [fileName, fileName + '-wal']
+                      if os.path.exists(fn))
+        if not mtime or mtime == self._setMtime:
+            return
+        self._setMtime = mtime
+
+        rows = self._blacklistSet.getColumnValues(['id', '_filename'],
+                                                  where='id>%d' % self._lastId)
+        for objId, fn in rows:
+            self._lastId = max(self._lastId, objId)
+            if fn:
+                self._names.add(os.path.basename(fn))
+                if os.path.islink(fn):
+                    target = os.readlink(fn)
+                    self._links.update([target, os.path.abspath(
+                        os.path.join(os.path.dirname(fn), target))])
+
+    def inSet(self, fileName, uniqueName):
+        """ Return True if fileName, with the unique name given when it is
+        imported, is a file of the blacklist set """
+        if self._blacklistSet is None:
+            return False
+        self._update()
+        return (uniqueName in self._names or fileName in self._links or
+                os.path.abspath(fileName) in self._links)
+
+    def matchItem(self, fileName):
+        """ Return the item (name or regular expression) blacklisting
+        fileName, or None """
+        for item, regexp in self._regexps:
+            if regexp.match(fileName):
+                return item
+        if self._items and fileName in self._items:
+            return fileName
+        return None
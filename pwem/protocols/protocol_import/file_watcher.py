@@ -0,0 +1,234 @@
+# **************************************************************************
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Incremental discovery of the files matching a pattern, used by the
+streaming imports instead of globbing the whole pattern in every check.
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import re
+import stat
+import struct
+import sys
+import time
+from glob import glob, has_magic
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks (sys/inotify.h)
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+
+class Inotify:
+    """ Minimal inotify binding (through ctypes) reporting the names of the
+    entries created in the watched directories. """
+    EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._addWatch = libc.inotify_add_watch
+        self._addWatch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}  # {watch descriptor: directory}
+
+    @classmethod
+    def create(cls):
+        """ Return a new instance, or None if inotify is not available """
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError) as e:
+            logger.debug("inotify not available: %s" % e)
+            return None
+
+    def addWatch(self, directory):
+        """ Watch the new entries of directory, return False on failure
+        (e.g. when the limit of watches is reached) """
+        wd = self._addWatch(self._fd, os.fsencode(directory or '.'),
+                            IN_CREATE | IN_MOVED_TO)
+        if wd < 0:
+            logger.debug("Can not watch %s: %s"
+                         % (directory, os.strerror(ctypes.get_errno())))
+            return False
+        self._dirs[wd] = directory
+        return True
+
+    def readEvents(self):
+        """ Return a dict {directory: set of new names} with the pending
+        events, or None if some events were lost (queue overflow). """
+        events = {}
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events = None
+                elif mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                elif events is not None and wd in self._dirs:
+                    events.setdefault(self._dirs[wd], set()).add(name)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class FileWatcher:
+    """ Keep an index of the files matching a glob pattern and report each
+    new one once, when it has not been modified for stableTime seconds.
+
+    Only the directories of the pattern are listed in each poll, and only if
+    they changed: through inotify events when available, and otherwise when
+    their modification time changed. The modification time is also checked
+    for watched directories, since inotify does not see the files written by
+    other hosts in network file systems. Already reported files are never
+    listed or checked again, so the cost of a poll does not grow with the
+    number of files imported.
+
+    The index is only kept in memory, so the first poll after a restart
+    lists the whole pattern again and the files already imported are
+    skipped by the protocol. A stored index could hide the files reported
+    but not imported when the previous run stopped. Files are stable
+    when their modification time is old enough, the size is not tracked.
+    """
+    # Directories modified less than these seconds before being listed are
+    # listed again, files created in the same time tick do not change it
+    MTIME_MARGIN = 2
+
+    def __init__(self, pattern, stableTime=0, useInotify=True):
+        """
+        :param pattern: glob pattern of the files, wildcards are allowed in
+            the directories part as well
+        :param stableTime: seconds without modifications before reporting
+            a new file
+        :param useInotify: use inotify events if available
+        """
+        self._dirPattern, namePattern = os.path.split(pattern)
+        self._nameRegex = re.compile(fnmatch.translate(namePattern))
+        # As glob, hidden files only match patterns starting with a dot
+        self._matchHidden = namePattern.startswith('.')
+        self._stableTime = stableTime
+        self._seen = set()  # paths already reported or ignored
+        self._pending = set()  # paths matched that are still being written
+        self._dirs = {}  # {directory: (mtime, time of the last listing)}
+        self._inotify = Inotify.create() if useInotify else None
+        self.polls = 0
+
+    def poll(self):
+        """ Return the sorted list of the new files that are stable """
+        now = time.time()
+        events = self._inotify.readEvents() if self._inotify else {}
+        candidates = set(self._pending)
+        for directory in self._listDirectories():
+            candidates.update(self._newPaths(directory, events, now))
+
+        newFiles = []
+        for path in candidates:
+            try:
+                st = os.stat(path)
+            except OSError:  # removed or broken link
+                self._pending.discard(path)
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                self._seen.add(path)
+            elif now - st.st_mtime >= self._stableTime:
+                self._pending.discard(path)
+                self._seen.add(path)
+                newFiles.append(path)
+            else:
+                self._pending.add(path)
+        self.polls += 1
+
+        return sorted(newFiles)
+
+    def hasPending(self):
+        """ Return True if some matching files are still being written """
+        return bool(self._pending)
+
+    def resubmit(self, path):
+        """ Report again this file in the next polls, once it is stable """
+        self._seen.discard(path)
+        self._pending.add(path)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def _listDirectories(self):
+        if has_magic(self._dirPattern):
+            return [d for d in glob(self._dirPattern) if os.path.isdir(d)]
+        return [self._dirPattern]
+
+    def _newPaths(self, directory, events, now):
+        """ Return the paths of directory matching the pattern and
+        not seen before """
+        try:
+            mtime = os.stat(directory or '.').st_mtime
+        except OSError:
+            self._dirs.pop(directory, None)
+            return []
+
+        last = self._dirs.get(directory)
+        names = None if events is None else events.get(directory)
+        if last is None:
+            if self._inotify is not None:
+                self._inotify.addWatch(directory)
+        elif events is not None and not names:
+            lastMtime, lastListing = last
+            if mtime == lastMtime and lastListing - lastMtime >= self.MTIME_MARGIN:
+                return []
+
+        if last is None or not names:
+            names = os.listdir(directory or '.')
+            self._dirs[directory] = (mtime, now)
+        # else the modification time is not updated, so the directory is
+        # listed once the events stop, in case some files were not notified
+
+        paths = []
+        for name in names:
+            if name.startswith('.') and not self._matchHidden:
+                continue
+            path = os.path.join(directory, name)
+            if (path not in self._seen and path not in self._pending
+                    and self._nameRegex.match(name)):
+                paths.append(path)
+        return paths
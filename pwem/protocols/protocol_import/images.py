@@ -38,9 +38,11 @@ import pyworkflow.protocol.params as params
 from pwem import cleanFileName, Config
 
 from pwem.emlib.image import ImageHandler
+from pwem.emlib.image.image_readers import ImageReadersRegistry
 from pwem.objects import Acquisition
 
 from .base import ProtImportFiles
+from .file_watcher import FileWatcher
 
 
 class ProtImportImages(ProtImportFiles):
@@ -135,7 +137,13 @@ class ProtImportImages(ProtImportFiles):
         copyOrLink = self.getCopyOrLink()
         alreadyWarned = False  # Use this flag to warn only once
 
-        for i, (fileName, fileId) in enumerate(self.iterFiles()):
+        files = list(self.iterFiles())
+        if self._checkStacks:
+            # Read the headers of all files concurrently, they are cached
+            # for the probe calls below
+            ImageReadersRegistry.probeMany([fn for fn, _ in files])
+
+        for i, (fileName, fileId) in enumerate(files):
             if self.isBlacklisted(fileName):
                 continue
             uniqueFn = self._getUniqueFileName(fileName)
@@ -151,7 +159,7 @@ class ProtImportImages(ProtImportFiles):
             self.handleImgHed(copyOrLink, fileName, dst)
             
             if self._checkStacks:
-                _, _, _, n = imgh.getDimensions(dst)
+                _, _, _, n = ImageReadersRegistry.probe(fileName)[0]
                 
             if n > 1:
                 for index in range(1, n+1):
@@ -236,87 +244,102 @@ class ProtImportImages(ProtImportFiles):
             timeout = timedelta(seconds=5)
             fileTimeout = timedelta(seconds=5)
 
-        while not finished:
-            time.sleep(Config.SCIPION_EM_NEW_FILE_CHECK_SEC)  # wait some seconds before check for new files(10 seconds by default)
-            someNew = False
-            someAdded = False
-
-            for fileName, uniqueFn, fileId in self.iterNewInputFiles():
-                someNew = True
-                if self.fileModified(fileName, fileTimeout):
-                    continue
+        # Only new files are listed in each check, see _getFileWatcher
+        self._fileWatcher = None
+        self._fileWatcherStableTime = fileTimeout.total_seconds()
+        # Unique names given in this run to each file path
+        self._uniqueFnPaths = {}
+
+        try:
+            while not finished:
+                time.sleep(Config.SCIPION_EM_NEW_FILE_CHECK_SEC)  # wait some seconds before check for new files(10 seconds by default)
+                someNew = False
+                someAdded = False
+
+                for fileName, uniqueFn, fileId in self.iterNewInputFiles():
+                    someNew = True
+                    if self.fileModified(fileName, fileTimeout):
+                        if self._fileWatcher is not None:
+                            self._fileWatcher.resubmit(fileName)
+                        continue
                 
-                dst = self._getExtraPath(uniqueFn)
-                self.importedFiles.add(uniqueFn)
-                dst, alreadyWarned = cleanFileName(dst, not alreadyWarned)
-
-                copyOrLink(fileName, dst)
-
-                self.debug('Importing file: %s' % fileName)
-                self.debug("uniqueFn: %s" % uniqueFn)
-                self.debug("dst Fn: %s" % dst)
-
-                if self._checkStacks:
-                    _, _, _, n = imgh.getDimensions(dst)
-
-                someAdded = True
-                self.debug('Appending file to DB...')
-                if self.importedFiles:  # enable append after first append
-                    imgSet.enableAppend()
-
-                if n > 1:
-                    for index in range(1, n+1):
-                        img.cleanObjId()
-                        img.setMicId(fileId)
+                    dst = self._getExtraPath(uniqueFn)
+                    self.importedFiles.add(uniqueFn)
+                    dst, alreadyWarned = cleanFileName(dst, not alreadyWarned)
+
+                    copyOrLink(fileName, dst)
+
+                    self.debug('Importing file: %s' % fileName)
+                    self.debug("uniqueFn: %s" % uniqueFn)
+                    self.debug("dst Fn: %s" % dst)
+
+                    if self._checkStacks:
+                        _, _, _, n = imgh.getDimensions(dst)
+
+                    someAdded = True
+                    self.debug('Appending file to DB...')
+                    if self.importedFiles:  # enable append after first append
+                        imgSet.enableAppend()
+
+                    if n > 1:
+                        for index in range(1, n+1):
+                            img.cleanObjId()
+                            img.setMicId(fileId)
+                            img.setFileName(dst)
+                            img.setIndex(index)
+                            self._addImageToSet(img, imgSet)
+                    else:
+                        img.setObjId(fileId)
                         img.setFileName(dst)
-                        img.setIndex(index)
+                        # Fill the micName if img is either a Micrograph or a Movie
+                        uniqueFn = uniqueFn.replace(' ', '')
+                        self.debug("FILENAME TO fillMicName: %s" % uniqueFn)
+                        self._fillMicName(img, uniqueFn)
                         self._addImageToSet(img, imgSet)
-                else:
-                    img.setObjId(fileId)
-                    img.setFileName(dst)
-                    # Fill the micName if img is either a Micrograph or a Movie
-                    uniqueFn = uniqueFn.replace(' ', '')
-                    self.debug("FILENAME TO fillMicName: %s" % uniqueFn)
-                    self._fillMicName(img, uniqueFn)
-                    self._addImageToSet(img, imgSet)
 
-                outFiles.append(dst)
-                self.debug('After append. Files: %d' % len(outFiles))
-
-            if someAdded:
-                self.debug('Updating output...')
-                self._updateOutputSet(outputName, imgSet,
-                                      state=imgSet.STREAM_OPEN)
-                self.debug('Update Done.')
-
-            self.debug('Checking if finished...someNew: %s' % someNew)
-
-            now = datetime.now()
-
-            if not someNew:
-                # If there are no new detected files, we should check the
-                # inactivity time elapsed (from last event to now) and
-                # if it is greater than the defined timeout, we conclude
-                # the import and close the output set
-                # Another option is to check if the protocol have some
-                # special stop condition, this can be used to manually stop
-                # some protocols such as import movies
-                finished = (now - lastDetectedChange > timeout or
-                            self.stopStreamingFileExists())
-                self.debug("Checking if finished:")
-                self.debug("   Now - Last Change: %s"
-                           % pwutils.prettyDelta(now - lastDetectedChange))
-                self.debug("Finished: %s" % finished)
-            else:
-                # If we have detected some files, we should update
-                # the timestamp of the last event
-                lastDetectedChange = now
+                    outFiles.append(dst)
+                    self.debug('After append. Files: %d' % len(outFiles))
+
+                # Files still being written are also new ones
+                someNew = someNew or (self._fileWatcher is not None and
+                                      self._fileWatcher.hasPending())
+
+                if someAdded:
+                    self.debug('Updating output...')
+                    self._updateOutputSet(outputName, imgSet,
+                                          state=imgSet.STREAM_OPEN)
+                    self.debug('Update Done.')
+
+                self.debug('Checking if finished...someNew: %s' % someNew)
+
+                now = datetime.now()
+
+                if not someNew:
+                    # If there are no new detected files, we should check the
+                    # inactivity time elapsed (from last event to now) and
+                    # if it is greater than the defined timeout, we conclude
+                    # the import and close the output set
+                    # Another option is to check if the protocol have some
+                    # special stop condition, this can be used to manually stop
+                    # some protocols such as import movies
+                    finished = (now - lastDetectedChange > timeout or
+                                self.stopStreamingFileExists())
+                    self.debug("Checking if finished:")
+                    self.debug("   Now - Last Change: %s"
+                               % pwutils.prettyDelta(now - lastDetectedChange))
+                    self.debug("Finished: %s" % finished)
+                else:
+                    # If we have detected some files, we should update
+                    # the timestamp of the last event
+                    lastDetectedChange = now
 
-            for fileName in self.getFileNamesList():
-                self.fileNamesList[fileName] = False
+                for fileName in self.getFileNamesList():
+                    self.fileNamesList[fileName] = False
 
-        self._updateOutputSet(outputName, imgSet,
-                              state=imgSet.STREAM_CLOSED)
+            self._updateOutputSet(outputName, imgSet,
+                                  state=imgSet.STREAM_CLOSED)
+        finally:
+            self._closeFileWatcher()
 
         self._cleanUp()
 
@@ -479,13 +502,37 @@ class ProtImportImages(ProtImportFiles):
     def _setupFirstImage(self, img, imgSet):
         pass
 
+    def _getFileWatcher(self):
+        """ Return the FileWatcher of the pattern, created on first use,
+        see importImagesStreamStep """
+        if getattr(self, '_fileWatcher', None) is None:
+            self._fileWatcher = FileWatcher(
+                self.getPattern(),
+                stableTime=getattr(self, '_fileWatcherStableTime', 0))
+        return self._fileWatcher
+
+    def _closeFileWatcher(self):
+        if getattr(self, '_fileWatcher', None) is not None:
+            self._fileWatcher.close()
+            self._fileWatcher = None
+
     def iterNewInputFiles(self):
         """ Iterate over input files that have not been imported.
-        This function uses the self.importedFiles dict.
+        This function uses the self.importedFiles dict and only checks the
+        files found since the previous call (see FileWatcher).
         """
-        for fileName, fileId in self.iterFiles():
-            # If file already imported or blacklisted,  skip it
+        fileWatcher = self._getFileWatcher()
+        uniqueFnPaths = getattr(self, '_uniqueFnPaths', {})
+
+        for fileName, fileId in self.iterFiles(fileWatcher.poll()):
             uniqueFn = self._getUniqueFileName(fileName)
+            if uniqueFnPaths.get(uniqueFn, fileName) != fileName:
+                # A new file with the same name of another one found in this
+                # run, files imported in previous runs keep their names
+                self.getFileNamesList()[os.path.basename(fileName)] = True
+                uniqueFn = self._getUniqueFileName(fileName)
+            uniqueFnPaths.setdefault(uniqueFn, fileName)
+            # If file already imported or blacklisted,  skip it
             if (uniqueFn not in self.importedFiles) and (not self.isBlacklisted(fileName)):
                 yield fileName, uniqueFn, fileId
 
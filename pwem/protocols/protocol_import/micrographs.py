@@ -25,6 +25,7 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # **************************************************************************
+from concurrent.futures import ProcessPoolExecutor
 import enum
 import os
 from os.path import join, basename
@@ -41,6 +42,7 @@ from pwem.emlib.image import ImageHandler
 import pwem.constants as emcts
 
 from .images import ProtImportImages
+from .blacklist import BlacklistIndex
 from ...objects import SetOfMicrographs, SetOfMovies
 
 
@@ -238,23 +240,29 @@ class ProtImportMicBase(ProtImportImages):
             self._blacklistedItems = set()
         return self._blacklistedItems
 
+    def getBlacklistIndex(self):
+        """ Return the BlacklistIndex of the blacklist set and file """
+        if not hasattr(self, '_blacklistIndex'):
+            self._blacklistIndex = BlacklistIndex(
+                self.blacklistSet.get(), self.getItemsToBlacklistFromFile(),
+                useRegexps=self.useRegexps.get())
+        return self._blacklistIndex
+
     def isBlacklisted(self, fileName):
         # check if already blacklisted
         blacklistedItems = self.getBlacklistedItems()
         if fileName in blacklistedItems:
             return True
 
-        # Blacklisted by set
-        blacklistSet = self.blacklistSet.get()
-        if blacklistSet is not None:
-            for img in blacklistSet:
-                blacklistFileName = img.getFileName()
-                if ((os.path.islink(blacklistFileName)
-                     and fileName == os.readlink(blacklistFileName))
-                        or (self._getUniqueFileName(fileName) == os.path.basename(blacklistFileName))):
-                    self.info("Blacklist warning: %s is blacklisted by the input set" % fileName)
-                    blacklistedItems.add(fileName)
-                    return True
+        blacklistIndex = self.getBlacklistIndex()
+
+        # Blacklisted by set (the unique name marks the file name as used,
+        # so it is only computed if there is a set)
+        if (self.blacklistSet.get() is not None and
+                blacklistIndex.inSet(fileName, self._getUniqueFileName(fileName))):
+            self.info("Blacklist warning: %s is blacklisted by the input set" % fileName)
+            blacklistedItems.add(fileName)
+            return True
 
         # Blacklisted by date
         blacklistDateFrom = self.blacklistDateFrom.get()
@@ -284,20 +292,44 @@ class ProtImportMicBase(ProtImportImages):
                     return True
 
         # Blacklisted by file
-        items2blacklist = self.getItemsToBlacklistFromFile()
-        for item2blacklist in items2blacklist:
+        item2blacklist = blacklistIndex.matchItem(fileName)
+        if item2blacklist is not None:
             if self.useRegexps.get():
-                if re.match(item2blacklist, fileName):
-                    self.info("Blacklist warning: %s matched blacklist regexp %s"
-                              % (fileName, item2blacklist))
-                    blacklistedItems.add(fileName)
-                    return True
-            elif fileName in item2blacklist:
+                self.info("Blacklist warning: %s matched blacklist regexp %s"
+                          % (fileName, item2blacklist))
+            else:
                 self.info("Blacklist warning: %s is blacklisted " % fileName)
-                blacklistedItems.add(fileName)
-                return True
+            blacklistedItems.add(fileName)
+            return True
         return False
 
+
+def createMovieStack(frameFns, movieFn, deleteFrames=False):
+    """ Write the movie stack movieFn with the frame files, in order. MRC
+    stacks of frames readable without Xmipp are preallocated from the first
+    frame and written in blocks of consecutive frames. """
+    from pwem.emlib.image.image_readers import (ImageReadersRegistry,
+                                                MRCImageReader,
+                                                XMIPPImageReader)
+    pwutils.cleanPath(movieFn)
+
+    if (ImageReadersRegistry.getReader(movieFn) is MRCImageReader and
+            all(ImageReadersRegistry.getReader(fn) is not XMIPPImageReader
+                for fn in frameFns)):
+        MRCImageReader.writeLocations(movieFn, [(1, fn) for fn in frameFns])
+        for frameFn in frameFns:
+            MRCImageReader.mmapPool.discard(frameFn)
+    else:
+        movieOut = movieFn + ":mrcs" if movieFn.endswith("mrc") else movieFn
+        ih = ImageHandler()
+        for i, frameFn in enumerate(frameFns):
+            ih.convert(frameFn, (i + 1, movieOut))
+
+    if deleteFrames:
+        for frameFn in frameFns:
+            pwutils.cleanPath(frameFn)
+
+
 class ImportMicsOutput(enum.Enum):
     outputMicrographs = SetOfMicrographs
 
@@ -535,6 +567,8 @@ class ProtImportMovies(ProtImportMicBase):
                                        "imported that you want to exclude for "
                                        "this import.")
 
+        form.addParallelSection(threads=1, mpi=0)
+
     # --------------------------- INSERT functions ----------------------------
     def _insertAllSteps(self):
         # Only the import movies has property 'inputIndividualFrames'
@@ -682,55 +716,55 @@ class ProtImportMovies(ProtImportMicBase):
             frameDict[prefix].append((frameid, fileName))
 
         suffix = self.movieSuffix.get()
-        ih = ImageHandler()
 
-        for movieFn in self.createdStacks:
+        # Yield the stacks created in previous calls in a deterministic order
+        for movieFn in sorted(self.createdStacks):
             uniqueFn = basename(movieFn)
             if uniqueFn not in self.importedFiles:
                 yield movieFn, uniqueFn, None
 
-        def checkMovie():
-            for k, v in frameDict.items():
-                moviePath = os.path.dirname(k)
-                movieFn = join(moviePath + "/", self._getUniqueFileName(k) +
-                               suffix)
-
-                if self.writeMoviesInProject:
-                    movieFn = self._getExtraPath(os.path.basename(movieFn))
-
-                if (movieFn not in self.importedFiles and
-                        movieFn not in self.createdStacks and
-                        len(v) == self.numberOfIndividualFrames):
-                    movieOut = movieFn
-
-                    if movieOut.endswith("mrc"):
-                        movieOut += ":mrcs"
-
-                    # By default we will write the movie stacks
-                    # unless we are in continue mode and the file exists
-                    writeMovie = True
-                    if self.isContinued() and os.path.exists(movieFn):
-                        self.info("Skipping movie stack: %s, seems to be done"
-                                  % movieFn)
-                        writeMovie = False
-
-                    if writeMovie:
-                        self.info("Writing movie stack: %s" % movieFn)
-                        # Remove the output file if exists
-                        pwutils.cleanPath(movieFn)
-
-                        for i, frame in enumerate(sorted(v, key=lambda x: x[0])):
-                            frameFn = frame[1]  # Frame name stored previously
-                            ih.convert(frameFn, (i + 1, movieOut))
-
-                            if self.deleteFrames:
-                                pwutils.cleanPath(frameFn)
-
-                    # Now return the newly created movie file as imported file
+        # Complete movies to write in this call, at most one per thread
+        newStacks = []
+        for k, v in frameDict.items():
+            if len(newStacks) == max(self.numberOfThreads.get(), 1):
+                break
+            moviePath = os.path.dirname(k)
+            movieFn = join(moviePath + "/", self._getUniqueFileName(k) +
+                           suffix)
+
+            if self.writeMoviesInProject:
+                movieFn = self._getExtraPath(os.path.basename(movieFn))
+
+            if (movieFn not in self.importedFiles and
+                    movieFn not in self.createdStacks and
+                    len(v) == self.numberOfIndividualFrames):
+                # By default we will write the movie stacks
+                # unless we are in continue mode and the file exists
+                if self.isContinued() and os.path.exists(movieFn):
+                    self.info("Skipping movie stack: %s, seems to be done"
+                              % movieFn)
                     self.createdStacks.add(movieFn)
-                    return
+                else:
+                    frameFns = [frame[1] for frame in
+                                sorted(v, key=lambda x: x[0])]
+                    newStacks.append((frameFns, movieFn))
+
+        if len(newStacks) > 1:
+            with ProcessPoolExecutor(len(newStacks)) as executor:
+                futures = [executor.submit(createMovieStack, frameFns,
+                                           movieFn, self.deleteFrames.get())
+                           for frameFns, movieFn in newStacks]
+                for (_, movieFn), future in zip(newStacks, futures):
+                    self.info("Writing movie stack: %s" % movieFn)
+                    future.result()
+        else:
+            for frameFns, movieFn in newStacks:
+                self.info("Writing movie stack: %s" % movieFn)
+                createMovieStack(frameFns, movieFn, self.deleteFrames.get())
 
-        checkMovie()
+        # Now the newly created movie files will be returned as imported
+        # files in the next call
+        self.createdStacks.update(movieFn for _, movieFn in newStacks)
 
     def ignoreCopy(self, source, dest):
         pass
@@ -562,8 +562,11 @@ class ProtCTFMicrographs(ProtMicrographs):
         # Check for newly done items
         listOfMics = self.micDict.values()
         nMics = len(listOfMics)
-        newDone = [m for m in listOfMics
-                   if m.getObjId() not in doneList and self._isMicDone(m)]
+        # listing the markers folder once unless _isMicDone is redefined
+        isMicDone = (None if type(self)._isMicDone is ProtCTFMicrographs._isMicDone
+                     else self._isMicDone)
+        newDone = self._getProgressLedger().getNewDone(
+            listOfMics, self._getMicrographDone, isMicDone)
 
         # Update the file with the newly done mics
         # or exit from the function if no new done mics
@@ -613,23 +616,18 @@ class ProtCTFMicrographs(ProtMicrographs):
     def _loadSet(self, inputSet, SetClass, getKeyFunc):
         """ Load a given input set if their items are not already present
         in the self.micDict.
+        Only the items added since the previous call (or not yet in
+        self.micDict) are read, see StreamingSetReader.
         This can be used to load new micrographs for estimation as well as
         new CTF (if used) in streaming.
         """
         setFn = inputSet.getFileName()
         self.debug("Loading input db: %s" % setFn)
-        updatedSet = SetClass(filename=setFn)
-        updatedSet.loadAllProperties()
-        newItemDict = OrderedDict()
-        for item in updatedSet:
-            micKey = getKeyFunc(item)
-            if micKey not in self.micDict:
-                newItemDict[micKey] = item.clone()
-        streamClosed = updatedSet.isStreamClosed()
-        updatedSet.close()
+        reader = self._getStreamingReader(inputSet, SetClass)
+        newItemDict = reader.readNew(getKeyFunc, self.micDict)
         self.debug("Closed db.")
 
-        return newItemDict, streamClosed
+        return newItemDict, reader.streamClosed
 
     def _updateOutputCTFSet(self, micList, streamMode):
         doneFailed = []
@@ -692,25 +690,12 @@ class ProtCTFMicrographs(ProtMicrographs):
         self._updateOutputSet(outputName, outputCtf, streamMode)
 
     def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-        return doneList
+        """ Return the list of ids (sorted) of the items that have been done. """
+        return sorted(self._getProgressLedger().getDone())
 
     def _writeDoneList(self, micList):
         """ Write to a text file the items that have been done. """
-        doneFile = self._getAllDone()
-
-        if not exists(doneFile):
-            pwutils.makeFilePath(doneFile)
-
-        with open(doneFile, 'a') as f:
-            for mic in micList:
-                f.write('%d\n' % mic.getObjId())
+        self._getProgressLedger().setDone([mic.getObjId() for mic in micList])
 
     def _isMicDone(self, mic):
         """ A mic is done if the marker file exists. """
@@ -732,19 +717,11 @@ class ProtCTFMicrographs(ProtMicrographs):
 
     def _writeFailedList(self, micList):
         """ Write to a text file the items that have failed. """
-        with open(self._getAllFailed(), 'a') as f:
-            for mic in micList:
-                f.write('%d\n' % mic.getObjId())
+        self._getProgressLedger().setFailed([mic.getObjId() for mic in micList])
 
     def _readFailedList(self):
-        """ Read from a text file the id's of the items that have failed. """
-        failedFile = self._getAllFailed()
-        failedList = []
-        if exists(failedFile):
-            with open(failedFile) as f:
-                failedList += [int(line.strip()) for line in f]
-
-        return failedList
+        """ Return the list of ids (sorted) of the items that have failed. """
+        return sorted(self._getProgressLedger().getFailed())
 
 
 class ProtPreprocessMicrographs(ProtMicrographs):
@@ -198,16 +198,21 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
         return None
 
     def _loadInputList(self):
-        """ Load the input set of movies and create a list. """
+        """ Load the input set of movies and create a list.
+        Only the movies added since the previous call are read and
+        appended to the list, which are also returned.
+        """
         moviesFile = self.inputMovies.get().getFileName()
         self.debug("Loading input db: %s" % moviesFile)
-        movieSet = emobj.SetOfMovies(filename=moviesFile)
-        movieSet.loadAllProperties()
-        self.listOfMovies = [m.clone() for m in movieSet]
-        self.streamClosed = movieSet.isStreamClosed()
-        movieSet.close()
+        reader = self._getStreamingReader(self.inputMovies.get(),
+                                          emobj.SetOfMovies)
+        newMovies = reader.read()
+        self.listOfMovies = getattr(self, 'listOfMovies', []) + newMovies
+        self.streamClosed = reader.streamClosed
         self.debug("Closed db.")
 
+        return newMovies
+
     def _checkNewInput(self):
         # Check if there are new movies to process from the input set
         localFile = self.inputMovies.get().getFileName()
@@ -224,14 +229,12 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
 
         self.lastCheck = now
         # Open input movies.sqlite and close it as soon as possible
-        self._loadInputList()
-        newMovies = any(m.getObjId() not in self.insertedDict
-                        for m in self.listOfMovies)
+        newMovies = [m for m in self._loadInputList()
+                     if m.getObjId() not in self.insertedDict]
         outputStep = self._getFirstJoinStep()
 
         if newMovies:
-            fDeps = self._insertNewMoviesSteps(self.insertedDict,
-                                               self.listOfMovies)
+            fDeps = self._insertNewMoviesSteps(self.insertedDict, newMovies)
             if outputStep is not None:
                 outputStep.addPrerequisites(*fDeps)
             self.updateSteps()
@@ -359,7 +362,8 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
                               % (inputMovieFn, outputMovieFn))
                     gain, dark = self.getGainAndDark()
                     self.correctGain(inputMovieFn, outputMovieFn,
-                                     gainFn=gain, darkFn=dark)
+                                     gainFn=gain, darkFn=dark,
+                                     threads=self.numberOfThreads.get())
                 else:
                     self.info("Converting movie '%s' -> '%s'"
                               % (inputMovieFn, outputMovieFn))
@@ -403,21 +407,12 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
         return self._getExtraPath('FAILED_all.TXT')
 
     def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if os.path.exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-
-        return doneList
+        """ Return the list of ids (sorted) of the items that have been done. """
+        return sorted(self._getProgressLedger().getDone())
 
     def _writeDoneList(self, movieList):
         """ Write to a text file the items that have been done. """
-        with open(self._getAllDone(), 'a') as f:
-            for movie in movieList:
-                f.write('%d\n' % movie.getObjId())
+        self._getProgressLedger().setDone([movie.getObjId() for movie in movieList])
 
     # --------------------------- OVERRIDE functions --------------------------
     def _filterMovie(self, movie):
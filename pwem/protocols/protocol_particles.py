@@ -27,6 +27,7 @@
 # **************************************************************************
 import enum
 import os
+import sqlite3
 from datetime import datetime
 from collections import OrderedDict
 
@@ -347,17 +348,10 @@ class ProtExtractParticles(ProtParticles):
         def _loadSet(inputSet, SetClass, getKeyFunc):
             setFn = inputSet.getFileName()
             self.debug("Loading input db: %s" % setFn)
-            updatedSet = SetClass(filename=setFn)
-            updatedSet.loadAllProperties()
-            newItemDict = OrderedDict()
-            for item in updatedSet:
-                micKey = getKeyFunc(item)
-                if micKey not in self.micDict:
-                    newItemDict[micKey] = item.clone()
-            streamClosed = updatedSet.isStreamClosed()
-            updatedSet.close()
+            reader = self._getStreamingReader(inputSet, SetClass)
+            newItemDict = reader.readNew(getKeyFunc, self.micDict)
             self.debug("Closed db.")
-            return newItemDict, streamClosed
+            return newItemDict, reader.streamClosed
 
         def _loadMics(micSet):
             return _loadSet(micSet, emobj.SetOfMicrographs,
@@ -415,14 +409,10 @@ class ProtExtractParticles(ProtParticles):
 
     def _loadInputCoords(self, micDict):
         """ Load coordinates from the input streaming.
+        Only the coordinates added since the previous call are read (see
+        _readNewCoords) and the ones of the given micrographs are moved to
+        self.coordDict. Micrographs without coordinates are not returned.
         """
-        # TODO: this takes for ever if you are NOT
-        # doing streaming and have several thousands of mics
-        # so I add a counter to keep the user entertained
-        import sys
-        a = datetime.now()
-        counter = 1
-
         coordsFn = self.getCoords().getFileName()
         self.debug("Loading input db: %s" % coordsFn)
         coordSet = emobj.SetOfCoordinates(filename=coordsFn)
@@ -430,23 +420,15 @@ class ProtExtractParticles(ProtParticles):
         coordSet._xmippMd = pwobj.String()
         coordSet.loadAllProperties()
 
+        self._readNewCoords(coordSet)
+
         micList = dict()  # To store a dictionary with mics with coordinates
 
         for micKey, mic in micDict.items():
-            if counter % 50 == 0:
-                b = datetime.now()
-                print(b - a, 'reading coordinates for mic number', "%06d" % counter)
-                sys.stdout.flush()  # force buffer to print
-            counter += 1
-
             micId = mic.getObjId()
-            coordList = []
-
-            self.debug("Loading coords for mic: %s (%s)" % (micId, micKey))
-            for coord in coordSet.iterItems(where='_micId=%s' % micId):
-                # TODO: Check performance penalty of using this clone
-                coordList.append(coord.clone())
-            self.debug("Coords found: %s" % len(coordList))
+            coordList = self._pendingCoords.pop(micId, None)
+            self.debug("Coords found for mic %s (%s): %s"
+                       % (micId, micKey, len(coordList or [])))
 
             if coordList:
                 self.coordDict[micId] = coordList
@@ -459,6 +441,48 @@ class ProtExtractParticles(ProtParticles):
 
         return micList
 
+    def _readNewCoords(self, coordSet):
+        """ Read, in a single query sorted by micrograph, the coordinates
+        with an id greater than the last one read and keep them grouped by
+        micId in self._pendingCoords until their micrograph is loaded.
+        Coordinates of micrographs already loaded are ignored.
+        """
+        self._lastCoordId = getattr(self, '_lastCoordId', 0)
+        self._pendingCoords = getattr(self, '_pendingCoords', {})
+        self._createMicIdIndex(coordSet)
+
+        micId, coordList, count = None, None, 0
+        for coord in coordSet.iterItems(orderBy=['_micId', 'id'],
+                                        where='id>%d' % self._lastCoordId):
+            self._lastCoordId = max(self._lastCoordId, coord.getObjId())
+            count += 1
+            if coordList is None or coord.getMicId() != micId:
+                micId = coord.getMicId()
+                coordList = (None if micId in self.coordDict
+                             else self._pendingCoords.setdefault(micId, []))
+            if coordList is not None:
+                coordList.append(coord.clone())
+
+        self.debug("New coords read: %d (last id: %d)"
+                   % (count, self._lastCoordId))
+
+    def _createMicIdIndex(self, coordSet):
+        """ Create the index on the _micId column of the coordinates db,
+        used to sort them by micrograph, if it does not exist yet. """
+        db = coordSet._getMapper().db
+        micIdCol = db._getRealCol('_micId')
+        if micIdCol is None:
+            return
+        db.executeCommand("SELECT name FROM sqlite_master WHERE type='index' "
+                          "AND name='index__micId'")
+        if db.cursor.fetchone() is None:
+            try:
+                db.executeCommand("CREATE INDEX index__micId ON Objects (%s)"
+                                  % micIdCol)
+                db.commit()
+            except sqlite3.OperationalError as e:  # e.g. locked or read-only
+                self.debug("Could not create _micId index: %s" % e)
+
     def _checkNewInput(self):
         self.debug(">>> _checkNewInput ")
 
@@ -512,9 +536,12 @@ class ProtExtractParticles(ProtParticles):
 
         # Load previously done items (from text file)
         doneList = self._readDoneList()
-        # Check for newly done items
-        newDone = [m for m in self.micDict.values()
-                   if m.getObjId() not in doneList and self._isMicDone(m)]
+        # Check for newly done items, listing the markers folder once
+        # unless _isMicDone is redefined
+        isMicDone = (None if type(self)._isMicDone is ProtExtractParticles._isMicDone
+                     else self._isMicDone)
+        newDone = self._getProgressLedger().getNewDone(
+            self.micDict.values(), self._getMicDone, isMicDone)
 
         # Update the file with the newly done mics
         # or exit from the function if no new done mics
@@ -611,26 +638,12 @@ class ProtExtractParticles(ProtParticles):
         return self._getExtraPath('DONE', 'all.TXT')
 
     def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if os.path.exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-
-        return doneList
+        """ Return the list of ids (sorted) of the items that have been done. """
+        return sorted(self._getProgressLedger().getDone())
 
     def _writeDoneList(self, micList):
         """ Write to a text file the items that have been done. """
-        doneFile = self._getAllDone()
-
-        if not os.path.exists(doneFile):
-            pwutils.makeFilePath(doneFile)
-
-        with open(doneFile, 'a') as f:
-            for mic in micList:
-                f.write('%d\n' % mic.getObjId())
+        self._getProgressLedger().setDone([mic.getObjId() for mic in micList])
 
     def _getFirstJoinStepName(self):
         # This function will be used for streaming, to check which is
@@ -35,6 +35,7 @@ import pyworkflow.utils as pwutils
 
 import pwem.objects as emobj
 from pwem.protocols import ProtParticles
+from pwem.convert.coordinates import CoordinatesIndex, readPositions, groupByMicrograph
 
 
 class ProtParticlePickingOutput(enum.Enum):
@@ -322,23 +323,18 @@ class ProtParticlePickingAuto(ProtParticlePicking):
     def _loadSet(self, inputSet, SetClass, getKeyFunc):
         """ Load a given input set if their items are not already present
         in the self.micDict.
+        Only the items added since the previous call (or not yet in
+        self.micDict) are read, see StreamingSetReader.
         This can be used to load new micrographs for picking as well as
         new CTF (if used) in streaming.
         """
         setFn = inputSet.getFileName()
         self.debug("Loading input db: %s" % setFn)
-        updatedSet = SetClass(filename=setFn)
-        updatedSet.loadAllProperties()
-        newItemDict = OrderedDict()
-        for item in updatedSet:
-            micKey = getKeyFunc(item)
-            if micKey not in self.micDict:
-                newItemDict[micKey] = item.clone()
-        streamClosed = updatedSet.isStreamClosed()
-        updatedSet.close()
+        reader = self._getStreamingReader(inputSet, SetClass)
+        newItemDict = reader.readNew(getKeyFunc, self.micDict)
         self.debug("Closed db.")
 
-        return newItemDict, streamClosed
+        return newItemDict, reader.streamClosed
 
     def _loadMics(self, micSet):
         return self._loadSet(micSet, emobj.SetOfMicrographs,
@@ -387,8 +383,11 @@ class ProtParticlePickingAuto(ProtParticlePicking):
         # Check for newly done items
         listOfMics = self.micDict.values()
         nMics = len(listOfMics)
-        newDone = [m for m in listOfMics
-                   if m.getObjId() not in doneList and self._isMicDone(m)]
+        # listing the markers folder once unless _isMicDone is redefined
+        isMicDone = (None if type(self)._isMicDone is ProtParticlePickingAuto._isMicDone
+                     else self._isMicDone)
+        newDone = self._getProgressLedger().getNewDone(
+            listOfMics, self._getMicDone, isMicDone)
 
         # Update the file with the newly done mics
         # or exit from the function if no new done mics
@@ -507,26 +506,12 @@ class ProtParticlePickingAuto(ProtParticlePicking):
         return self._getExtraPath('DONE', 'all.TXT')
 
     def _readDoneList(self):
-        """ Read from a text file the id's of the items that have been done. """
-        doneFile = self._getAllDone()
-        doneList = []
-        # Check what items have been previously done
-        if os.path.exists(doneFile):
-            with open(doneFile) as f:
-                doneList += [int(line.strip()) for line in f]
-
-        return doneList
+        """ Return the list of ids (sorted) of the items that have been done. """
+        return sorted(self._getProgressLedger().getDone())
 
     def _writeDoneList(self, micList):
         """ Write to a text file the items that have been done. """
-        doneFile = self._getAllDone()
-
-        if not os.path.exists(doneFile):
-            pwutils.makeFilePath(doneFile)
-
-        with open(doneFile, 'a') as f:
-            for mic in micList:
-                f.write('%d\n' % mic.getObjId())
+        self._getProgressLedger().setDone([mic.getObjId() for mic in micList])
 
     def _getFirstJoinStepName(self):
         # This function will be used for streaming, to check which is
@@ -602,24 +587,25 @@ class ProtPickingDifference(ProtParticlePicking):
         outputCoords = self._createSetOfCoordinates(inputMics)
         outputCoords.setBoxSize(inputCoords.getBoxSize())
 
-        r2 = radius * radius  # to avoid computing sqrt when comparing distances
-
-        def _discard(coord, negPos):
-            """ Find if there is a close negative particle to this one. """
-            x, y = coord.getPosition()
-
-            for nx, ny in negPos:
-                if abs((x - nx) * (y - ny)) < r2:
-                    return True
-
-            return False  # Far enough from all negative coordinates
-
-        # Read all consensus particles
-        for mic in inputMics:
-            negPos = [(c.getX(), c.getY())
-                      for c in negCoords.iterCoordinates(mic)]
-            for coord in inputCoords.iterCoordinates(mic):
-                if not _discard(coord, negPos):
+        coordIds, coordMicIds, coordPositions = readPositions(inputCoords)
+        _, negMicIds, negPositions = readPositions(negCoords)
+        negGroups = dict(groupByMicrograph(negMicIds))
+        micIds = inputMics.getIdSet()
+
+        # Keep the coordinates far enough from all negative coordinates
+        keepIds = []
+        for micId, indexes in groupByMicrograph(coordMicIds):
+            if micId not in micIds:
+                continue
+            if micId in negGroups:
+                negIndex = CoordinatesIndex(negPositions[negGroups[micId]])
+                indexes = indexes[~negIndex.hasNeighbours(coordPositions[indexes], radius, strict=True)]
+            keepIds.extend(coordIds[indexes].tolist())
+
+        if outputCoords.appendSubset(inputCoords, ids=keepIds) is None:
+            keepIds = set(keepIds)
+            for coord in inputCoords.iterCoordinates():
+                if coord.getObjId() in keepIds:
                     outputCoords.append(coord)
 
         # Set output
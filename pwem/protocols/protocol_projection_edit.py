@@ -297,10 +297,17 @@ class ProtProjectionEditor(EMProtocol):
         inputSet = self.inputSet.get()
         modifiedSet = inputSet.createCopy(self._getExtraPath(), copyInfo=True)
 
-        for sourceItem in inputSet.iterItems():
+        # Move all the transformations at once
+        _, matrices = inputSet.getTransformMatrices()
+        matrices, found = SymmetryHelper.moveTransformsInsideUnitCell(
+            matrices, symmetry=self.targetSymmetryToMove.get(),
+            symmetryOrder=self.symmetryOrderToMove.get())
+        if not found.all():
+            self.warning("%d particles could not be moved inside the unit cell." % (~found).sum())
+
+        for sourceItem, matrix in zip(inputSet.iterItems(orderBy='id'), matrices):
             item = sourceItem.clone()
-
-            SymmetryHelper.moveParticleInsideUnitCell(item, symmetry=self.targetSymmetryToMove.get(), symmetryOrder=self.symmetryOrderToMove.get())
+            item.getTransform().setMatrix(matrix)
             modifiedSet.append(item)
 
         self.createOutput(self.inputSet, modifiedSet)
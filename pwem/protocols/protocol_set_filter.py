@@ -25,11 +25,130 @@
 # *
 # **************************************************************************
 
+import ast
+
 import pyworkflow.protocol.params as params
 from pwem.protocols import EMProtocol
 from pwem.objects.data import SetOfCoordinates
+from pwem.convert.coordinates import CoordinatesIndex, readPositions, groupByMicrograph
 import numpy as np
 
+
+class _ColumnFormula(ast.NodeTransformer):
+    """ Rewrite a formula over the item attributes (item._attr.get())
+    into an expression over numpy columns (_col0, _col1...), raising
+    ValueError for anything that can not be evaluated that way. """
+    ALLOWED = (ast.Expression, ast.BinOp, ast.Constant, ast.operator,
+               ast.unaryop, ast.expr_context)
+    COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+    FUNCTIONS = ('abs',)
+    MODULES = ('np', 'numpy')
+    # Only elementwise functions: reductions (mean, sum, max...) would be
+    # computed over the whole column instead of the item value
+    NUMPY_FUNCTIONS = ('abs', 'absolute', 'sqrt', 'square', 'exp', 'log',
+                       'log10', 'sin', 'cos', 'tan', 'arcsin', 'arccos',
+                       'arctan', 'arctan2', 'deg2rad', 'rad2deg', 'floor',
+                       'ceil', 'isnan', 'isinf', 'isfinite', 'logical_and',
+                       'logical_or', 'logical_not', 'logical_xor', 'minimum',
+                       'maximum')
+
+    def __init__(self):
+        self.attributes = []
+
+    @staticmethod
+    def _npCall(funcName, args):
+        func = ast.Attribute(value=ast.Name(id='_np', ctx=ast.Load()),
+                             attr=funcName, ctx=ast.Load())
+        return ast.Call(func=func, args=args, keywords=[])
+
+    def _reduce(self, funcName, values):
+        result = values[0]
+        for value in values[1:]:
+            result = self._npCall(funcName, [result, value])
+        return result
+
+    def _getAttribute(self, node):
+        """ Return the attribute name (e.g. _ctfModel._defocusU) of
+        item._ctfModel._defocusU or None for other nodes. """
+        names = []
+        while isinstance(node, ast.Attribute):
+            names.insert(0, node.attr)
+            node = node.value
+        if names and isinstance(node, ast.Name) and node.id == 'item':
+            return '.'.join(names)
+        return None
+
+    def visit_Call(self, node):
+        func = node.func
+        if node.keywords:
+            raise ValueError("Keyword arguments are not supported")
+        if isinstance(func, ast.Attribute) and func.attr == 'get' and not node.args:
+            attribute = self._getAttribute(func.value)
+            if attribute is not None:
+                if attribute not in self.attributes:
+                    self.attributes.append(attribute)
+                return ast.Name(id='_col%d' % self.attributes.index(attribute),
+                                ctx=ast.Load())
+        if ((isinstance(func, ast.Name) and func.id in self.FUNCTIONS) or
+                (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                 and func.value.id in self.MODULES
+                 and func.attr in self.NUMPY_FUNCTIONS)):
+            node.args = [self.visit(arg) for arg in node.args]
+            return node
+        raise ValueError("Call not supported: %s" % ast.dump(func))
+
+    def visit_BoolOp(self, node):
+        funcName = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        return self._reduce(funcName, [self.visit(v) for v in node.values])
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            return self._npCall('logical_not', [self.visit(node.operand)])
+        return self.generic_visit(node)
+
+    def visit_Compare(self, node):
+        if not all(isinstance(op, self.COMPARISONS) for op in node.ops):
+            raise ValueError("Comparison not supported")
+        # a < b < c  -> (a < b) & (b < c)
+        left = self.visit(node.left)
+        comparisons = []
+        for op, comparator in zip(node.ops, node.comparators):
+            right = self.visit(comparator)
+            comparisons.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+            left = right
+        return self._reduce('logical_and', comparisons)
+
+    def visit_Name(self, node):
+        raise ValueError("Name not supported: %s" % node.id)
+
+    def visit_Attribute(self, node):
+        raise ValueError("Attribute not supported: %s" % node.attr)
+
+    def generic_visit(self, node):
+        if not isinstance(node, self.ALLOWED):
+            raise ValueError("%s not supported" % type(node).__name__)
+        return ast.NodeTransformer.generic_visit(self, node)
+
+
+def compileColumnFormula(formula):
+    """ Compile a passing formula (e.g. item._resolution.get() < 4) to be
+    evaluated at once over the columns of the set instead of per item.
+
+    Returns:
+        (code, attributes) where code has to be evaluated with the
+        column of attributes[i] as _col<i> (and numpy as _np), or None if
+        the formula can not be evaluated this way (statements, calls to
+        item methods...).
+    """
+    try:
+        transformer = _ColumnFormula()
+        tree = transformer.visit(ast.parse(formula.strip(), mode='eval'))
+    except (SyntaxError, ValueError):
+        return None
+    return (compile(ast.fix_missing_locations(tree), '<formula>', 'eval'),
+            transformer.attributes)
+
+
 class ProtSetFilter(EMProtocol):
     """
     Protocol to filter sets based on its attributes through an expression that
@@ -133,14 +252,16 @@ class ProtSetFilter(EMProtocol):
         sampling = mic.getSamplingRate()
         distance = self.distance.get() / sampling
         distance2 = distance * distance
-        for sourceItem in inputSet.iterItems():
-            item = sourceItem.clone()
-            x = item.getX()
-            y = item.getY()
-            diffX =  (x-micXcenter)
-            diffY =  (y-micYcenter)
-            if diffX * diffX + diffY * diffY > distance2:
-                modifiedSet.append(item)
+
+        ids, _, positions = readPositions(inputSet)
+        diff = positions - (micXcenter, micYcenter)
+        keepIds = ids[(diff * diff).sum(axis=1) > distance2].tolist()
+
+        if modifiedSet.appendSubset(inputSet, ids=keepIds) is None:
+            keepIds = set(keepIds)
+            for sourceItem in inputSet.iterItems():
+                if sourceItem.getObjId() in keepIds:
+                    modifiedSet.append(sourceItem.clone())
 
         self.createOutput(modifiedSet)
 
@@ -155,40 +276,22 @@ class ProtSetFilter(EMProtocol):
         mic = inputSet.getMicrographs().getFirstItem()
         sampling = mic.getSamplingRate()
         distance = self.distance.get() / sampling
-        distance2 = distance * distance
 
-        # duplicate setOfCoordinates in memory
-        coordList = []
-        oldMicId=-1
-        # If coordenates are sorted by micId then
-        # we can process much faster
-        useBreak = True
-        for item in inputSet.iterItems():
-            micId = item.getMicId()
-            coordList.append([item.getX(), item.getY(), micId])
-            if oldMicId > micId:
-                useBreak = False
-            oldMicId = micId
-        keepList = np.full((len(inputSet)), True, dtype=bool)
-        # search for close coordinates
-        # this one remove both particles
-        for start1, coord1 in enumerate(coordList):
-            for start2, coord2 in enumerate(coordList[start1+1:]):
-                if (coord1[2] != coord2[2]):  # compare micIds
-                    if useBreak:
-                        break
-                    else:
-                        continue
-                xd = coord1[0] - coord2[0]
-                yd = coord1[1] - coord2[1]
-                if (xd*xd + yd*yd) < distance2:
-                    if keepFirstNot:
-                        keepList[start1] = False
-                    keepList[start2+start1+1] = False
-
-        for condition, coord in zip(keepList, inputSet):
-            if condition:
-                modifiedSet.append(item)
+        ids, micIds, positions = readPositions(inputSet)
+        keepList = np.full(len(ids), True, dtype=bool)
+        # search for close coordinates in each micrograph, the second one
+        # (by id) is removed, and also the first one if not keepFirst
+        for micId, indexes in groupByMicrograph(micIds):
+            pairs = CoordinatesIndex(positions[indexes]).closePairs(distance, strict=True)
+            keepList[indexes[pairs[:, 1]]] = False
+            if keepFirstNot:
+                keepList[indexes[pairs[:, 0]]] = False
+
+        if modifiedSet.appendSubset(inputSet, ids=ids[keepList].tolist()) is None:
+            keepIds = set(ids[keepList].tolist())
+            for coord in inputSet.iterItems():
+                if coord.getObjId() in keepIds:
+                    modifiedSet.append(coord)
 
         self.createOutput(modifiedSet)
 
@@ -198,23 +301,61 @@ class ProtSetFilter(EMProtocol):
         Goes through all items in the input set and applies the formula to each of them using exec.
         Complex python code could be run separating lines with ;  To use numpy you could do
         import numpy; item._resolution.set(numpy.random.randint(10))
-        If result is True, item will be transferred to the output set
+        If result is True, item will be transferred to the output set.
+        Formulas that are expressions of the item attribute values
+        (e.g. item._resolution.get() < 4) are evaluated at once over the
+        columns of the set (see compileColumnFormula) and the passing rows
+        copied in bulk.
         """
         inputSet = self.inputSet.get()
         modifiedSet = inputSet.create(self._getExtraPath())
         modifiedSet.copyInfo(inputSet)
 
-        for sourceItem in inputSet.iterItems():
-            item = sourceItem.clone()
-            exec("item.setEnabled(%s)"% self.formula.get())
-            if item.isEnabled():
-                modifiedSet.append(item)
+        keepIds = self._evalColumnFormula(inputSet)
+
+        if keepIds is None:
+            for sourceItem in inputSet.iterItems():
+                item = sourceItem.clone()
+                exec("item.setEnabled(%s)"% self.formula.get())
+                if item.isEnabled():
+                    modifiedSet.append(item)
+        elif modifiedSet.appendSubset(inputSet, ids=keepIds, enable=True) is None:
+            keepIds = set(keepIds)
+            for sourceItem in inputSet.iterItems():
+                if sourceItem.getObjId() in keepIds:
+                    item = sourceItem.clone()
+                    item.setEnabled(True)
+                    modifiedSet.append(item)
         # TODO: copyInfo does not copy the set of micrographs
         # associate to the setOfCoordinates
         if isinstance(modifiedSet, SetOfCoordinates):
             modifiedSet.setMicrographs(inputSet.getMicrographs())
         self.createOutput(modifiedSet)
 
+    def _evalColumnFormula(self, inputSet):
+        """ Return the ids of the items of inputSet passing the formula,
+        evaluated over the columns of the referenced attributes, or None
+        if it has to be evaluated item by item. """
+        compiled = compileColumnFormula(self.formula.get())
+        if compiled is None:
+            return None
+        code, attributes = compiled
+
+        try:
+            rows = inputSet.getColumnValues(['id'] + attributes)
+            columns = list(zip(*rows)) or [()] * (len(attributes) + 1)
+            ids = np.array(columns[0], dtype=int)
+            namespace = {'_col%d' % i: np.array(column)
+                         for i, column in enumerate(columns[1:])}
+            namespace.update(_np=np, np=np, numpy=np)
+            mask = np.broadcast_to(np.asarray(eval(code, namespace), dtype=bool),
+                                   ids.shape)
+        except Exception as e:
+            self.info("Formula will be evaluated item by item: %s" % e)
+            return None
+
+        return ids[mask].tolist()
+
     def rankingStep(self):
         """
         Goes through all items in the input set and takes the number/proportion of items with a higher/lower value
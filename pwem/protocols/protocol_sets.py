@@ -41,6 +41,7 @@ from pwem.protocols import EMProtocol
 from pwem.objects import Volume, EMSet, SetOfClasses, SetOfData
 from pyworkflow.utils import ProgressBar, getListFromRangeString
 from pwem.constants import ID_COLUMN, ID_ATTRIBUTE
+from pwem.convert.coordinates import CoordinatesIndex, readPositions, groupByMicrograph
 
 
 class ProtSets(EMProtocol):
@@ -613,7 +614,30 @@ class ProtSubSet(ProtSets):
             else:
                 self.info("Creating subset by range: %s" % self.range)
                 ids = set(getListFromRangeString(self.range.get()))
+            copied = outputSet.appendSubset(inputFullSet, ids=ids)
         else:
+            ids = None
+            # Let sqlite compare both sets when possible
+            copied = outputSet.appendSubset(inputFullSet, refSet=self.inputSubSet.get(),
+                                            difference=self.setOperation == self.SET_DIFFERENCE)
+
+        if copied is None:
+            self._appendSubset(inputFullSet, outputSet, ids)
+
+        if outputSet.getSize():
+            key = 'output' + inputClassName.replace('SetOf', '')
+            self._defineOutputs(**{key: outputSet})
+            self._defineTransformRelation(inputFullSet, outputSet)
+            if not (self.chooseAtRandom.get() or self.selectIds.get()):
+                self._defineSourceRelation(self.inputSubSet, outputSet)
+        else:
+            self.summaryVar.set('Output was not generated. Resulting set '
+                                'was EMPTY!!!')
+
+    def _appendSubset(self, inputFullSet, outputSet, ids=None):
+        """ Append the items of the subset one by one (i.e. for sets of sets).
+        If ids is None, they are taken from the other set."""
+        if ids is None:
             # Get the ids from both sets
             fullSetIds = inputFullSet.getIdSet()
             smallSetIds = self.inputSubSet.get().getIdSet()
@@ -649,16 +673,6 @@ class ProtSubSet(ProtSets):
         if progress:
             progress.finish(printNewLine=True)
 
-        if outputSet.getSize():
-            key = 'output' + inputClassName.replace('SetOf', '')
-            self._defineOutputs(**{key: outputSet})
-            self._defineTransformRelation(inputFullSet, outputSet)
-            if not (self.chooseAtRandom.get() or self.selectIds.get()):
-                self._defineSourceRelation(self.inputSubSet, outputSet)
-        else:
-            self.summaryVar.set('Output was not generated. Resulting set '
-                                'was EMPTY!!!')
-
     # Overwrite SetOfCoordinates creation
     def _createSetOfCoordinates(self, suffix=''):
         coordSet = self.inputFullSet.get()
@@ -787,14 +801,13 @@ class ProtSubSetByMic(ProtSets):
         outputSet = self._createSetOfParticles()
         outputSet.copyInfo(inputParticles)
 
-        micIds = []
+        if outputSet.appendSubset(inputParticles, refSet=inputMicrographs,
+                                  attribute='_micId') is None:
+            micIds = inputMicrographs.getIdSet()
 
-        for mic in inputMicrographs:
-            micIds.append(mic.getObjId())
-
-        for particle in inputParticles:
-            if particle.getMicId() in micIds:
-                outputSet.append(particle)
+            for particle in inputParticles:
+                if particle.getMicId() in micIds:
+                    outputSet.append(particle)
 
         self._defineOutputs(outputParticles=outputSet)
         self._defineTransformRelation(inputParticles, outputSet)
@@ -854,23 +867,25 @@ class ProtSubSetByCoord(ProtSets):
         outputSet = self._createSetOfParticles()
         outputSet.copyInfo(inputParticles)
 
-        micCoordinates = {}
-        for coord in inputCoordinates.iterCoordinates():
-            micId = coord.getMicId()
-            x, y = coord.getPosition()
-            if micId not in micCoordinates:
-                micCoordinates[micId] = []
-            micCoordinates[micId].append((x, y))
-
-        for particle in inputParticles:
-            if particle.getMicId() in micCoordinates:
-                x0, y0 = particle.getCoordinate().getPosition()
-                okToAdd = False
-                for x, y in micCoordinates[particle.getMicId()]:
-                    if abs(x - x0) <= tolerance and abs(y - y0) <= tolerance:
-                        okToAdd = True
-                        break
-                if okToAdd:
+        _, coordMicIds, coordPositions = readPositions(inputCoordinates)
+        micCoordinates = dict(groupByMicrograph(coordMicIds))
+        partIds, partMicIds, partPositions = readPositions(
+            inputParticles, '_coordinate._x', '_coordinate._y',
+            ['_micId', '_coordinate._micId'])
+
+        # Particles with a coordinate of the same micrograph closer than
+        # the tolerance in x and y
+        selectedIds = []
+        for micId, indexes in groupByMicrograph(partMicIds):
+            if micId in micCoordinates:
+                coordsIndex = CoordinatesIndex(coordPositions[micCoordinates[micId]])
+                found = coordsIndex.hasNeighbours(partPositions[indexes], tolerance, box=True)
+                selectedIds.extend(partIds[indexes[found]].tolist())
+
+        if outputSet.appendSubset(inputParticles, ids=selectedIds) is None:
+            selectedIds = set(selectedIds)
+            for particle in inputParticles:
+                if particle.getObjId() in selectedIds:
                     outputSet.append(particle)
 
         self._defineOutputs(outputParticles=outputSet)
@@ -939,6 +954,17 @@ class ProtCrossSubSet(ProtSets):
         outputSet = mainSet.create(self.getPath())
         outputSet.copyInfo(mainSet)
 
+        # Join both sets in sqlite when possible
+        if outputSet.appendSubset(mainSet, refSet=secSet, attribute=self.getMainSetField(),
+                                  refAttribute=self.getSecSetField()) is None:
+            self._appendCrossSubset(mainSet, secSet, outputSet)
+
+        self._defineOutputs(subset=outputSet)
+        self._defineTransformRelation(mainSet, outputSet)
+
+    def _appendCrossSubset(self, mainSet, secSet, outputSet):
+        """ Append the matching items of the main set one by one (i.e. for sets of sets)"""
+        secSetField = self.getSecSetField()
         # Get unique values of secfield in secset
         uniqueValuesinSec = secSet.getUniqueValues(secSetField)
         uniqueValuesinSec ={value:None for value in uniqueValuesinSec}
@@ -960,9 +986,6 @@ class ProtCrossSubSet(ProtSets):
 
         pb.finish()
 
-        self._defineOutputs(subset=outputSet)
-        self._defineTransformRelation(mainSet, outputSet)
-
     def getMainSetField(self, pythonName=False):
         if pythonName:
             return self._normalizeSpecialFields(self.mainSetField.get())
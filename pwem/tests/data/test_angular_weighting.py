@@ -0,0 +1,199 @@
+# **************************************************************************
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import logging
+import os
+import time
+
+import numpy as np
+import pyworkflow.tests as pwtests
+
+import pwem.objects as emobj
+from pwem.convert.transformations import (euler_matrix, euler_from_matrix,
+                                          euler_direction)
+from pwem.convert.trigonometry import FibonacciSphere
+from pwem.viewers.plotter import EmPlotter
+
+logger = logging.getLogger(__name__)
+
+
+def weightEulerAnglesReference(rots, tilts, delta=3):
+    """ Former sequential implementation of EmPlotter.weightEulerAngles,
+    kept as reference for grouping and speed. """
+    projectionList = []
+    weights = []
+    for rot, tilt in zip(rots, tilts):
+        for index, projection in enumerate(projectionList):
+            if (abs(projection[0] - rot) <= delta and
+                    abs(projection[1] - tilt) <= delta):
+                weights[index] += 1
+                break
+        else:
+            projectionList.append([rot, tilt])
+            weights.append(1)
+
+    return ([p[0] for p in projectionList],
+            [p[1] for p in projectionList], weights)
+
+
+def randomAngles(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-180, 180, n), rng.uniform(0, 180, n)
+
+
+class TestWeightEulerAngles(pwtests.unittest.TestCase):
+
+    def test_sameGrouping(self):
+        """ Grid engine must group exactly as the sequential search. """
+        rots, tilts = randomAngles(5000)
+        # Quantized angles force many ties at exactly delta distance
+        qRots, qTilts = np.round(rots), np.round(tilts)
+
+        for r, t in [(rots, tilts), (qRots, qTilts)]:
+            for delta in [0, 1, 3, 10]:
+                goldRots, goldTilts, goldWeights = \
+                    weightEulerAnglesReference(r, t, delta=delta)
+                newRots, newTilts, weights = \
+                    EmPlotter.weightEulerAngles(r, t, delta=delta)
+                self.assertEqual(goldWeights, weights)
+                np.testing.assert_array_equal(goldRots, newRots)
+                np.testing.assert_array_equal(goldTilts, newTilts)
+                self.assertEqual(len(r), sum(weights))
+
+        newRots, _, _ = EmPlotter.weightEulerAngles(rots, tilts,
+                                                    rotInRadians=True)
+        goldRots, _, _ = weightEulerAnglesReference(rots, tilts)
+        np.testing.assert_array_almost_equal(np.radians(goldRots), newRots)
+
+    @pwtests.unittest.skipUnless(os.environ.get('SCIPION_TEST_BENCHMARK'),
+                                 "set SCIPION_TEST_BENCHMARK to run it")
+    def test_benchmark(self):
+        """ Times the grid engine against the sequential search.
+        Sizes can be changed with SCIPION_TEST_ANGULAR_SIZES and the
+        sequential search is only timed up to SCIPION_TEST_ANGULAR_REF_MAX
+        angles since it is quadratic. """
+        sizes = os.environ.get('SCIPION_TEST_ANGULAR_SIZES', '10000,100000,1000000')
+        refMax = int(os.environ.get('SCIPION_TEST_ANGULAR_REF_MAX', 10000))
+
+        for n in [int(s) for s in sizes.split(',')]:
+            rots, tilts = randomAngles(n)
+            t0 = time.time()
+            _, _, weights = EmPlotter.weightEulerAngles(rots, tilts)
+            gridTime = time.time() - t0
+            self.assertEqual(n, sum(weights))
+
+            if n <= refMax:
+                t0 = time.time()
+                weightEulerAnglesReference(rots, tilts)
+                refTime = time.time() - t0
+                logger.info("%d angles: grid %0.2fs, sequential %0.2fs (x%0.1f)"
+                            % (n, gridTime, refTime, refTime / gridTime))
+            else:
+                logger.info("%d angles: grid %0.2fs, sequential skipped "
+                            "(set SCIPION_TEST_ANGULAR_REF_MAX)" % (n, gridTime))
+
+
+class TestFibonacciSphere(pwtests.unittest.TestCase):
+
+    def test_appendMany(self):
+        """ Batch binning must match a point by point z band search. """
+        rng = np.random.default_rng(0)
+        xyz = rng.normal(size=(5000, 3))
+        xyz /= np.linalg.norm(xyz, axis=1)[:, None]
+        xyz = np.vstack([xyz, [[0, 0, 1], [0, 0, -1], [1, 0, 0]]])
+
+        fiSph = FibonacciSphere(500)
+        goldWeights = np.zeros(fiSph.num_points)
+        numPoints = fiSph.num_points - 1
+        for x, y, z in xyz:
+            zIndex = min(max(round(z * fiSph.half_points - 1 + fiSph.half_points), 0), numPoints)
+            band = np.arange(max(zIndex - fiSph.searchRange, 0),
+                             min(zIndex + fiSph.searchRange, numPoints))
+            dist = (fiSph.sphX[band] - x) ** 2 + (fiSph.sphY[band] - y) ** 2
+            goldWeights[band[np.argmin(dist)]] += 1
+
+        fiSph.appendMany(xyz, chunkSize=1000)
+        np.testing.assert_array_equal(goldWeights, fiSph.weights)
+
+        X, Y, Z, W = fiSph.cleanWeights()
+        self.assertIsInstance(W, np.ndarray)
+        self.assertEqual(len(xyz), W.sum())
+        self.assertTrue(np.all(W > 0))
+        self.assertEqual(len(X), len(W))
+
+
+class TestEulerAnglesFromSet(pwtests.BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        pwtests.setupTestOutput(cls)
+
+    def test_transformMatrices(self):
+        """ Columnar reading of the matrices must give the same angles
+        as going through the items. """
+        partSet = emobj.SetOfParticles(filename=self.getOutputPath('particles.sqlite'))
+        partSet.setAlignmentProj()
+        rng = np.random.default_rng(0)
+        for i, angles in enumerate(rng.uniform(-np.pi, np.pi, (100, 3))):
+            p = emobj.Particle(location=(i + 1, 'particles.stk'))
+            matrix = euler_matrix(*angles, axes='szyz')
+            matrix[:3, 3] = [i, -i, 0]
+            p.setTransform(emobj.Transform(matrix))
+            partSet.append(p)
+        partSet.write()
+
+        ids, matrices = partSet.getTransformMatrices()
+        self.assertEqual(list(range(1, 101)), ids.tolist())
+        self.assertEqual((100, 4, 4), matrices.shape)
+        self.assertEqual(ids.tolist(), partSet.getColumnValues('id'))
+
+        rots, tilts, psis = EmPlotter.eulerAnglesFromMatrices(matrices)
+        for i, p in enumerate(partSet):
+            np.testing.assert_array_almost_equal(p.getTransform().getMatrix(), matrices[i])
+            matrixI = np.linalg.inv(p.getTransform().getRotationMatrix())
+            rot, tilt, psi = np.degrees(euler_from_matrix(matrixI, axes='szyz'))
+            if tilt < 0:
+                rot, tilt = -rot, -tilt
+            np.testing.assert_array_almost_equal([rot, tilt, psi],
+                                                 [rots[i], tilts[i], psis[i]])
+
+        x, y, z = euler_direction(rots, tilts)
+        np.testing.assert_array_almost_equal(np.ones(100), x ** 2 + y ** 2 + z ** 2)
+
+
+class TestAngularDistribution3D(pwtests.unittest.TestCase):
+
+    def test_weightsArray(self):
+        """ Weights given as an array color the points, and are not taken
+        as the direction (zdir) of the 3D scatter. """
+        rng = np.random.default_rng(3)
+        x, y, z = rng.uniform(-1, 1, (3, 50))
+        weights = rng.uniform(0, 10, 50)
+
+        plotter = EmPlotter()
+        plotter.plotAngularDistribution3D('3D distribution', x, y, z, weights, '')
+        points = plotter.getLastSubPlot().collections[0]
+        for coords, expected in zip(points._offsets3d, (x, y, z)):
+            np.testing.assert_array_almost_equal(coords, expected)
+        np.testing.assert_array_almost_equal(points.get_array(), weights)
+        plotter.close()
@@ -0,0 +1,104 @@
+# **************************************************************************
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+import pyworkflow.tests as pwtests
+from pyworkflow.tests import setupTestOutput
+
+import pwem.objects as emobj
+from pwem.convert.coordinates import (CoordinatesIndex, readPositions,
+                                      groupByMicrograph)
+
+
+class TestCoordinatesIndex(pwtests.BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        # integer positions to have many pairs exactly at the radius
+        self.positions = rng.integers(0, 200, size=(500, 2)).astype(float)
+        self.others = rng.integers(0, 200, size=(300, 2)).astype(float)
+
+    def _distances(self, a, b, box):
+        diff = np.abs(a[:, None, :] - b[None, :, :])
+        return diff.max(axis=2) if box else np.sqrt((diff ** 2).sum(axis=2))
+
+    def test_closePairs(self):
+        index = CoordinatesIndex(self.positions)
+        for strict in (False, True):
+            for box in (False, True):
+                dist = self._distances(self.positions, self.positions, box)
+                close = dist < 5 if strict else dist <= 5
+                expected = np.argwhere(np.triu(close, k=1))
+                pairs = index.closePairs(5, strict=strict, box=box)
+                np.testing.assert_array_equal(pairs, expected)
+
+    def test_hasNeighbours(self):
+        index = CoordinatesIndex(self.positions)
+        for strict in (False, True):
+            for box in (False, True):
+                dist = self._distances(self.others, self.positions, box)
+                close = dist < 3 if strict else dist <= 3
+                np.testing.assert_array_equal(
+                    index.hasNeighbours(self.others, 3, strict=strict, box=box),
+                    close.any(axis=1))
+
+        empty = CoordinatesIndex([])
+        self.assertEqual(len(empty), 0)
+        self.assertFalse(empty.hasNeighbours(self.others, 3).any())
+        self.assertEqual(empty.closePairs(3).shape, (0, 2))
+
+    def test_groupByMicrograph(self):
+        groups = dict(groupByMicrograph([3, 1, 3, 2, 1, 3]))
+        self.assertEqual(sorted(groups), [1, 2, 3])
+        self.assertEqual(groups[1].tolist(), [1, 4])
+        self.assertEqual(groups[3].tolist(), [0, 2, 5])
+        self.assertEqual(list(groupByMicrograph([])), [])
+
+    def test_emptySet(self):
+        coordSet = emobj.SetOfCoordinates(
+            filename=self.getOutputPath('coordinates_empty.sqlite'))
+        ids, micIds, positions = readPositions(coordSet)
+        self.assertEqual(positions.shape, (0, 2))
+        self.assertEqual(list(groupByMicrograph(micIds)), [])
+        coordSet.close()
+
+    def test_readPositions(self):
+        coordSet = emobj.SetOfCoordinates(
+            filename=self.getOutputPath('coordinates.sqlite'))
+        for i, (x, y) in enumerate(self.positions[:10]):
+            coord = emobj.Coordinate(x=int(x), y=int(y))
+            coord.setMicId(i % 3 + 1)
+            coordSet.append(coord)
+        coordSet.write()
+
+        ids, micIds, positions = readPositions(coordSet)
+        self.assertEqual(ids.tolist(), list(range(1, 11)))
+        self.assertEqual(micIds.tolist(), [i % 3 + 1 for i in range(10)])
+        np.testing.assert_array_equal(positions, self.positions[:10])
+        coordSet.close()
+
@@ -6,11 +6,12 @@ Created on May 20, 2013
 
 from glob import iglob
 import sqlite3
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 
+import mrcfile
 import numpy as np
 
-from pwem.emlib.image.image_readers import ROT_MODE
+from pwem.emlib.image.image_readers import ROT_MODE, MRCImageReader, MmapPool, ImageCache, STKImageReader
 from pyworkflow import SCIPION_DEBUG_NOCLEAN
 from pyworkflow.tests import *
 import pyworkflow.utils as pwutils
@@ -458,6 +459,228 @@ class TestImageRegistry(pwtests.BaseTest):
         slice = rotImg.getImage()
         np.testing.assert_equal(slice, np.array([[1000,100], [-50, -100]]), "Image horizontal flip does not work")
 
+    def testMrcMmapPool(self):
+        """ Tests slices are views of pooled memory maps"""
+
+        npStack = np.arange(5 * 4 * 4, dtype=np.float32).reshape((5, 4, 4))
+        files = [self.getOutputPath("pool%d.mrcs" % i) for i in range(3)]
+        for fn in files:
+            MRCImageReader.write(ImageStack(list(npStack)), fn, isStack=True)
+
+        pool = MmapPool(maxSize=2)
+        mrcs = [pool.get(fn) for fn in files]
+        self.assertEqual(len(pool), 2)
+        self.assertTrue(mrcs[0]._iostream.closed, "Least recently used map is not closed")
+        self.assertIs(pool.get(files[2]), mrcs[2])
+
+        npSlice = MRCImageReader.openSlice(files[0], 3)
+        np.testing.assert_equal(npSlice, npStack[2])
+        self.assertFalse(npSlice.flags.owndata, "Slice is not a view")
+        self.assertIs(MRCImageReader.getMrcImage(files[0]), MRCImageReader.getMrcImage(files[0]))
+
+        # Modified files are mapped again
+        MRCImageReader.write(ImageStack(list(npStack * 2)), files[0], isStack=True)
+        np.testing.assert_equal(MRCImageReader.openSlice(files[0], 3), npStack[2] * 2)
+
+    def testImageCache(self):
+        """ Tests the images cache of the registry"""
+
+        npStack = np.arange(5 * 4 * 4, dtype=np.float32).reshape((5, 4, 4))
+        fn = self.getOutputPath("cache.mrcs")
+        MRCImageReader.write(ImageStack(list(npStack)), fn, isStack=True)
+
+        previousCache = ImageReadersRegistry._cache
+        cache = ImageCache(maxBytes=npStack.nbytes)
+        ImageReadersRegistry._cache = cache
+        try:
+            ImageReadersRegistry.open("2@" + fn)
+            ImageReadersRegistry.open("2@" + fn)
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 1))
+            # Memory mapped slices are copied, not kept mapped
+            self.assertTrue(all(data.flags.owndata for data in cache._entries.values()))
+
+            # Whole file replaces its slices and serves them
+            ImageReadersRegistry.open(fn)
+            self.assertEqual((len(cache), cache.getBytes()), (1, npStack.nbytes))
+            npSlice = ImageReadersRegistry.open("3@" + fn).getImage()
+            np.testing.assert_equal(npSlice, npStack[2])
+            self.assertEqual((cache.hits, cache.misses, len(cache)), (2, 2, 1))
+
+            # Bounded by bytes
+            ImageReadersRegistry.setCacheSize(npStack[0].nbytes * 2)
+            self.assertEqual((len(cache), cache.evictions), (0, 1))
+            for index in range(1, 6):
+                ImageReadersRegistry.open("%d@%s" % (index, fn))
+            self.assertEqual(len(cache), 2)
+            self.assertLessEqual(cache.getBytes(), cache.getMaxBytes())
+        finally:
+            ImageReadersRegistry._cache = previousCache
+
+    @staticmethod
+    def _writeSpider(fileName, npImages, isStack):
+        """ Writes a SPIDER stack or volume with float32 values"""
+        def header(nz, ny, nx, maxim):
+            values = np.zeros(256, dtype=np.float32)
+            values[[0, 1, 11, 21, 23, 25]] = [nz, ny, nx, 1024, 2 if isStack else 0, maxim]
+            return values.tobytes()
+
+        n, ny, nx = npImages.shape
+        with open(fileName, 'wb') as f:
+            if isStack:
+                f.write(header(1, ny, nx, n))
+                for npImage in npImages:
+                    f.write(header(1, ny, nx, 0))
+                    f.write(npImage.astype(np.float32).tobytes())
+            else:
+                f.write(header(n, ny, nx, 0))
+                f.write(npImages.astype(np.float32).tobytes())
+
+    def testStkReader(self):
+        """ Tests SPIDER stacks and volumes reading"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        npImages = np.arange(6 * 3 * 4, dtype=np.float32).reshape((6, 3, 4))
+        stackFn = self.getOutputPath("images.stk")
+        volFn = self.getOutputPath("volume.vol")
+        self._writeSpider(stackFn, npImages, isStack=True)
+        self._writeSpider(volFn, npImages, isStack=False)
+
+        self.assertEqual(STKImageReader.getDimensions(stackFn), (4, 3, 1, 6))
+        self.assertEqual(STKImageReader.getDimensions(volFn), (4, 3, 6, 0))
+        np.testing.assert_equal(STKImageReader.readAll(stackFn), npImages)
+        np.testing.assert_equal(STKImageReader.readAll(volFn), npImages)
+        self.assertIs(STKImageReader.getReader(stackFn), STKImageReader.getReader("2@" + stackFn))
+
+        with ThreadPoolExecutor(4) as executor:
+            slices = list(executor.map(lambda i: STKImageReader.openSlice(stackFn if i % 2 else volFn, i // 2 + 1),
+                                       range(12)))
+        np.testing.assert_equal(slices, np.repeat(npImages, 2, axis=0))
+
+    def testTransformMatrixSlices(self):
+        """ Tests Scipion matrices are applied mapping input to output coordinates"""
+        npImages = np.random.RandomState(3).rand(3, 8, 8).astype(np.float32)
+        matrices = np.tile(np.eye(4), (3, 1, 1))
+        matrices[1, :2, 3] = [2, -3]  # shift x, y
+        matrices[2, :2, :2] = [[0, -1], [1, 0]]  # 90 degrees
+        out = ImageStack.transformMatrixSlices(npImages, matrices)
+
+        np.testing.assert_equal(out[0], npImages[0])
+        np.testing.assert_allclose(out[1], np.roll(npImages[1], (-3, 2), axis=(0, 1)), atol=1e-5)
+        expected = np.empty_like(npImages[2])
+        cy, cx = 4, 4
+        for row in range(8):
+            for col in range(8):
+                x, y = col - cx, row - cy
+                expected[(cy + x) % 8, (cx - y) % 8] = npImages[2, row, col]
+        np.testing.assert_allclose(out[2], expected, atol=1e-5)
+        np.testing.assert_allclose(ImageStack.transformMatrixSlice(npImages[2], matrices[2]), out[2])
+
+    def testWriteStack(self):
+        """ Tests stacks written by blocks from several source files"""
+        npImages = np.random.RandomState(5).rand(7, 6, 6).astype(np.float32)
+        mrcFn = self.getOutputPath("sources.mrcs")
+        stkFn = self.getOutputPath("sources.stk")
+        MRCImageReader.write(ImageStack(list(npImages[:4])), mrcFn, isStack=True)
+        self._writeSpider(stkFn, npImages[4:], isStack=True)
+
+        partSet = emobj.SetOfParticles(filename=self.getOutputPath("stack_particles.sqlite"))
+        partSet.setSamplingRate(2.0)
+        partSet.setAlignment2D()
+        order = [(2, mrcFn), (1, stkFn), (4, mrcFn), (1, mrcFn), (3, stkFn), (2, stkFn), (3, mrcFn + ':mrcs')]
+        for i, (index, fn) in enumerate(order):
+            p = emobj.Particle(location=(index, fn))
+            t = emobj.Transform()
+            t.setShifts(i, 0, 0)
+            p.setTransform(t)
+            partSet.append(p)
+        expected = np.array([npImages[i - 1 if fn.startswith(mrcFn) else i + 3] for i, fn in order])
+
+        outFn = self.getOutputPath("written.mrcs")
+        for applyTransform in [False, True]:
+            partSet.writeStack(outFn, applyTransform=applyTransform)
+            written = MRCImageReader.getArray(outFn)
+            if applyTransform:
+                expected = np.array([np.roll(img, i, axis=1) for i, img in enumerate(expected)])
+            np.testing.assert_allclose(written, expected, atol=1e-5)
+            self.assertEqual(MRCImageReader.getDimensions(outFn), (6, 6, 1, 7))
+            with mrcfile.open(outFn) as mrc:
+                self.assertAlmostEqual(float(mrc.voxel_size.x), 2.0)
+                self.assertAlmostEqual(float(mrc.header.dmean), expected.mean(), places=5)
+        partSet.close()
+
+    def testWriteStackVolumes(self):
+        """ Volumes are not written as stacks of their first slices"""
+        from unittest.mock import patch
+
+        volSet = emobj.SetOfVolumes(filename=self.getOutputPath("stack_volumes.sqlite"))
+        volSet.setSamplingRate(1.0)
+        for i in range(2):
+            volFn = self.getOutputPath("stack_volume%d.mrc" % i)
+            MRCImageReader.write(ImageStack(list(np.random.rand(4, 6, 6).astype(np.float32))), volFn)
+            volSet.append(emobj.Volume(location=volFn))
+
+        outFn = self.getOutputPath("written_volumes.mrcs")
+        pwutils.cleanPath(outFn)
+        with patch.object(ImageHandler, 'convert') as convert:
+            volSet.writeStack(outFn)
+        self.assertEqual(convert.call_count, 2)
+        self.assertFalse(os.path.exists(outFn))
+        volSet.close()
+
+    def testProbe(self):
+        """ Tests dimensions and data types read from the headers"""
+        from tifffile import imwrite
+        from pwem.emlib.image.image_readers import EmImageReader
+
+        npImages = np.random.RandomState(3).randint(0, 9, (5, 6, 8))
+        mrcFn = self.getOutputPath("probe.mrcs")
+        stkFn = self.getOutputPath("probe.stk")
+        tifFn = self.getOutputPath("probe.tif")
+        emFn = self.getOutputPath("probe.em")
+        with mrcfile.new(mrcFn, npImages.astype(np.int16), overwrite=True) as mrc:
+            mrc.set_image_stack()
+        self._writeSpider(stkFn, npImages, isStack=True)
+        imwrite(tifFn, npImages.astype(np.uint8))
+        EmImageReader.write(ImageStack(list(npImages.astype(np.float32))), emFn)
+
+        expected = [((8, 6, 1, 5), np.int16), ((8, 6, 1, 5), np.float32),
+                    ((8, 6, 1, 5), np.uint8), ((8, 6, 5, 1), np.float32)]
+        results = ImageReadersRegistry.probeMany([mrcFn, stkFn, tifFn, emFn, "missing.mrc"])
+        self.assertIsNone(results[-1])
+        for (dims, dtype), (expectedDims, expectedType) in zip(results, expected):
+            self.assertEqual(tuple(dims), expectedDims)
+            self.assertEqual(np.dtype(dtype), np.dtype(expectedType))
+        self.assertEqual(ImageHandler.getDimensions(stkFn), (8, 6, 1, 5))
+
+        # Cached results are not used once the file changes
+        self._writeSpider(stkFn, npImages[:2], isStack=True)
+        self.assertEqual(ImageReadersRegistry.probe(stkFn)[0], (8, 6, 1, 2))
+
+    def testAverageLocations(self):
+        """ Tests the average and variance of images from several stacks"""
+        npImages = np.random.RandomState(7).rand(11, 6, 5).astype(np.float32) * 100
+        mrcFn = self.getOutputPath("average.mrcs")
+        stkFn = self.getOutputPath("average.stk")
+        volFn = self.getOutputPath("average_vol.mrc")
+        MRCImageReader.write(ImageStack(list(npImages[:6])), mrcFn, isStack=True)
+        self._writeSpider(stkFn, npImages[6:], isStack=True)
+        MRCImageReader.write(ImageStack(list(npImages[:6])), volFn)
+
+        locations = [(i, mrcFn) for i in [3, 1, 2, 6, 4]] + [(i, stkFn) for i in range(1, 6)]
+        expected = np.concatenate([npImages[:4], npImages[5:]]).astype(np.float64)
+        for processes, chunkSize in [(1, 128), (1, 2), (3, 3)]:
+            mean, variance = ImageReadersRegistry.averageLocations(
+                locations, variance=True, chunkSize=chunkSize, processes=processes)
+            np.testing.assert_allclose(mean, expected.mean(axis=0), rtol=1e-6)
+            np.testing.assert_allclose(variance, expected.var(axis=0), rtol=1e-6)
+
+        mean, variance = ImageReadersRegistry.averageLocations([(0, stkFn)])
+        np.testing.assert_allclose(mean, npImages[6])
+        self.assertIsNone(variance)
+
+        self.assertTrue(ImageHandler._canAverageLocations(locations + [(1, mrcFn + ':mrcs')]))
+        self.assertFalse(ImageHandler._canAverageLocations([(1, volFn)]))
+
     def _testWriteAndRead(self, imgStack, extension, properties_to_check=None):
         """ Tests write and read of the image passed as parameter
 
@@ -1055,6 +1278,340 @@ class TestCopyItems(BaseTest):
         item._list.set([1.0, 2.0])
 
 
+class TestCopyItemsPipelined(BaseTest):
+    """ Pipelined copyItems must give the same output than the sequential one. """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _createInput(self, name, n):
+        inFn = self.getOutputPath(name)
+        pwutils.cleanPath(inFn)
+        inputSet = emobj.SetOfParticles(filename=inFn)
+        inputSet.setSamplingRate(1.5)
+        for i in range(1, n + 1):
+            p = emobj.Particle(location=(i, 'particles.stk'))
+            p.setMicId(i % 13)
+            p.setEnabled(i % 7 != 0)
+            inputSet.append(p)
+        inputSet.write()
+        return inputSet
+
+    def _copy(self, inputSet, name, **kwargs):
+        outFn = self.getOutputPath(name)
+        pwutils.cleanPath(outFn)
+        outputSet = emobj.SetOfParticles(filename=outFn)
+        outputSet.copyInfo(inputSet)
+        # One data row per input item, disabled ones included
+        rows = iter(range(1, inputSet.getSize() + 1))
+        outputSet.copyItems(inputSet, updateItemCallback=self._updateItem,
+                            itemDataIterator=rows, **kwargs)
+        outputSet.write()
+        size = outputSet.getSize()
+        outputSet.close()
+        return outFn, size
+
+    def _updateItem(self, item, row):
+        item._row = emobj.Integer(row)
+        item._appendItem = row % 5 != 0
+
+    def test_sameOutput(self):
+        inputSet = self._createInput('input.sqlite', 500)
+        seqFn, seqSize = self._copy(inputSet, 'sequential.sqlite')
+
+        for workers in [1, 3]:
+            pipeFn, pipeSize = self._copy(inputSet, 'pipelined%d.sqlite' % workers,
+                                          workers=workers, chunkSize=32)
+            self.assertEqual(seqSize, pipeSize)
+            query = "SELECT id, enabled, label, comment, c01, c02, c03, c04 FROM Objects"
+            rows = [sqlite3.connect(fn).execute(query).fetchall()
+                    for fn in [seqFn, pipeFn]]
+            self.assertEqual(rows[0], rows[1])
+
+        checkSet = emobj.SetOfParticles(filename=pipeFn)
+        for p in checkSet:
+            self.assertEqual(p.getObjId(), p._row.get())
+            self.assertTrue(p.getObjId() % 5 and p.getObjId() % 7)
+        checkSet.close()
+
+    def test_callbackError(self):
+        inputSet = self._createInput('input_error.sqlite', 100)
+
+        def _fail(item, row):
+            raise ValueError("wrong row %s" % row)
+
+        outputSet = emobj.SetOfParticles(filename=self.getOutputPath('error.sqlite'))
+        with self.assertRaises(ValueError):
+            outputSet.copyItems(inputSet, updateItemCallback=_fail,
+                                workers=2, chunkSize=10)
+        outputSet.close()
+
+    @skipUnless(os.environ.get('SCIPION_TEST_BENCHMARK'),
+                "set SCIPION_TEST_BENCHMARK to run it")
+    def test_benchmark(self):
+        """ Rows per second of the sequential and pipelined copies, with a
+        light callback and with a numpy one (that releases the GIL). The
+        number of items can be changed with SCIPION_TEST_COPY_SIZE. """
+        n = int(os.environ.get('SCIPION_TEST_COPY_SIZE', 2000))
+        inputSet = self._createInput('input_bench.sqlite', n)
+        image = np.random.rand(64, 64)
+
+        def _light(item, row):
+            item._score = emobj.Float(row)
+
+        def _numpy(item, row):
+            item._score = emobj.Float(np.abs(np.fft.fft2(image)).sum())
+
+        for callback in [_light, _numpy]:
+            for workers in [0, 1, 4]:
+                outFn = self.getOutputPath('bench%d.sqlite' % workers)
+                pwutils.cleanPath(outFn)
+                t0 = time.time()
+                outputSet = emobj.SetOfParticles(filename=outFn)
+                outputSet.copyInfo(inputSet)
+                outputSet.copyItems(inputSet, updateItemCallback=callback,
+                                    itemDataIterator=iter(range(n)),
+                                    workers=workers)
+                outputSet.write()
+                outputSet.close()
+                elapsed = time.time() - t0
+                logger.info("copyItems %d items, %s callback, workers=%d: "
+                            "%0.2fs (%d rows/s)" % (n, callback.__name__[1:],
+                                                    workers, elapsed, n / elapsed))
+
+
+class TestClassifyItems(BaseTest):
+    """ Buffered classification of the particles in the classes tables. """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _updateItem(self, item, row):
+        self.assertEqual(item.getObjId(), row)
+        item.setClassId(row % 5)
+        item._appendItem = row % 11 != 0
+
+    def _classify(self, classes, partSet, where):
+        rows = iter([p.getObjId() for p in partSet.iterItems(where=where)])
+        classes.classifyItems(updateItemCallback=self._updateItem,
+                              itemDataIterator=rows,
+                              iterParams={'where': where})
+
+    def test_classifyItems(self):
+        partFn = self.getOutputPath('particles.sqlite')
+        partSet = emobj.SetOfParticles(filename=partFn)
+        partSet.setSamplingRate(1.0)
+        partSet.setAcquisition(emobj.Acquisition(voltage=300))
+        for i in range(1, 301):
+            p = emobj.Particle(location=(i, 'particles.stk'))
+            p.setEnabled(i % 7 != 0)
+            partSet.append(p)
+        partSet.write()
+
+        clsFn = self.getOutputPath('classes.sqlite')
+        classes = emobj.SetOfClasses2D(filename=clsFn)
+        classes.setImages(partSet)
+        classes.CLASSIFY_BUFFER_SIZE = 17
+        self._classify(classes, partSet, 'id<=200')
+        classes.write()
+        # Add items to the existing classes, as done in streaming
+        self._classify(classes, partSet, 'id>200')
+        classes.write()
+        classes.close()
+
+        classes = emobj.SetOfClasses2D(filename=clsFn)
+        self.assertEqual([1, 2, 3, 4], list(classes.getIdSet()))
+        for cls in classes:
+            expected = [i for i in range(1, 301)
+                        if i % 5 == cls.getObjId() and i % 7 and i % 11]
+            self.assertEqual(len(expected), cls.getSize())
+            self.assertEqual(expected, [p.getObjId() for p in cls])
+            self.assertEqual(300, cls.getFirstItem().getAcquisition().getVoltage())
+        classes.close()
+
+
+class TestAppendSubset(BaseTest):
+    """ Subsets made in sqlite without building the items"""
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+        cls.partFn = cls.getOutputPath('particles.sqlite')
+        partSet = emobj.SetOfParticles(filename=cls.partFn)
+        partSet.setSamplingRate(2.5)
+        for i in range(1, 101):
+            p = emobj.Particle(location=(i, 'particles.stk'))
+            p.setMicId(None if i % 10 == 0 else i % 7)
+            p.setObjComment('particle %d' % i)
+            partSet.append(p)
+        partSet.write()
+        partSet.close()
+
+        cls.micFn = cls.getOutputPath('micrographs.sqlite')
+        micSet = emobj.SetOfMicrographs(filename=cls.micFn)
+        micSet.setSamplingRate(1.0)
+        for i in [2, 3, 5]:
+            micSet.append(emobj.Micrograph(location='mic%d.mrc' % i, objId=i))
+        micSet.write()
+        micSet.close()
+
+    def _subset(self, name, **kwargs):
+        inputSet = emobj.SetOfParticles(filename=self.partFn)
+        inputSet.loadAllProperties()
+        outFn = self.getOutputPath(name)
+        pwutils.cleanPath(outFn)
+        outputSet = emobj.SetOfParticles(filename=outFn)
+        outputSet.copyInfo(inputSet)
+        size = outputSet.appendSubset(inputSet, **kwargs)
+        outputSet.write()
+        outputSet.close()
+
+        checkSet = emobj.SetOfParticles(filename=outFn)
+        checkSet.loadAllProperties()
+        self.assertEqual(size, checkSet.getSize())
+        self.assertEqual(2.5, checkSet.getSamplingRate())
+        # Same rows and columns mapping than the input
+        for query in ["SELECT * FROM Classes", "SELECT * FROM Objects WHERE id IN (%s)"
+                      % ','.join(map(str, checkSet.getIdSet()))]:
+            rows = [sqlite3.connect(fn).execute(query).fetchall() for fn in [outFn, self.partFn]]
+            self.assertEqual(rows[0], rows[1])
+        return [p.getMicId() for p in checkSet], checkSet.getIdSet()
+
+    def test_byIds(self):
+        ids = {1, 5, 50, 99, 1000}
+        _, outIds = self._subset('ids.sqlite', ids=ids)
+        self.assertEqual(outIds, {1, 5, 50, 99})
+
+    def test_bySet(self):
+        micSet = emobj.SetOfMicrographs(filename=self.micFn)
+        _, outIds = self._subset('intersection.sqlite', refSet=micSet)
+        self.assertEqual(outIds, {2, 3, 5})
+        _, outIds = self._subset('difference.sqlite', refSet=micSet, difference=True)
+        self.assertEqual(outIds, set(range(1, 101)) - {2, 3, 5})
+
+        micIds, _ = self._subset('bymic.sqlite', refSet=micSet, attribute='_micId')
+        self.assertEqual(len(micIds), len([i for i in range(1, 101) if i % 10 and i % 7 in (2, 3, 5)]))
+        self.assertTrue(all(micId in (2, 3, 5) for micId in micIds))
+        micIds, _ = self._subset('notbymic.sqlite', refSet=micSet, attribute='_micId', difference=True)
+        self.assertEqual(micIds.count(None), 10)
+        self.assertFalse(any(micId in (2, 3, 5) for micId in micIds))
+
+    def test_setOfSets(self):
+        classesFn = self.getOutputPath('classes.sqlite')
+        pwutils.cleanPath(classesFn)
+        classes = emobj.SetOfClasses2D(filename=classesFn)
+        classes.append(emobj.Class2D())
+        classes.write()
+        outFn = self.getOutputPath('classes_subset.sqlite')
+        pwutils.cleanPath(outFn)
+        self.assertIsNone(emobj.SetOfClasses2D(filename=outFn).appendSubset(classes, ids=[1]))
+
+
+class TestStreamingSetReader(BaseTest):
+    """ Incremental reading of a set in streaming """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _appendMics(self, fn, ids, streamState=emobj.Set.STREAM_OPEN):
+        exists = os.path.exists(fn)
+        micSet = emobj.SetOfMicrographs(filename=fn)
+        if exists:
+            micSet.loadAllProperties()
+            micSet.enableAppend()
+        micSet.setSamplingRate(1.5)
+        for micId in ids:
+            micSet.append(emobj.Micrograph(location='mic%s.mrc' % micId,
+                                           objId=micId))
+        micSet.setStreamState(streamState)
+        micSet.write()
+        micSet.close()
+
+    def test_read(self):
+        fn = self.getOutputPath('stream_mics.sqlite')
+        self._appendMics(fn, [10, 20, 30])
+        reader = emprot.StreamingSetReader(fn, emobj.SetOfMicrographs)
+
+        mics = reader.read()
+        self.assertEqual([m.getObjId() for m in mics], [10, 20, 30])
+        self.assertEqual(mics[0].getSamplingRate(), 1.5)
+        self.assertFalse(reader.streamClosed)
+        self.assertEqual(reader.read(), [])
+
+        # Appended later, one of them with a lower explicit id
+        self._appendMics(fn, [5, None], emobj.Set.STREAM_CLOSED)
+        mics = reader.read()
+        self.assertEqual([m.getFileName() for m in mics],
+                         ['mic5.mrc', 'micNone.mrc'])
+        self.assertTrue(reader.streamClosed)
+        self.assertEqual(reader.read(), [])
+
+    def test_readNew(self):
+        fn = self.getOutputPath('stream_mics_keys.sqlite')
+        self._appendMics(fn, [1, 2, 3])
+        reader = emprot.StreamingSetReader(fn, emobj.SetOfMicrographs)
+        getKey = lambda mic: mic.getFileName()
+
+        self.assertEqual(list(reader.readNew(getKey, {'mic1.mrc'})),
+                         ['mic2.mrc', 'mic3.mrc'])
+        # Not processed items are returned again together with the new ones
+        self._appendMics(fn, [4])
+        self.assertEqual(list(reader.readNew(getKey, {'mic1.mrc', 'mic2.mrc'})),
+                         ['mic3.mrc', 'mic4.mrc'])
+
+
+class TestProgressLedger(BaseTest):
+    """ Done/failed bookkeeping of streaming protocols """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_ledger(self):
+        doneFn = self.getOutputPath('DONE', 'all.TXT')
+        failedFn = self.getOutputPath('FAILED_all.TXT')
+        ledger = emprot.ProgressLedger(doneFn, failedFn)
+        self.assertEqual(ledger.getDone(), set())
+
+        ledger.setInProgress([1, 2, 3, 4])
+        ledger.setDone([1, 2])
+        ledger.setDone([2, 3])
+        self.assertEqual(ledger.getInProgress(), {4})
+        ledger.setFailed([4])
+        self.assertEqual(ledger.getDone(), {1, 2, 3})
+        self.assertTrue(ledger.isFailed(4))
+        self.assertEqual(ledger.getInProgress(), set())
+        with open(doneFn) as f:
+            self.assertEqual(f.read().split(), ['1', '2', '3'])
+
+        # Appended by others, the last line is not complete yet
+        with open(doneFn, 'a') as f:
+            f.write('5\n6')
+        self.assertEqual(ledger.getDone(), {1, 2, 3, 5})
+        with open(doneFn, 'a') as f:
+            f.write('0\n')
+        self.assertTrue(ledger.isDone(60))
+        self.assertEqual(emprot.ProgressLedger(doneFn).getDone(), {1, 2, 3, 5, 60})
+
+    def test_getNewDone(self):
+        ledger = emprot.ProgressLedger(self.getOutputPath('new_done.TXT'))
+        markersDir = self.getOutputPath('MARKERS')
+        pwutils.makePath(markersDir)
+        getMarker = lambda mic: os.path.join(markersDir, 'mic_%06d.TXT' % mic.getObjId())
+        mics = [emobj.Micrograph(objId=i) for i in range(1, 6)]
+
+        self.assertEqual(ledger.getNewDone(mics, getMarker), [])
+        for mic in mics[1:4]:
+            open(getMarker(mic), 'w').close()
+        ledger.setDone([2])
+        self.assertEqual([m.getObjId() for m in ledger.getNewDone(mics, getMarker)], [3, 4])
+        self.assertEqual([m.getObjId() for m in ledger.getNewDone(
+            mics, getMarker, isDoneFunc=lambda mic: mic.getObjId() > 3)], [4, 5])
+
+
 class TestCoordinatesTiltPair(BaseTest):
     # TODO: A proper test for CoordinatesTiltPair is missing
     @classmethod
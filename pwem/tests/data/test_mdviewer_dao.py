@@ -0,0 +1,267 @@
+# **************************************************************************
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+import pyworkflow.tests as pwtests
+from metadataviewer.model import Page
+
+import pwem.objects as emobj
+from pwem.convert.transformations import euler_matrix, euler_from_matrix
+from pwem.viewers.mdviewer.sqlite_dao import ScipionSetsDAO, OBJECT_TABLE
+from pwem.viewers.mdviewer.star_dao import StarFile, INDEX_EXTENSION
+
+
+class ObjectManagerMock:
+    """ Minimal object manager needed to fill the tables """
+    def isLabelVisible(self, label):
+        return True
+
+
+class TestScipionSetsDAO(pwtests.BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        pwtests.setupTestOutput(cls)
+        cls.setFn = cls.getOutputPath('particles.sqlite')
+        partSet = emobj.SetOfParticles(filename=cls.setFn)
+        partSet.setSamplingRate(1.0)
+        rng = np.random.default_rng(0)
+        for i in range(1, 1001):
+            p = emobj.Particle(location=(i, 'particles.stk'))
+            # Many ties and some missing values
+            p.setMicId(None if i % 13 == 0 else int(rng.integers(7)))
+            matrix = euler_matrix(*rng.uniform(-3, 3, 3), axes='szyz')
+            matrix[:2, 3] = rng.uniform(-10, 10, 2)
+            p.setTransform(emobj.Transform(matrix))
+            partSet.append(p)
+        partSet.write()
+        partSet.close()
+        # Copy without the indexes created by the viewer
+        cls.noIndexFn = cls.getOutputPath('particles_noindex.sqlite')
+        shutil.copy(cls.setFn, cls.noIndexFn)
+
+        # 2D (3x3) and 3D (4x4) transforms in the same set
+        cls.mixedFn = cls.getOutputPath('particles_mixed.sqlite')
+        partSet = emobj.SetOfParticles(filename=cls.mixedFn)
+        partSet.setSamplingRate(1.0)
+        for i in range(1, 51):
+            p = emobj.Particle(location=(i, 'particles.stk'))
+            matrix = euler_matrix(*rng.uniform(-3, 3, 3), axes='szyz')
+            matrix[:2, 3] = rng.uniform(-10, 10, 2)
+            if i % 2:
+                matrix = euler_matrix(0, 0, rng.uniform(-3, 3), axes='szyz')[:3, :3]
+                matrix[:2, 2] = rng.uniform(-10, 10, 2)
+            p.setTransform(emobj.Transform(matrix))
+            partSet.append(p)
+        partSet.write()
+        partSet.close()
+
+    def _getIds(self, column, mode, setFn=None):
+        """ Ids of the rows sorted as the viewer does """
+        con = sqlite3.connect(setFn or self.setFn)
+        col = con.execute("SELECT column_name FROM Classes WHERE label_property=?",
+                          (column,)).fetchone()
+        orderBy = 'id' if column == 'id' else '%s %s, id' % (col[0], mode)
+        ids = [row[0] for row in con.execute("SELECT id FROM Objects ORDER BY %s %s" % (orderBy, mode))]
+        con.close()
+        return ids
+
+    def _checkPagination(self, dao, setFn=None):
+        """ Pages read by seeking must match sorted rows, whatever the
+        order in which pages are requested. """
+        table = dao.getTables()[OBJECT_TABLE]
+        dao.fillTable(table, ObjectManagerMock())
+        pageSize = 64
+
+        for column in ['id', '_micId']:
+            for asc in [True, False]:
+                goldIds = self._getIds(column, 'ASC' if asc else 'DESC', setFn)
+                numberOfPages = len(goldIds) // pageSize + 1
+                # Jump to pages after and before the ones read (from rows
+                # with and without values), then go through all pages
+                for pageNumber in ([1, numberOfPages, 2, 9, numberOfPages - 3, 5] +
+                                   list(range(1, numberOfPages + 2))):
+                    page = Page(table, pageNumber=pageNumber, pageSize=pageSize)
+                    dao.fillPage(page, column, orderAsc=asc)
+                    first = (pageNumber - 1) * pageSize
+                    self.assertEqual(goldIds[first:first + pageSize],
+                                     [row.getId() for row in page.getRows()],
+                                     "page %d sorted by %s" % (pageNumber, column))
+
+    def test_pagination(self):
+        dao = ScipionSetsDAO(self.setFn)
+        self._checkPagination(dao)
+        dao.close()
+
+    def test_paginationWithoutIndex(self):
+        """ Ties must be sorted in the same way in all pages when there is
+        no index to sort, e.g. read-only files """
+        dao = ScipionSetsDAO(self.noIndexFn)
+        dao._createSortIndex = lambda tableName, column: None
+        self._checkPagination(dao)
+        dao.close()
+
+    def test_paginationStreaming(self):
+        """ Pages read after adding rows to the set must include them """
+        setFn = self.getOutputPath('particles_streaming.sqlite')
+        shutil.copy(self.setFn, setFn)
+        dao = ScipionSetsDAO(setFn)
+        self._checkPagination(dao, setFn)
+
+        partSet = emobj.SetOfParticles(filename=setFn)
+        partSet.loadAllProperties()
+        partSet.enableAppend()
+        for i in range(1001, 1201):
+            p = emobj.Particle(location=(i, 'particles.stk'))
+            p.setMicId(i % 5)
+            p.setTransform(emobj.Transform(np.eye(4)))
+            partSet.append(p)
+        partSet.write()
+        partSet.close()
+        self._checkPagination(dao, setFn)
+        dao.close()
+
+    def _checkAlignmentColumns(self, setFn, pageNumber, pageSize):
+        """ Angles and shifts computed for a whole page must match the ones
+        computed for each matrix. """
+        dao = ScipionSetsDAO(setFn)
+        table = dao.getTables()[OBJECT_TABLE]
+        dao.fillTable(table, ObjectManagerMock())
+        colNames = [col.getName() for col in table.getColumns()]
+        matrixIndex = colNames.index('_transform._matrix')
+        page = Page(table, pageNumber=pageNumber, pageSize=pageSize)
+        dao.fillPage(page, 'id')
+        self.assertEqual(pageSize, len(page.getRows()))
+
+        for row in page.getRows():
+            values = row.getValues()
+            matrix = np.array(json.loads(values[matrixIndex]))
+            angles = np.rad2deg(euler_from_matrix(np.linalg.inv(matrix), axes='szyz'))
+            expected = list(angles) + [matrix[0, -1], matrix[1, -1]]
+            computed = [values[colNames.index('_transform.' + label)]
+                        for label in ['_rot', '_tilt', '_psi', '_shiftX', '_shiftY']]
+            np.testing.assert_allclose(computed, expected, atol=1e-8)
+        dao.close()
+
+    def test_alignmentColumns(self):
+        self._checkAlignmentColumns(self.setFn, pageNumber=2, pageSize=100)
+
+    def test_alignmentColumnsMixed(self):
+        """ Pages with 2D and 3D matrices """
+        self._checkAlignmentColumns(self.mixedFn, pageNumber=1, pageSize=50)
+
+
+class TestStarFile(pwtests.BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        pwtests.setupTestOutput(cls)
+        cls.starFn = cls.getOutputPath('particles.star')
+        rng = np.random.default_rng(0)
+        cls.rows = []
+        with open(cls.starFn, 'w') as f:
+            f.write("# version 30001\n\ndata_general\n\n_rlnImageSize 64\n_rlnClassNumber 2\n\n")
+            f.write("data_particles\n\nloop_\n_rlnImageName #1\n_rlnDefocusU #2\n_rlnClassNumber #3\n")
+            for i in range(1, 3001):
+                values = ['%06d@particles.mrcs' % i, '%0.2f' % rng.uniform(5000, 20000),
+                          str(int(rng.integers(5)))]
+                cls.rows.append([str(i)] + values)
+                f.write(' '.join(values) + '\n')
+            f.write("\n")
+
+    def _checkPages(self, dao, table, sortColumn, asc):
+        sign = 1 if asc else -1  # Equal values keep the file order
+        gold = sorted(self.rows, key=lambda row: sign * float(row[sortColumn]))
+        pageSize = 100
+        for pageNumber in [30, 1, 17, 31]:
+            page = Page(table, pageNumber=pageNumber, pageSize=pageSize)
+            table.setSortingChanged(pageNumber == 30)
+            dao.fillPage(page, table.getSortingColumn(), asc)
+            first = (pageNumber - 1) * pageSize
+            self.assertEqual(gold[first:first + pageSize],
+                             [row.getValues() for row in page.getRows()])
+            self.assertEqual([int(row[0]) for row in gold[first:first + 10]],
+                             dao.getSelectedRangeRowsIds(table.getName(), first + 1, 9, None))
+
+    def test_tables(self):
+        dao = StarFile(self.starFn)
+        tables = dao.getTables()
+        self.assertEqual(['data_general', 'data_particles'], list(tables))
+        self.assertEqual(1, dao.getTableRowCount('data_general'))
+        self.assertEqual(3000, dao.getTableRowCount('data_particles'))
+
+        general = tables['data_general']
+        dao.fillTable(general, None)
+        page = Page(general, pageNumber=1, pageSize=10)
+        dao.fillPage(page, 'id', True)
+        self.assertEqual([['1', '64', '2']], [row.getValues() for row in page.getRows()])
+
+        table = tables['data_particles']
+        dao.fillTable(table, None)
+        self.assertEqual(['id', 'rlnImageName', 'rlnDefocusU', 'rlnClassNumber'],
+                         [col.getName() for col in table.getColumns()])
+        for column in [0, 2, 3]:
+            for asc in [True, False]:
+                table.setSortingColumn(table.getColumns()[column].getName())
+                self._checkPages(dao, table, column, asc)
+        dao.close()
+
+    def test_blankLineInLoop(self):
+        """ Rows counted must be the ones read, up to the first blank line """
+        starFn = self.getOutputPath('blank_line.star')
+        with open(starFn, 'w') as f:
+            f.write("data_particles\n\nloop_\n_rlnImageName #1\n\n")
+            f.write("1@a.mrcs\n2@a.mrcs\n\n3@a.mrcs\n")
+            f.write("data_classes\n\nloop_\n_rlnClassNumber #1\n1\n2\n")
+        dao = StarFile(starFn)
+        tables = dao.getTables()
+        for tableName, names in [('data_particles', ['1@a.mrcs', '2@a.mrcs']),
+                                 ('data_classes', ['1', '2'])]:
+            self.assertEqual(len(names), dao.getTableRowCount(tableName))
+            table = tables[tableName]
+            dao.fillTable(table, None)
+            page = Page(table, pageNumber=1, pageSize=10)
+            dao.fillPage(page, 'id', True)
+            self.assertEqual(names, [row.getValues()[1] for row in page.getRows()])
+        dao.close()
+
+    def test_persistedIndex(self):
+        indexFn = self.starFn + INDEX_EXTENSION
+        dao = StarFile(self.starFn, persistIndex=True)
+        dao.getTables()
+        dao.close()
+        self.assertTrue(os.path.exists(indexFn))
+
+        dao = StarFile(self.starFn)
+        table = dao.getTables()['data_particles']
+        dao.fillTable(table, None)
+        self.assertEqual(3000, dao.getTableRowCount('data_particles'))
+        table.setSortingColumn('rlnDefocusU')
+        self._checkPages(dao, table, 2, True)
+        dao.close()
+        os.remove(indexFn)
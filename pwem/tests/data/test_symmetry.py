@@ -1104,6 +1104,42 @@ class TestSymmetry(pwtests.unittest.TestCase):
             print(img.getTransform().getMatrix(), transformsOUT[i])
             self.assertTrue(np.allclose(img.getTransform().getMatrix(), transformsOUT[i]))
 
+    def test_51_moveTransformsInsideUnitCell(self):
+        """ The matrices moved at once must match the ones moved one by one. """
+        from pwem.convert import SymmetryHelper
+        from pwem.convert.transformations import euler_matrix
+
+        def moveTransform(matrix, matrixSet, unitCellPlanes):
+            """ Move one matrix as moveParticlesInsideUnitCell used to do """
+            column = matrix[0:3, 2]
+            if all(np.dot(column, plane) > 0 for plane in unitCellPlanes):
+                return matrix
+            for symMatrix in matrixSet:
+                columnPrime = np.delete(np.array(symMatrix), -1, 1).dot(column)[:3]
+                if all(np.dot(columnPrime, plane) > 0 for plane in unitCellPlanes):
+                    return np.dot(symMatrix, matrix)
+            return None
+
+        rng = np.random.default_rng(51)
+        matrices = []
+        for angles in rng.uniform(-np.pi, np.pi, (50, 3)):
+            matrix = euler_matrix(*angles, axes='szyz')
+            matrix[:3, 3] = rng.uniform(-10, 10, 3)
+            matrices.append(matrix)
+
+        for sym, n in [(emcts.SYM_CYCLIC, 4), (emcts.SYM_DIHEDRAL_X, 3),
+                       (emcts.SYM_TETRAHEDRAL_Z3, 1), (emcts.SYM_OCTAHEDRAL, 1),
+                       (emcts.SYM_I222r, 1)]:
+            matrixSet, unitCellPlanes = SymmetryHelper.getSymmetryMatricesAndPlanes(sym, n)
+            # Small chunks to check that all of them are moved
+            moved, found = SymmetryHelper._moveTransformsInsideUnitCell(
+                matrices, matrixSet, unitCellPlanes, chunkSize=16)
+            for matrix, movedMatrix, isFound in zip(matrices, moved, found):
+                expected = moveTransform(matrix, matrixSet, unitCellPlanes)
+                self.assertEqual(expected is not None, isFound)
+                if isFound:
+                    self.assertTrue(np.allclose(expected, movedMatrix), (sym, n))
+
     def test_60_SymmetryHelicalSymmetryMatrices(self):
         n = 7
         angle=360.0/n
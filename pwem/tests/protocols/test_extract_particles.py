@@ -1,5 +1,9 @@
+import os
+import shutil
+import tempfile
 import unittest
 from unittest.mock import Mock, patch, MagicMock
+import pwem.objects as emobj
 from pwem.protocols.protocol_particles import ProtExtractParticles
 from pwem.tests.utils import getSoCTFsMock, getSoMMock
 
@@ -188,3 +192,73 @@ class TestExtractParticles(unittest.TestCase):
             extractParticles.micDict = processedMics
 
             return extractParticles._loadInputList()
+
+
+class TestLoadInputCoords(unittest.TestCase):
+    """ Coordinates read by micrograph from a streaming set of coordinates """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpDir)
+
+    def _appendCoords(self, coordSet, micIds):
+        for micId in micIds:
+            coord = emobj.Coordinate(x=micId, y=micId)
+            coord.setMicId(micId)
+            coordSet.append(coord)
+        coordSet.write()
+
+    def _getMics(self, *micIds):
+        micDict = {}
+        for micId in micIds:
+            mic = emobj.Micrograph()
+            mic.setObjId(micId)
+            micDict['mic%d' % micId] = mic
+        return micDict
+
+    def _getCoordIds(self, prot, micId):
+        return [coord.getObjId() for coord in prot.coordDict[micId]]
+
+    def test_loadInputCoords(self):
+        commands = []
+
+        class SetOfCoordinates(emobj.SetOfCoordinates):
+            """ Record the commands run on the coordinates db """
+            def _getMapper(self):
+                db = super()._getMapper().db
+                if not isinstance(db.executeCommand, Mock):
+                    execute = db.executeCommand
+                    db.executeCommand = Mock(side_effect=lambda *args:
+                                             commands.append(args[0]) or execute(*args))
+                return self._mapper
+
+        coordSet = emobj.SetOfCoordinates(
+            filename=os.path.join(self.tmpDir, 'coordinates.sqlite'))
+        coordSet.setStreamState(coordSet.STREAM_OPEN)
+        self._appendCoords(coordSet, [2, 1, 2, 1, 3])  # ids 1 to 5
+
+        prot = ProtExtractParticles()
+        prot.coordDict = {}
+        prot.getCoords = lambda: coordSet
+
+        with patch.object(emobj, 'SetOfCoordinates', SetOfCoordinates):
+            micList = prot._loadInputCoords(self._getMics(1, 4))
+            self.assertEqual(['mic1'], list(micList))
+            self.assertEqual([2, 4], self._getCoordIds(prot, 1))
+
+            # Coordinates added later are read once, and the ones of the
+            # micrographs already loaded are ignored
+            self._appendCoords(coordSet, [1, 2, 4])  # ids 6 to 8
+            micList = prot._loadInputCoords(self._getMics(2, 3))
+            self.assertEqual(['mic2', 'mic3'], list(micList))
+            self.assertEqual([2, 4], self._getCoordIds(prot, 1))
+            self.assertEqual([1, 3, 7], self._getCoordIds(prot, 2))
+            self.assertEqual([5], self._getCoordIds(prot, 3))
+
+            micList = prot._loadInputCoords(self._getMics(4))
+            self.assertEqual(['mic4'], list(micList))
+            self.assertEqual([8], self._getCoordIds(prot, 4))
+            self.assertEqual({}, prot._pendingCoords)
+        coordSet.close()
+
+        self.assertEqual(1, len([c for c in commands if c.startswith('CREATE INDEX')]))
@@ -0,0 +1,93 @@
+# **************************************************************************
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+import mrcfile
+import numpy as np
+from tifffile import imwrite
+
+from pyworkflow.tests import BaseTest, setupTestOutput
+from pwem.protocols.protocol_align_movies import (ProtAlignMovies,
+                                                  canCorrectGainStack,
+                                                  correctGainStack)
+
+
+class TestCorrectGain(BaseTest):
+    """ Gain and dark correction of movies without xmipp """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+        rng = np.random.RandomState(7)
+        cls.frames = rng.randint(0, 20, size=(9, 16, 12)).astype(np.int16)
+        cls.gain = rng.rand(16, 12).astype(np.float32) + 0.5
+        cls.dark = rng.rand(16, 12).astype(np.float32)
+
+        cls.movieMrc = cls.getOutputPath('movie.mrcs')
+        with mrcfile.new(cls.movieMrc, cls.frames, overwrite=True) as mrc:
+            mrc.voxel_size = 1.25
+        cls.movieTif = cls.getOutputPath('movie.tif')
+        imwrite(cls.movieTif, cls.frames.astype(np.uint8))
+        cls.gainFn = cls.getOutputPath('gain.mrc')
+        with mrcfile.new(cls.gainFn, cls.gain, overwrite=True):
+            pass
+        cls.darkFn = cls.getOutputPath('dark.mrc')
+        with mrcfile.new(cls.darkFn, cls.dark[None], overwrite=True):
+            pass
+
+    def _checkOutput(self, outputFn, expected):
+        with mrcfile.open(outputFn) as mrc:
+            self.assertEqual(np.float32, mrc.data.dtype)
+            self.assertTrue(mrc.is_image_stack())
+            np.testing.assert_allclose(mrc.data, expected, rtol=1e-6)
+            return float(mrc.voxel_size.x)
+
+    def test_correctGainStack(self):
+        frames = self.frames.astype(np.float32)
+        for movieFn in [self.movieMrc, self.movieTif]:
+            for threads in [1, 3]:
+                outputFn = self.getOutputPath('corrected_%d.mrcs' % threads)
+                correctGainStack(movieFn, outputFn, self.gainFn, self.darkFn,
+                                 chunkSize=2, threads=threads)
+                self._checkOutput(outputFn, (frames - self.dark) * self.gain)
+
+            correctGainStack(movieFn, outputFn, gainFn=self.gainFn)
+            self._checkOutput(outputFn, frames * self.gain)
+            correctGainStack(movieFn, outputFn, darkFn=self.darkFn)
+            voxelSize = self._checkOutput(outputFn, frames - self.dark)
+            # Sampling rate is kept from MRC movies
+            self.assertAlmostEqual(1.25 if movieFn == self.movieMrc else 0, voxelSize)
+
+    def test_correctGain(self):
+        outputFn = self.getOutputPath('movie_corrected.mrcs')
+        ProtAlignMovies().correctGain(self.movieMrc, outputFn,
+                                      gainFn=self.gainFn, darkFn=self.darkFn)
+        self._checkOutput(outputFn, (self.frames - self.dark) * self.gain)
+
+        self.assertFalse(canCorrectGainStack('movie.em:ems', 'movie.mrcs'))
+        self.assertFalse(canCorrectGainStack(self.movieMrc, 'movie.tif'))
+        self.assertFalse(canCorrectGainStack(self.movieMrc, outputFn,
+                                             gainFn='gain.xmp'))
+
+        with self.assertRaises(Exception):
+            correctGainStack(self.movieMrc, outputFn,
+                             gainFn=self.getOutputPath('movie.mrcs'))
@@ -160,3 +160,192 @@ class TestImportMovies(TestImportBase):
         self._checkOutput(protBlacklistSetFiles, args, size=1,
                           movieNames=['Falcon_2012_06_12-16_55_40_0_movie.mrcs'])
 
+
+
+class TestFileWatcher(pwtests.BaseTest):
+    """ Incremental discovery of the files to import in streaming """
+
+    @classmethod
+    def setUpClass(cls):
+        pwtests.setupTestOutput(cls)
+
+    def _touch(self, *paths, age=0):
+        for path in paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+            if age:
+                t = time.time() - age
+                os.utime(path, (t, t))
+
+    def _testWatcher(self, useInotify):
+        from glob import glob
+        from pwem.protocols.protocol_import.file_watcher import FileWatcher
+
+        root = self.getOutputPath('watched_%s' % useInotify)
+        path = lambda *parts: os.path.join(root, *parts)
+        self._touch(path('a', 'mic1.mrc'), path('b', 'mic2.mrc'),
+                    path('b', 'mic2.txt'), path('b', '.mic3.mrc'), age=60)
+        pattern = path('*', 'mic*.mrc')
+        watcher = FileWatcher(pattern, stableTime=30, useInotify=useInotify)
+
+        reported = watcher.poll()
+        self.assertEqual([path('a', 'mic1.mrc'), path('b', 'mic2.mrc')], reported)
+        self.assertEqual([], watcher.poll())
+
+        # Old directories (as in a long session) are not listed if not modified
+        old = time.time() - 60
+        for d in ['a', 'b']:
+            os.utime(path(d), (old, old))
+        self.assertEqual([], watcher.poll())
+
+        # New files are reported once they are stable
+        self._touch(path('a', 'mic4.mrc'), path('c', 'mic5.mrc'))
+        self.assertEqual([], watcher.poll())
+        self.assertTrue(watcher.hasPending())
+        self._touch(path('a', 'mic4.mrc'), path('c', 'mic5.mrc'), age=60)
+        newFiles = watcher.poll()
+        self.assertEqual([path('a', 'mic4.mrc'), path('c', 'mic5.mrc')], newFiles)
+        self.assertFalse(watcher.hasPending())
+        reported += newFiles
+
+        watcher.resubmit(path('a', 'mic4.mrc'))
+        self.assertEqual([path('a', 'mic4.mrc')], watcher.poll())
+
+        self.assertEqual(sorted(glob(pattern)), sorted(reported))
+        watcher.close()
+
+    def test_inotify(self):
+        self._testWatcher(useInotify=True)
+
+    def test_mtime(self):
+        self._testWatcher(useInotify=False)
+
+    def test_uniqueNames(self):
+        """ Files found in later checks keep the names given in previous
+        runs, and get a path based name if another file found in this run
+        has the same name """
+        root = self.getOutputPath('unique_names')
+        path = lambda *parts: os.path.join(root, 'data', *parts)
+        self._touch(path('a', 'mic2.mrc'), age=60)
+        self._touch(path('a', 'mic1.mrc'))  # imported before, but modified
+        prot = emprot.ProtImportMicrographs(workingDir=os.path.join(root, 'prot'))
+        prot.makePathsAndClean()
+        prot.filesPath.set(os.path.join(root, 'data'))
+        prot.filesPattern.set('*/mic*.mrc')
+        prot.importedFiles = {'mic1.mrc'}
+        prot._fileWatcherStableTime = 30
+        prot._uniqueFnPaths = {}
+
+        self.assertEqual([(path('a', 'mic2.mrc'), 'mic2.mrc', None)],
+                         list(prot.iterNewInputFiles()))
+        self._touch(path('a', 'mic1.mrc'), path('c', 'mic2.mrc'), age=60)
+        self.assertEqual([(path('c', 'mic2.mrc'), 'c_mic2.mrc', None)],
+                         list(prot.iterNewInputFiles()))
+        prot._closeFileWatcher()
+
+
+class TestBlacklistIndex(pwtests.BaseTest):
+    """ Blacklist lookups of the micrographs and movies import """
+
+    @classmethod
+    def setUpClass(cls):
+        pwtests.setupTestOutput(cls)
+
+    def test_set(self):
+        from pwem.objects import SetOfMicrographs, Micrograph
+        from pwem.protocols.protocol_import.blacklist import BlacklistIndex
+
+        target = self.getOutputPath('raw', 'mic_link.mrc')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        open(target, 'w').close()
+        link = self.getOutputPath('mic_link.mrc')
+        os.symlink(target, link)
+
+        micSet = SetOfMicrographs(filename=self.getOutputPath('blacklist.sqlite'))
+        for fn in ['imported/mic_1.mrc', link]:
+            micSet.append(Micrograph(location=fn))
+        micSet.write()
+
+        index = BlacklistIndex(micSet)
+        self.assertTrue(index.inSet('/data/mic_1.mrc', 'mic_1.mrc'))
+        self.assertTrue(index.inSet(target, 'other.mrc'))
+        self.assertFalse(index.inSet('/data/mic_2.mrc', 'mic_2.mrc'))
+
+        # Files added to the set in streaming are found
+        time.sleep(0.01)
+        micSet.append(Micrograph(location='imported/mic_2.mrc'))
+        micSet.write()
+        self.assertTrue(index.inSet('/data/mic_2.mrc', 'mic_2.mrc'))
+        micSet.close()
+
+        self.assertFalse(BlacklistIndex().inSet('/data/mic_1.mrc', 'mic_1.mrc'))
+
+    def test_items(self):
+        from pwem.protocols.protocol_import.blacklist import BlacklistIndex
+
+        index = BlacklistIndex(items=['/data/mic_1.mrc', '', '/data/mic_22.mrc'])
+        self.assertEqual('mic_2', index.matchItem('mic_2'))
+        self.assertIsNone(index.matchItem('/data/mic_3.mrc'))
+
+        index = BlacklistIndex(items=[r'.*_1\.mrc', r'/data/.*_2'],
+                               useRegexps=True)
+        self.assertEqual(r'/data/.*_2', index.matchItem('/data/mic_22.mrc'))
+        self.assertEqual(r'.*_1\.mrc', index.matchItem('/data/mic_1.mrc'))
+        self.assertIsNone(index.matchItem('/other/mic_3.mrc'))
+
+    def test_namesWithoutSet(self):
+        """ Checking the blacklist does not change the names of the files
+        imported with a nested pattern """
+        root = self.getOutputPath('nested')
+        fileNames = [os.path.join(root, 'data', d, 'mic_%s.mrc' % d)
+                     for d in ['s1', 's2']]
+        for fn in fileNames:
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            open(fn, 'w').close()
+        prot = emprot.ProtImportMicrographs(workingDir=os.path.join(root, 'prot'))
+        prot.makePathsAndClean()
+        prot.filesPath.set(os.path.join(root, 'data'))
+        prot.filesPattern.set('*/*.mrc')
+
+        uniqueNames = []
+        for fn in fileNames:
+            self.assertFalse(prot.isBlacklisted(fn))
+            uniqueNames.append(prot._getUniqueFileName(fn))
+        self.assertEqual(['mic_s1.mrc', 'mic_s2.mrc'], uniqueNames)
+
+
+class TestCreateMovieStack(pwtests.BaseTest):
+    """ Movie stacks written from individual frame files """
+
+    @classmethod
+    def setUpClass(cls):
+        pwtests.setupTestOutput(cls)
+
+    def test_createMovieStack(self):
+        from concurrent.futures import ProcessPoolExecutor
+        import numpy as np
+        import mrcfile
+        from pwem.protocols.protocol_import.micrographs import createMovieStack
+
+        movies = {}
+        for m in range(3):
+            frames = np.random.randint(0, 5, (4, 32, 48)).astype(np.int8)
+            frameFns = []
+            for i, frame in enumerate(frames):
+                frameFn = self.getOutputPath('movie%d_%d.mrc' % (m, i + 1))
+                mrcfile.new(frameFn, frame, overwrite=True).close()
+                frameFns.append(frameFn)
+            movies[self.getOutputPath('movie%d_frames.mrcs' % m)] = (frameFns, frames)
+
+        with ProcessPoolExecutor(2) as executor:
+            futures = [executor.submit(createMovieStack, frameFns, movieFn,
+                                       deleteFrames=True)
+                       for movieFn, (frameFns, _) in movies.items()]
+            for future in futures:
+                future.result()
+
+        for movieFn, (frameFns, frames) in movies.items():
+            with mrcfile.open(movieFn) as mrc:
+                self.assertTrue(mrc.is_image_stack())
+                np.testing.assert_array_equal(frames, mrc.data)
+            self.assertFalse(any(os.path.exists(fn) for fn in frameFns))
@@ -31,9 +31,43 @@ from PIL import Image
 import pyworkflow.tests as pwtests
 import pwem.objects as emobj
 from pwem.protocols import ProtSetFilter, EMProtocol
+from pwem.protocols.protocol_set_filter import compileColumnFormula
 
 OUTPUT_COORDINATES = "outputCoordinates"
 
+class TestColumnFormula(pwtests.unittest.TestCase):
+    """ Formulas evaluated over columns must match the item by item ones """
+
+    def test_formulas(self):
+        rng = np.random.default_rng(5)
+        coords = []
+        for i in range(200):
+            coord = emobj.Coordinate(x=int(rng.integers(0, 100)), y=int(rng.integers(0, 100)))
+            coord.setMicId(i % 4)
+            coords.append(coord)
+
+        for formula in ['item._x.get() > 50',
+                        'item._x.get() > 20 and not item._micId.get() == 2 or item._y.get() < 10',
+                        '10 < item._x.get() <= 60 != item._y.get()',
+                        'abs(item._x.get() - item._y.get()) < numpy.sqrt(item._y.get())',
+                        'np.maximum(item._x.get(), item._y.get()) > 80',
+                        'True']:
+            code, attributes = compileColumnFormula(formula)
+            namespace = {'_col%d' % i: np.array([c.getAttributeValue(a) for c in coords])
+                         for i, a in enumerate(attributes)}
+            namespace.update(_np=np, numpy=np, np=np)
+            mask = np.broadcast_to(eval(code, namespace), len(coords))
+            expected = [bool(eval(formula, {'numpy': np, 'np': np}, {'item': c})) for c in coords]
+            self.assertEqual(mask.tolist(), expected, formula)
+
+        for formula in ['item.getX() > 3', 'import numpy; item._x.get()',
+                        'item._x.get() in [1, 2]', 'item._x > 3', 'item._x.set(1)',
+                        # Reductions are per item values, not over the set
+                        'item._x.get() > np.mean(item._x.get())',
+                        'numpy.sum(item._y.get()) > 3', 'np.any(item._x.get())']:
+            self.assertIsNone(compileColumnFormula(formula), formula)
+
+
 class TestSetFilter(pwtests.BaseTest):
     """Run different tests related to the editor set protocol."""
     @classmethod
@@ -42,7 +42,8 @@ import pyworkflow as pw
 from metadataviewer.dao.model import IDAO
 from metadataviewer.model import Table, Column, BoolRenderer, ImageRenderer, StrRenderer, FloatRenderer
 from metadataviewer.model.renderers import Action
-from pwem.convert.transformations import euler_from_matrix
+from pwem.convert.transformations import euler_from_matrices
+from pwem.objects import Matrix
 
 ALLOWED_COLUMNS_TYPES = ['String', 'Float', 'Integer', 'Boolean', 'Matrix',
                          'CsvList']
@@ -56,6 +57,7 @@ EXTENDED_COLUMN_NAME = 'stack'
 ENABLED_COLUMN = 'enabled'
 PROPERTIES_TABLE = 'Properties'
 OBJECT_TABLE = 'objects'
+ALIGNMENT_CACHE_SIZE = 100000  # Max number of rows with cached alignment values
 
 SCIPION_OBJECT_ID = "SCIPION_OBJECT_ID"
 SCIPION_PORT = "SCIPION_PORT"
@@ -114,6 +116,14 @@ class ScipionSetsDAO(IDAO):
         self._labelsTypes = {}
         self._aliases = {}
         self._columnsMap = {}
+        self._excludedColumns = {}
+        self._columnsReverseMap = {}
+        self._pageAnchors = {}  # {(tableName, column, mode): {rowPosition: (value, id)}}
+        self._dataVersion = None  # Version of the file when the anchors were read
+        self._sortIndexes = set()
+        self._queries = {}
+        self._matrixColumns = {}  # {tableName: [matrix columns]}
+        self._alignmentValues = {}  # {(tableName, matrixColumn): {rowId: (rot, tilt, psi, shiftX, shiftY)}}
         self._tableWithAdditionalInfo = None
         self._objectsType = {}
 
@@ -311,32 +321,27 @@ class ScipionSetsDAO(IDAO):
 
             elif colName.endswith("_matrix"):
 
-                def addAlignmentColumn(name, offset, position):
+                def addAlignmentColumn(name, matrixCol, position):
                     extraCol = ScipionColumn(name, renderer=FloatRenderer())
                     extraCol.setIsSorteable(False)
                     extraCol.setIsVisible(newCol.isVisible())
-                    extraCol.setCallback(lambda row, values: self.exctractAngularValue(values, offset, position))
-                    table.addColumn(extraCol)
-
-                def addShiftColumn(name, offset, position):
-                    extraCol = ScipionColumn(name, renderer=FloatRenderer())
-                    extraCol.setIsVisible(newCol.isVisible())
-                    extraCol.setIsSorteable(False)
-                    extraCol.setCallback(lambda row, values: self.exctractShift(values, offset, position))
+                    extraCol.setCallback(lambda row, values: values.append(
+                        self._getAlignmentValue(tableName, matrixCol, row, position)))
                     table.addColumn(extraCol)
 
+                self._matrixColumns.setdefault(tableName, []).append(colName)
                 colNamePrefix = colName.split("_matrix")[0]
-                addAlignmentColumn(colNamePrefix + "_rot", -1, 0)
+                addAlignmentColumn(colNamePrefix + "_rot", colName, 0)
                 computedColsCount += 1
                 if imgRenderer:
                     imgRenderer.setRotationColumnIndex(index + computedColsCount)
-                addAlignmentColumn(colNamePrefix + "_tilt", -2, 1)
+                addAlignmentColumn(colNamePrefix + "_tilt", colName, 1)
                 computedColsCount += 1
-                addAlignmentColumn(colNamePrefix + "_psi", -3, 2)
+                addAlignmentColumn(colNamePrefix + "_psi", colName, 2)
                 computedColsCount += 1
-                addShiftColumn(colNamePrefix + "_shiftX", -4, 0)
+                addAlignmentColumn(colNamePrefix + "_shiftX", colName, 3)
                 computedColsCount += 1
-                addShiftColumn(colNamePrefix + "_shiftY", -5, 1)
+                addAlignmentColumn(colNamePrefix + "_shiftY", colName, 4)
                 computedColsCount += 1
 
         # table.setAlias(self._aliases[tableName])
@@ -345,21 +350,54 @@ class ScipionSetsDAO(IDAO):
         endTime = time.time()
         logger.debug("Table structure created: %f" % (endTime - initTime))
 
-    def exctractAngularValue(self, values, offset, position):
-        """ Extract the euler angle form the matrix"""
-        matrix = values[offset]
-        if isinstance(matrix, str):
-            matrix = numpy.array(eval(matrix))
-            values[offset] = matrix
-        matrixI = numpy.linalg.inv(matrix)
-        euler_data = euler_from_matrix(matrix=matrixI, axes='szyz')
-        values.append(numpy.rad2deg(euler_data[position]))
-
-    def exctractShift(self, values, offset, position):
-        """ Extract offset value """
-        matrix = values[offset]
-        shape = matrix.shape[0]
-        values.append(matrix[position, shape - 1])
+    def _decodeAlignments(self, tableName, rows):
+        """ Compute the alignment values (rot, tilt, psi, shiftX, shiftY) of
+        the given rows from their transformation matrices. All the matrices
+        are decoded at once and the values are cached by row id. """
+        for matrixCol in self._matrixColumns.get(tableName, []):
+            cache = self._alignmentValues.setdefault((tableName, matrixCol), {})
+            pending = {}
+            for row in rows:
+                key = self._getAlignmentKey(row, matrixCol)
+                if key not in cache:
+                    pending[key] = row[matrixCol]
+            if not pending:
+                continue
+
+            if len(cache) + len(pending) > ALIGNMENT_CACHE_SIZE:
+                cache.clear()
+            # 2D (3x3) and 3D (4x4) matrices are decoded in separate groups,
+            # by their number of rows (None values are 4x4 identities)
+            groups = {}
+            for key, value in pending.items():
+                size = value.count('[') - 1 if value else 4
+                groups.setdefault(size, {})[key] = value
+
+            for group in groups.values():
+                matrices = Matrix.parseValues(list(group.values()))
+                rot, tilt, psi = numpy.rad2deg(euler_from_matrices(numpy.linalg.inv(matrices), axes='szyz'))
+                # The shifts are in the last column, whatever the size
+                shiftX = matrices[:, 0, -1]
+                shiftY = matrices[:, 1, -1]
+                cache.update(zip(group.keys(),
+                                 zip(rot.tolist(), tilt.tolist(), psi.tolist(),
+                                     shiftX.tolist(), shiftY.tolist())))
+
+    @staticmethod
+    def _getAlignmentKey(row, matrixCol):
+        """ Rows are identified by id, or by the matrix itself when the table
+        has no id column """
+        return row['id'] if 'id' in row else row[matrixCol]
+
+    def _getAlignmentValue(self, tableName, matrixCol, row, position):
+        """ Return the alignment value at position (rot, tilt, psi, shiftX
+        or shiftY) of the row, decoding its matrix if not cached yet """
+        cache = self._alignmentValues.get((tableName, matrixCol), {})
+        key = self._getAlignmentKey(row, matrixCol)
+        if key not in cache:
+            self._decodeAlignments(tableName, [row])
+            cache = self._alignmentValues[(tableName, matrixCol)]
+        return cache[key][position]
 
     def addExternalProgram(self, renderer: ImageRenderer, imageExt: str):
         self.addChimera(renderer, imageExt)
@@ -439,10 +477,24 @@ Stack.setSlice(slice);
         columnLabel = actualColumn if tableName != PROPERTIES_TABLE else table.getColumns()[0].getName()
         mode = 'ASC' if orderAsc else 'DESC'
 
+        kwargs = {'classes': table.getDefinitionTable(), 'orderBy': columnLabel,
+                  'mode': mode, 'limit': limit}
+        # Seek from the last row before the page instead of skipping rows.
+        # The first page is read with the same sorting, ties sorted by id
+        useKeyset = tableName != PROPERTIES_TABLE and table.hasColumnId()
+        if useKeyset:
+            self._checkDataVersion()
+            kwargs['after'] = (self._getPageAnchor(tableName, kwargs['classes'], columnLabel, mode, firstRow - 1)
+                               if firstRow > 0 else ())
+        else:
+            kwargs['start'] = firstRow
+
         hasId = None
-        for rowcount, row in enumerate(self.iterTable(tableName, start=firstRow, limit=limit,
-                                                      classes=table.getDefinitionTable(),
-                                                      orderBy=columnLabel, mode=mode)):
+        lastRow = None
+        # No anchor if the page is beyond the last row
+        rows = list(self.iterTable(tableName, **kwargs)) if kwargs.get('after', ()) is not None else []
+        self._decodeAlignments(tableName, [row for row in rows if row])
+        for rowcount, row in enumerate(rows):
             if row:
                 values = []
 
@@ -462,10 +514,137 @@ Stack.setSlice(slice);
                     idValue = rowcount
 
                 page.addRow((int(idValue), values))
+                lastRow = row
+
+        if useKeyset and lastRow is not None:
+            anchors = self._pageAnchors.setdefault((tableName, columnLabel, mode), {})
+            anchors[firstRow + rowcount] = (lastRow[columnLabel], lastRow['id'])
 
         endTime = time.time()
         logger.debug("Page filled in %f seconds." % (endTime - initTime))
 
+    def _checkDataVersion(self):
+        """ Forget the page anchors if the file has been modified since they
+        were read, e.g. rows added to a streaming set may move the rows to
+        other positions when not sorted by id. """
+        version = self._con.execute("PRAGMA data_version").fetchone()['data_version']
+        if version != self._dataVersion:
+            self._dataVersion = version
+            self._pageAnchors.clear()
+
+    def _getPageAnchor(self, tableName, classes, orderBy, mode, position):
+        """ Return the (value, id) of the row at the given position when
+        sorting by orderBy. They are remembered for the pages already
+        read. Otherwise only the sorting column and the id are read,
+        skipping the rows after the closest anchor before the position.
+        Note that skipping rows is still linear in their number, so jumping
+        far from the pages already read is as slow as an offset. """
+        anchors = self._pageAnchors.setdefault((tableName, orderBy, mode), {})
+        if position not in anchors:
+            self._loadColumnsMap(tableName, classes)
+            column = self._getColumnMap(tableName, orderBy) or orderBy
+            self._createSortIndex(tableName, column)
+            lower = max((p for p in anchors if p < position), default=None)
+            if lower is None:
+                row = self._seekRow(tableName, column, mode, (), position)
+            else:
+                row = self._seekRow(tableName, column, mode, anchors[lower],
+                                    position - lower - 1)
+            if row is None:  # Beyond the last row
+                return None
+            anchors[position] = (row[column], row['id'])
+        return anchors[position]
+
+    def _seekRow(self, tableName, column, mode, after, skip):
+        """ Return the column and id of the row found skipping the given
+        number of rows after the (value, id) given (from the first row if
+        after is empty), or None if there are not so many rows. """
+        value, rowId = after or (None, None)
+        for where in self._getSegments(column, mode, after):
+            query = self._getQuery(tableName, column, mode, where=where, anchor=True)
+            row = self._con.execute(query, (value, rowId, skip)).fetchone()
+            if row is not None:
+                return row
+            # Skip the rows of this segment (fewer than skip) in the next one
+            query = self._getQuery(tableName, column, mode, where=where, count=True)
+            skip -= self._con.execute(query, (value, rowId, skip)).fetchone()['count']
+        return None
+
+    def _getQuery(self, tableName, column, mode, where=None, anchor=False,
+                  count=False):
+        """ Return (and cache) the sql used to read a sorted table. The same
+        sql strings are reused so sqlite keeps them prepared.
+        :param where: condition to seek the rows after a given row, using
+            ?1 for its value and ?2 for its id. Next parameter is the limit.
+        :param anchor: only read the column and id of the row at a given
+            position (offset parameter, instead of the limit)
+        :param count: count the rows, up to the limit
+        """
+        key = (tableName, column, mode, where, anchor, count)
+        if key not in self._queries:
+            selectCols = '*' if not anchor else ('id' if column == 'id' else '%s, id' % column)
+            query = "SELECT %s FROM %s" % (selectCols if not count else '1', tableName)
+            if where:
+                query += " WHERE " + where.format(col=column)
+            if not count:
+                query += " ORDER BY %s %s" % (column, mode)
+                if column != 'id':
+                    query += ", id %s" % mode
+            query += " LIMIT 1 OFFSET ?3" if anchor else " LIMIT ?3"
+            if count:
+                query = "SELECT COUNT(*) AS count FROM (%s)" % query
+            self._queries[key] = query
+        return self._queries[key]
+
+    @staticmethod
+    def _getSegments(column, mode, after):
+        """ Return the conditions of the rows after the (value, id) given,
+        using ?1 for the value and ?2 for the id, in the order they have to
+        be read. NULL values are sorted before any other value, so they are
+        read in a separated query. """
+        value = after[0] if after else None
+        if not after:
+            return [None]
+        elif column == 'id':
+            return ['id > ?2' if mode == 'ASC' else 'id < ?2']
+        elif mode == 'ASC':
+            return (['{col} IS NULL AND id > ?2', '{col} IS NOT NULL'] if value is None
+                    else ['({col}, id) > (?1, ?2)'])
+        else:
+            return (['{col} IS NULL AND id < ?2'] if value is None
+                    else ['({col}, id) < (?1, ?2)', '{col} IS NULL'])
+
+    def _iterAfter(self, tableName, column, mode, after, limit):
+        """ Iterate the rows sorted by column after the (value, id) given,
+        seeking through the index, or from the first row if after is empty
+        (see _getSegments). """
+        value, rowId = after or (None, None)
+        for where in self._getSegments(column, mode, after):
+            query = self._getQuery(tableName, column, mode, where=where)
+            res = self._con.execute(query, (value, rowId, limit))
+            while row := res.fetchone():
+                limit -= 1
+                yield row
+            if limit == 0:
+                break
+
+    def _createSortIndex(self, tableName, column):
+        """ Create, once, an index to sort the table by the given column
+        if the file can be written. Sets already have some of them. """
+        if column == 'id' or (tableName, column) in self._sortIndexes:
+            return
+        self._sortIndexes.add((tableName, column))
+        if not os.access(self._file, os.W_OK):
+            return
+        try:
+            con = sqlite3.connect(self._file, timeout=1)
+            con.execute("CREATE INDEX IF NOT EXISTS index_mdviewer_%s_%s ON %s (%s, id)"
+                        % (tableName, column, tableName, column))
+            con.commit()
+            con.close()
+        except Exception as e:
+            logger.debug("Could not create the index for %s in %s: %s" % (column, tableName, e))
+
     def getRowsCount(self, tableName):
         """ Return the number of elements in the given table. """
         logger.debug("Reading the table %s" % tableName)
@@ -492,8 +671,10 @@ Stack.setSlice(slice);
         col = self._getColumnMap(tableName, column)
         if col == None:
             col = column
+        # Same order than the pages, ties sorted by id
+        orderBy = col if col == 'id' else '%s %s, id' % (col, mode)
         query = "SELECT id FROM %s ORDER BY %s %s LIMIT %d , %d" % (
-            tableName, col, mode, startRow - 1, numberOfRows + 1)
+            tableName, orderBy, mode, startRow - 1, numberOfRows + 1)
         rowsList = self._con.execute(query).fetchall()
         rowsIds = [row['id'] for row in rowsList]
         return rowsIds
@@ -550,74 +731,100 @@ Stack.setSlice(slice);
         :param kwargs:
                 limit: integer value to limit the number of elements
                 start: start from a given element
+                after: (value, id) of the row after which to start when
+                       sorting by orderBy (seek instead of skipping rows),
+                       or () to start from the first row. Rows with the
+                       same value are sorted by id
                 classes: read column names from a 'classes' table
                 orderBy: clause to sort given a column name
                 mode: sort direction ASC or DESC
         """
-        query = f"SELECT * FROM {tableName}"
+        hasClasses = 'classes' in kwargs and kwargs['classes'] != PROPERTIES_TABLE
+        if hasClasses:
+            self._loadColumnsMap(tableName, kwargs['classes'])
+
+        if 'after' in kwargs:
+            column = self._getColumnMap(tableName, kwargs['orderBy']) or kwargs['orderBy']
+            self._createSortIndex(tableName, column)
+            query = None
+        else:
+            query = f"SELECT * FROM {tableName}"
+
+            if 'mode' in kwargs:
+                orderBy = kwargs.get('orderBy', '')
+                if orderBy:
+                    column = self._getColumnMap(tableName, orderBy)
+                    if not column:
+                        column = orderBy
 
-        if 'mode' in kwargs:
-            orderBy = kwargs.get('orderBy', '')
-            if orderBy:
-                column = self._getColumnMap(tableName, orderBy)
-                if not column:
-                    column = orderBy
+                    query += f" ORDER BY {column}"
 
-                query += f" ORDER BY {column}"
+                if kwargs['mode']:
+                    query += f" {kwargs['mode']}"
 
-            if kwargs['mode']:
-                query += f" {kwargs['mode']}"
+            if 'start' in kwargs and 'limit' not in kwargs:
+                kwargs['limit'] = -1
 
-        if 'start' in kwargs and 'limit' not in kwargs:
-            kwargs['limit'] = -1
+            if 'limit' in kwargs:
+                query += f" LIMIT {kwargs['limit']}"
 
-        if 'limit' in kwargs:
-            query += f" LIMIT {kwargs['limit']}"
+            if 'start' in kwargs:
+                query += f" OFFSET {kwargs['start']}"
 
-        if 'start' in kwargs:
-            query += f" OFFSET {kwargs['start']}"
+        def _iterRows():
+            if query is None:
+                yield from self._iterAfter(tableName, column, kwargs.get('mode') or 'ASC',
+                                           kwargs['after'], kwargs.get('limit', -1))
+            else:
+                res = self._con.execute(query)
+                while row := res.fetchone():
+                    yield row
 
         # Properties Table
-        if 'classes' not in kwargs or kwargs['classes'] == PROPERTIES_TABLE:
-            res = self._con.execute(query)
-            while row := res.fetchone():
-                yield row
+        if not hasClasses:
+            yield from _iterRows()
         else:  # Mapping the column names and  including only the allowed columns
-
-            self._columnsMap[tableName] = {}
-            self._excludedColumns = {}
-
-            for row in self.iterTable(kwargs['classes']):
-
-                colName = row['column_name']
-                colType = row['label_property']
-
-                if row['class_name'] in ALLOWED_COLUMNS_TYPES:
-                    self._columnsMap[tableName][colName] = colType
-                else:
-                    self._excludedColumns[colName] = colType
+            columnsMap = self._columnsMap[tableName]
+            excludedColumns = self._excludedColumns[tableName]
 
             def _row_factory(cursor, row):
                 fields = [column[0] for column in cursor.description]
-                rowFact = {self._columnsMap[tableName].get(k, k): v for k, v in zip(fields, row) if
-                           k not in self._excludedColumns}
+                rowFact = {columnsMap.get(k, k): v for k, v in zip(fields, row) if
+                           k not in excludedColumns}
                 return rowFact
 
             # Modify row factory to modify column names
             self._con.row_factory = _row_factory
-            res = self._con.execute(query)
-            while row := res.fetchone():
-                yield row
+            yield from _iterRows()
             # Restore row factory
             self._con.row_factory = self._dictFactory
 
+    def _loadColumnsMap(self, tableName, classes):
+        """ Read, once per table, the mapping of the column names from the
+        'classes' table, including only the allowed columns """
+        if tableName in self._columnsMap:
+            return
+
+        columnsMap = {}
+        excludedColumns = {}
+
+        for row in self.iterTable(classes):
+
+            colName = row['column_name']
+            colType = row['label_property']
+
+            if row['class_name'] in ALLOWED_COLUMNS_TYPES:
+                columnsMap[colName] = colType
+            else:
+                excludedColumns[colName] = colType
+
+        self._columnsMap[tableName] = columnsMap
+        self._excludedColumns[tableName] = excludedColumns
+        self._columnsReverseMap[tableName] = {v: k for k, v in columnsMap.items()}
+
     def _getColumnMap(self, tableName, column):
         """Get the column name that has been mapped"""
-        if tableName in self._columnsMap:
-            for key, value in self._columnsMap[tableName].items():
-                if value == column:
-                    return key
-        return None
+        return self._columnsReverseMap.get(tableName, {}).get(column)
 
     def getTableRow(self, tableName, rowIndex, **kwargs):
         """ Get a given row by index. Extra args are passed to iterTable. """
@@ -24,8 +24,11 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # **************************************************************************
+import json
 import logging
-import time
+import os
+
+import numpy
 
 from metadataviewer.model import Table
 
@@ -33,22 +36,39 @@ logger = logging.getLogger()
 
 from metadataviewer.dao.model import IDAO
 
+ROWS_BLOCK_SIZE = 1024  # Number of rows between two stored offsets
+INDEX_EXTENSION = '.mdidx'
+INDEX_VERSION = 2  # Bump when the stored index layout or counting changes
+
 
 class StarFile(IDAO):
     """
     Class to handle STAR or XMD files.
+    The file is read once to store the labels of every data block and the
+    byte offset of each block of rows. Rows are then read lazily when a page
+    is requested, and the tables are sorted loading only the sorting column.
     """
-    def __init__(self, inputFile):
+    def __init__(self, inputFile, persistIndex=False):
+        """
+        :param inputFile: STAR or XMD file
+        :param persistIndex: store the offsets found in a sidecar file
+            (inputFile + .mdidx) so next time the file is opened faster
+        """
+        self._fileName = inputFile
+        self._persistIndex = persistIndex
         self._file = self.__loadFile(inputFile)
         self._tableCount = {}
-        self._tableData = {}
+        self._blockOffsets = {}  # {tableName: offsets of every ROWS_BLOCK_SIZE rows}
+        self._firstRows = {}
         self._labels = {}
         self._tables = {}
         self._labelsTypes = {}
+        self._rowOffsets = {}  # {tableName: offset of every row}, only when sorted
+        self._sortOrder = {}  # {tableName: row indexes in sorted order}
 
     def __loadFile(self, inputFile):
         try:
-            return open(inputFile, 'r')
+            return open(inputFile, 'rb')
         except Exception as e:
             logger.error("The file could not be opened. Make sure the path is "
                          "correct: \n %s" % e)
@@ -86,106 +106,176 @@ class StarFile(IDAO):
 
     def getTables(self):
         """ Return all the names of the data_ blocks found in the file and
-            fill all labels and data of every table name """
+            fill the labels and the rows offsets of every table name """
         if not self._tables:
-            f = self._file
-            line = f.readline()
-            logger.debug("Reading the star file completely and filling "
-                         "the model().")
-            while line:
-                # While searching for a data line, we will store the offsets
-                # for any data_ line that we find
-                if line.startswith('data_'):
-                    table = line.strip()
-                    alias = table.replace('data_', '')
-                    tbl = Table(table)
-                    tbl.setAlias(alias)
-                    self._tables[table] = tbl
-                    data = self._getData()
-                    self._tableCount[table] = data[0]
-                    self._labels[table] = ['id'] + data[1]
-                    self._labelsTypes[table] = data[2]
-                    self._tableData[table] = data[3]
-                line = f.readline()
+            if not self._loadIndex():
+                logger.debug("Indexing the star file.")
+                self._indexFile()
+                if self._persistIndex:
+                    self._writeIndex()
+
+            for tableName in self._labels:
+                tbl = Table(tableName)
+                tbl.setAlias(tableName.replace('data_', ''))
+                self._tables[tableName] = tbl
+                firstRow = self._firstRows[tableName]
+                self._labelsTypes[tableName] = [int] + [_guessType(value) for value in firstRow[1:]]
 
         return self._tables
 
-    def _getData(self):
-        """ Method to get all information of the table (labels, data,...)"""
-        self._findLabelLine()
-        data = []
-        line, labels = self._getLabels()
-        count = 0
+    def _indexFile(self):
+        """ Read the file once, storing for every data block its labels, its
+        first row and the offset of every block of rows. """
         f = self._file
-        firstRow = line.split()
-        labelsTypes = [int]
-        for i in range(len(firstRow)):
-            labelsTypes.append(_guessType(firstRow[i]))
-
-        while line and not line.startswith('\n'):
-            line = str(count+1) + ' ' + line
-            data.append(line.split())
-            count += 1
-            line = f.readline().strip()
-        return count, labels, labelsTypes, data
-
-    def _getLabels(self):
-        """Get the table labels"""
-        logger.debug("Getting the table labels...")
-        line = self._line
-        labels = []
-        while line.startswith('\n'):
-            line = self._file.readline()
-        while line.startswith('_'):
-            parts = line.split()
-            labels.append(parts[0][1:])
-            line = self._file.readline().lstrip()
-        while line.startswith('\n'):
-            line = self._file.readline()
-        return line, labels
+        f.seek(0)
+        offset = 0
+        tableName = None
+        labels, values = [], []
+        isLoop = False
+        rowsEnded = False
+        count = 0
+        offsets = []
+
+        def _closeTable():
+            if tableName is None:
+                return
+            if isLoop:
+                rowCount = count
+            else:  # Label-value pairs make a single row
+                rowCount = 1
+                self._firstRows[tableName] = ['1'] + values
+                offsets.clear()
+            if tableName not in self._firstRows:
+                self._firstRows[tableName] = [''] * (len(labels) + 1)
+            self._labels[tableName] = ['id'] + labels
+            self._tableCount[tableName] = rowCount
+            self._blockOffsets[tableName] = offsets
+
+        for line in f:
+            lineOffset = offset
+            offset += len(line)
+            line = line.strip()
+            if line.startswith(b'data_'):
+                _closeTable()
+                tableName = line.decode()
+                labels, values, offsets = [], [], []
+                isLoop = False
+                rowsEnded = False
+                count = 0
+            elif tableName is None or rowsEnded or line.startswith(b'#'):
+                continue
+            elif not line:
+                # A blank line ends the rows, as in _iterTableLines
+                rowsEnded = isLoop and count > 0
+            elif line.startswith(b'loop_'):
+                isLoop = True
+            elif line.startswith(b'_') and not count:
+                parts = line.decode().split()
+                labels.append(parts[0][1:])
+                if not isLoop and len(parts) > 1:
+                    values.append(parts[1])
+            elif isLoop:
+                if count % ROWS_BLOCK_SIZE == 0:
+                    offsets.append(lineOffset)
+                if not count:
+                    self._firstRows[tableName] = ['1'] + line.decode().split()
+                count += 1
+        _closeTable()
+
+    def _getIndexFile(self):
+        return self._fileName + INDEX_EXTENSION
+
+    def _loadIndex(self):
+        """ Load the offsets from the sidecar index file if it exists and it
+        is newer than the star file. Returns True if loaded. """
+        indexFile = self._getIndexFile()
+        try:
+            if os.path.getmtime(indexFile) < os.path.getmtime(self._fileName):
+                return False
+            with open(indexFile) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if (index.get('version') != INDEX_VERSION or
+                index.get('blockSize') != ROWS_BLOCK_SIZE):
+            return False
+        for tableName, tableIndex in index['tables'].items():
+            self._labels[tableName] = tableIndex['labels']
+            self._tableCount[tableName] = tableIndex['count']
+            self._firstRows[tableName] = tableIndex['firstRow']
+            self._blockOffsets[tableName] = tableIndex['offsets']
+        return True
+
+    def _writeIndex(self):
+        """ Store the offsets in the sidecar index file. """
+        tables = {tableName: {'labels': self._labels[tableName],
+                              'count': self._tableCount[tableName],
+                              'firstRow': self._firstRows[tableName],
+                              'offsets': self._blockOffsets[tableName]}
+                  for tableName in self._labels}
+        try:
+            with open(self._getIndexFile(), 'w') as f:
+                json.dump({'version': INDEX_VERSION,
+                           'blockSize': ROWS_BLOCK_SIZE,
+                           'tables': tables}, f)
+        except OSError as e:
+            logger.debug("The star file index could not be written: %s" % e)
 
     def _loadStarFileInfo(self, table):
         """Create the table structure"""
         logger.debug("Creating the table columns...")
         colNames = self._labels[table.getName()]
-        data = self._tableData[table.getName()]
-        
-        if len(data) > 0:
-            firstRow = data[0]
-        else:
-            firstRow = ['']*len(colNames)
-        
-        table.createColumns(colNames, firstRow)
+        table.createColumns(colNames, self._firstRows[table.getName()])
         table.setAlias(table.getAlias())
 
-    def _findLabelLine(self):
-        """Find the first labels line in the star file"""
-        line = ''
-        foundLoop = False
-
-        rawLine = self._file.readline()
-        while rawLine:
-            rawLine = rawLine.lstrip()
-            if rawLine.startswith('_'):
-                line = rawLine
-                break
-            elif rawLine.startswith('loop_'):
-                foundLoop = True
-            rawLine = self._file.readline()
-
-        self._line = line.strip()
-        self._foundLoop = foundLoop
+    def _iterTableLines(self, tableName, firstRow=0):
+        """ Iterate over the (offset, line) of the table rows, starting at
+        firstRow. The file is read from the closest stored offset """
+        offsets = self._blockOffsets[tableName]
+        block = firstRow // ROWS_BLOCK_SIZE
+        if block >= len(offsets):
+            return
+        f = self._file
+        f.seek(offsets[block])
+        offset = offsets[block]
+        skip = firstRow - block * ROWS_BLOCK_SIZE
+        for line in f:
+            lineOffset = offset
+            offset += len(line)
+            line = line.strip()
+            if not line or line.startswith(b'data_'):
+                return
+            if line.startswith(b'#'):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield lineOffset, line
+
+    def _readRow(self, tableName, rowIndex, line):
+        """ Return the (id, values) of a row. Ids are the row position in the file """
+        rowId = rowIndex + 1
+        return rowId, [str(rowId)] + line.decode().split()
 
     def _iterRowLines(self, tableName, firstRow, endRow):
         """Iter over the table in a range of rows """
-        if self._tableCount[tableName] == 1:
-            yield 1, self._tableData[tableName][0]
+        if self._tableCount[tableName] == 1 and not self._blockOffsets[tableName]:
+            yield 1, self._firstRows[tableName]
             return
-        if firstRow + endRow > self._tableCount[tableName]:
-            endRow = self._tableCount[tableName]
-        for i in range(firstRow, endRow):
-            values = self._tableData[tableName][i]
-            yield int(values[0]), values
+        endRow = min(endRow, self._tableCount[tableName])
+        order = self._sortOrder.get(tableName)
+
+        if order is None:
+            rows = self._iterTableLines(tableName, firstRow)
+            for rowIndex, (_, line) in zip(range(firstRow, endRow), rows):
+                yield self._readRow(tableName, rowIndex, line)
+        else:
+            rowOffsets = self._rowOffsets[tableName]
+            f = self._file
+            for rowIndex in order[firstRow:endRow].tolist():
+                f.seek(rowOffsets[rowIndex])
+                yield self._readRow(tableName, rowIndex, f.readline().strip())
 
     def close(self):
         if getattr(self, '_file', None):
@@ -199,26 +289,64 @@ class StarFile(IDAO):
         return ['star', 'xmd']
 
     def sort(self, tableName, column, sortAsc=True):
-        """ Sort the table in place using the provided column.
+        """ Sort the table using the provided column. Only the values of that
+            column (and the rows offsets) are loaded.
             :param column is a number, it is the index of one column. """
-        _columType = self._labelsTypes[tableName][column]
-        orderList = sorted(self._tableData[tableName],
-                           key=lambda x: _columType(x[column]),
-                           reverse=not sortAsc)
-        self._tableData[tableName] = orderList
+        count = self._tableCount[tableName]
+        if column == 0 or count <= 1 or not self._blockOffsets[tableName]:
+            # Rows are already sorted by id
+            self._sortOrder[tableName] = (None if sortAsc
+                                          else numpy.arange(count - 1, -1, -1))
+            self._loadRowOffsets(tableName)
+            return
+
+        values = self._loadColumn(tableName, column)
+        if sortAsc:
+            order = numpy.argsort(values, kind='stable')
+        else:  # Descending, keeping the file order for equal values
+            order = count - 1 - numpy.argsort(values[::-1], kind='stable')[::-1]
+        self._sortOrder[tableName] = order
+
+    def _loadRowOffsets(self, tableName):
+        """ Store the offset of every row of the table, needed to read the
+        rows once sorted """
+        if tableName not in self._rowOffsets and self._blockOffsets[tableName]:
+            self._rowOffsets[tableName] = numpy.fromiter(
+                (offset for offset, _ in self._iterTableLines(tableName)),
+                dtype=numpy.int64, count=self._tableCount[tableName])
+
+    def _loadColumn(self, tableName, column):
+        """ Return a typed array with the values of a column of the table.
+        The rows offsets are stored in the same pass. """
+        count = self._tableCount[tableName]
+        position = column - 1  # id column is not in the file
+        loadOffsets = tableName not in self._rowOffsets
+        offsets = numpy.empty(count, dtype=numpy.int64) if loadOffsets else None
+        values = []
+        for rowIndex, (offset, line) in enumerate(self._iterTableLines(tableName)):
+            if loadOffsets:
+                offsets[rowIndex] = offset
+            values.append(line.split(None, position + 1)[position].decode())
+        if loadOffsets:
+            self._rowOffsets[tableName] = offsets
+
+        if self._labelsTypes[tableName][column] is not str:
+            try:
+                return numpy.array(values, dtype=numpy.float64)
+            except ValueError:
+                pass
+        return numpy.array(values)
 
     def getSelectedRangeRowsIds(self, tableName, startRow, numberOfRows, column, reverse=True):
         """Return a range of rows starting at 'startRow' an amount of
            'numberOfRows' """
         logger.debug("Reading the table %s and selected a range of rows %d - %d" % (tableName, startRow+1, numberOfRows + 1))
-        col = 0
-        for i in range(len(self._labels[tableName])):
-            if self._labels[tableName][i] == 'id':
-                col = i
-                break
-        table = self._tableData[tableName]
-        rowsIds = [int(table[row][col]) for row in range(startRow-1, startRow+numberOfRows)]
-        return rowsIds
+        first = max(startRow - 1, 0)
+        end = min(startRow + numberOfRows, self._tableCount[tableName])
+        order = self._sortOrder.get(tableName)
+        if order is None:
+            return list(range(first + 1, end + 1))
+        return (order[first:end] + 1).tolist()
 
     def getTableWithAdditionalInfo(self):
         """Return a tuple with the table that need to show additional info and
@@ -238,8 +366,3 @@ def _guessType(strValue):
             return float
         except ValueError:
             return str
-
-
-
-
-
@@ -33,12 +33,14 @@ import numpy as np
 import matplotlib.cm as cm
 from scipy.ndimage.filters import gaussian_filter
 
-from pwem.convert.transformations import euler_from_matrix
+from pwem.convert.transformations import (euler_from_matrix, euler_from_matrices,
+                                          euler_direction)
 from pyworkflow.gui.plotter import Plotter, plt
 import pwem.emlib.metadata as md
 import numbers
 from math import atan2, sqrt, pi
 from pwem import emlib
+from pwem.objects import SetOfImages
 
 PLOT_EULER_ANGLES = 1
 PLOT_PROJ_ANGLES = 2
@@ -88,7 +90,7 @@ class EmPlotter(Plotter):
 
         ax =self.createSubPlot(title, xlabel=None, ylabel=None, projection='3d', subtitle=subtitle)
         ax.set_box_aspect(aspect=(1, 1, 1))
-        sc = ax.scatter(x, y, z, markerSize,c=markerSize, s=60, cmap=colormap, alpha=1)
+        sc = ax.scatter(x, y, z, c=markerSize, s=60, cmap=colormap, alpha=1)
         plt.colorbar(sc)
 
 
@@ -135,10 +137,15 @@ class EmPlotter(Plotter):
             thetas.append(rot)
             phis.append(tilt)
 
-        thetas.append(-180)
-        thetas.append(180)
-        phis.append(0)
-        phis.append(180)
+        return self.plotAngularDistributionHistogramFromAngles(title, thetas, phis,
+                                                               colormap=colormap, subtitle=subtitle)
+
+    def plotAngularDistributionHistogramFromAngles(self, title, rots, tilts, colormap=cm.jet, subtitle=None):
+        """ Same as plotAngularDistributionHistogram but receiving the rot
+        and tilt angles (in degrees) instead of the data. """
+
+        thetas = np.append(np.asarray(rots, dtype=float), [-180, 180])
+        phis = np.append(np.asarray(tilts, dtype=float), [0, 180])
 
         heatmap, xedges, yedges = np.histogram2d(thetas, phis, bins=1000)
         sigma = min(max(xedges) - min(xedges), max(yedges) - min(yedges)) / 20
@@ -163,6 +170,13 @@ class EmPlotter(Plotter):
                  :param colormap: matplotlib color map
                 """
 
+        # Sets stored in sqlite are read as columns, without building the items
+        if isinstance(mdSet, SetOfImages):
+            _, matrices = mdSet.getTransformMatrices()
+            rots, tilts, _ = self.eulerAnglesFromMatrices(matrices)
+            return self.plotAngularDistributionFromAngles(rots, tilts, title, type, colormap,
+                                                          subtitle=subtitle, **kwargs)
+
         def eulerAnglesGetter (item):
 
             matrix = item.getTransform().getRotationMatrix()
@@ -178,6 +192,19 @@ class EmPlotter(Plotter):
 
         self.plotAngularDistributionBase(mdSet, eulerAnglesGetter, title, type, colormap, subtitle=subtitle,**kwargs)
 
+    @staticmethod
+    def eulerAnglesFromMatrices(matrices):
+        """ Returns the rot, tilt and psi arrays (in degrees) of the projection
+        directions given by a stack of transformation matrices of shape
+        (N, 4, 4), with tilt in the [0, 180] range. """
+        matricesI = np.linalg.inv(np.asarray(matrices)[:, :3, :3])
+        rots, tilts, psis = euler_from_matrices(matricesI, axes='szyz')
+
+        negTilt = tilts < 0
+        tilts[negTilt] = -tilts[negTilt]
+        rots[negTilt] = -rots[negTilt]
+
+        return np.degrees(rots), np.degrees(tilts), np.degrees(psis)
 
     def plotAngularDistributionBase(self, data, eulerAnglesGetterCallback, title,
                                     type=PLOT_PROJ_ANGLES, colormap=cm.jet, subtitle="", **kwargs):
@@ -192,59 +219,64 @@ class EmPlotter(Plotter):
          :param subtitle: subtitle of the plot
         """
 
-        if type==PLOT_EULER_ANGLES:
-            return self.plotAngularDistributionHistogram(title, data , eulerAnglesGetterCallback,
-                                                         colormap=colormap, subtitle=subtitle)
+        rots =[]
+        tilts= []
 
-        else:
+        # Get the euler angles
+        for item in data:
+            rot, tilt, psi = eulerAnglesGetterCallback(item)
+            rots.append(rot)
+            tilts.append(tilt)
 
-            rots =[]
-            tilts= []
+        return self.plotAngularDistributionFromAngles(rots, tilts, title, type, colormap,
+                                                      subtitle=subtitle, **kwargs)
+
+    def plotAngularDistributionFromAngles(self, rots, tilts, title,
+                                          type=PLOT_PROJ_ANGLES, colormap=cm.jet, subtitle="", **kwargs):
+        """ Plot the histogram or the angular distribution of the
+         rot and tilt angles (in degrees).
+
+         :param type: 1 for histogram, 2 for polar plot, 3 for 3d plot
+        """
 
-            # Get the euler angles
-            for item in data:
-                rot, tilt, psi = eulerAnglesGetterCallback(item)
-                rots.append(rot)
-                tilts.append(tilt)
+        if type==PLOT_EULER_ANGLES:
+            return self.plotAngularDistributionHistogramFromAngles(title, rots, tilts,
+                                                                   colormap=colormap, subtitle=subtitle)
 
-            if type==PLOT_PROJ_ANGLES:
-                # Weight (group) rots and tilts
-                rots, tilts, weights = self.weightEulerAngles(rots, tilts, rotInRadians=type == PLOT_PROJ_ANGLES)
+        elif type==PLOT_PROJ_ANGLES:
+            # Weight (group) rots and tilts
+            rots, tilts, weights = self.weightEulerAngles(rots, tilts, rotInRadians=type == PLOT_PROJ_ANGLES)
 
-                return self.plotAngularDistribution(title, rots, tilts, weight=weights, colormap=colormap, subtitle=subtitle, **kwargs)
+            return self.plotAngularDistribution(title, rots, tilts, weight=weights, colormap=colormap, subtitle=subtitle, **kwargs)
 
-            else:
-                # Create discrete point of a fibonacci sphere (5000 points)
-                fiSph = FibonacciSphere()
+        else:
+            # Create discrete point of a fibonacci sphere (5000 points)
+            fiSph = FibonacciSphere()
 
-                Xs, Ys, Zs = self._anglesToSphereCoords(rots, tilts)
+            Xs, Ys, Zs = self._anglesToSphereCoords(rots, tilts)
 
-                for  x,y,z in zip(Xs,Ys,Zs):
-                    fiSph.append(x,y,z)
+            fiSph.appendMany(np.column_stack((Xs, Ys, Zs)))
 
-                fiSph.cleanWeights()
+            fiSph.cleanWeights()
 
-                return self.plotAngularDistribution3D(title, fiSph.sphX, fiSph.sphY, fiSph.sphZ,
-                                                      fiSph.weights, subtitle,colormap=colormap)
+            return self.plotAngularDistribution3D(title, fiSph.sphX, fiSph.sphY, fiSph.sphZ,
+                                                  fiSph.weights, subtitle,colormap=colormap)
 
-    def weightEulerAngles(self, rots, tilts, delta=3, rotInRadians=False):
+    @staticmethod
+    def weightEulerAngles(rots, tilts, delta=3, rotInRadians=False):
         """ Receives the list of rots and tilts angles (in deg) and returns
          a reduced list of rots, tilts and weights lists
 
-         :param rotCaster: method that receives the rot in degrees and returns it converted to something else, radians?"""
+         Each angle is grouped with the first projection found within delta
+         degrees in both rot and tilt, otherwise it becomes a new projection.
+         Projections are hashed in a grid of delta-sized cells so only the
+         neighbour cells are searched for each angle.
 
-        # Holds pairs of rot, tilt
-        projectionList = []
+         :param rotInRadians: if True, returned rots are converted to radians"""
 
-        def getCloseProjectionIndex(angleRot, angleTilt):
-            """ Get an existing projection close to angleRot, angleTilt.
-            Return None if not found close enough.
-            """
-            for index, projection in enumerate(projectionList):
-                if (abs(projection[0] - angleRot) <= delta and
-                        abs(projection[1] - angleTilt) <= delta):
-                    return index
-            return None
+        # Maps (rotCell, tiltCell) to the indexes of the projections in it
+        cellSize = delta if delta > 0 else 1
+        grid = {}
 
         weight = 1 #1. / len(rots)
 
@@ -252,42 +284,46 @@ class EmPlotter(Plotter):
         new_tilts = []
         weights = []
 
-        if rotInRadians:
-            rotCaster = np.radians
-        else:
-            rotCaster = lambda rot: rot
+        rotsArray = np.asarray(rots, dtype=float)
+        tiltsArray = np.asarray(tilts, dtype=float)
+        rotCells = np.floor(rotsArray / cellSize).astype(np.int64)
+        tiltCells = np.floor(tiltsArray / cellSize).astype(np.int64)
 
         # Weight the rots and tilts
-        for rot, tilt in zip(rots, tilts):
-            projectionIndex = getCloseProjectionIndex(rot, tilt)
+        for rot, tilt, rotCell, tiltCell in zip(rotsArray.tolist(),
+                                                tiltsArray.tolist(),
+                                                rotCells.tolist(),
+                                                tiltCells.tolist()):
+            projectionIndex = None
+
+            # Keep the oldest close projection, as a sequential search would
+            for i in (rotCell - 1, rotCell, rotCell + 1):
+                for j in (tiltCell - 1, tiltCell, tiltCell + 1):
+                    for index in grid.get((i, j), ()):
+                        if ((projectionIndex is None or index < projectionIndex) and
+                                abs(new_rots[index] - rot) <= delta and
+                                abs(new_tilts[index] - tilt) <= delta):
+                            projectionIndex = index
+                            break
 
             if projectionIndex is None:
-                projectionList.append([rot, tilt])
-                new_rots.append(rotCaster(rot))
+                grid.setdefault((rotCell, tiltCell), []).append(len(new_rots))
+                new_rots.append(rot)
                 new_tilts.append(tilt)
                 weights.append(weight)
             else:
                 weights[projectionIndex] += weight
 
+        if rotInRadians:
+            new_rots = np.radians(new_rots).tolist()
+
         return new_rots, new_tilts, weights
 
     def _anglesToSphereCoords(self, rots, tilts):
         """ Converts euler angles (rot and tilts) to spherical coordinates."""
 
-        X=[]
-        Y=[]
-        Z=[]
-
-        for rot, tilt in zip(rots, tilts):
-
-            # Converts to euler direction
-            x, y, z = emlib.Euler_direction(rot, tilt, 0)
-
-            X.append(x)
-            Y.append(y)
-            Z.append(z)
-
-        return X, Y, Z
+        # Converts to euler direction
+        return euler_direction(rots, tilts)
 
     def plotAngularDistributionFromMd(self, mdFile, title, **kwargs):
         """ Read the values of rot, tilt and weights from